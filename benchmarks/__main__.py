@@ -0,0 +1,86 @@
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import click
+
+from benchmarks.harness import Result
+from benchmarks.harness import compare
+from benchmarks.harness import save
+from benchmarks.scenarios import SCENARIOS
+from benchmarks.scenarios import Config
+
+BASELINES_DIR = Path(__file__).parent.parent / ".benchmarks"
+
+
+def _ints(value: str) -> tuple[int, ...]:
+    return tuple(int(v.replace("_", "")) for v in value.split(","))
+
+
+@click.command()
+@click.argument("scenarios", nargs=-1, type=click.Choice(list(SCENARIOS)))
+@click.option("--rows", default="1000,100000", help="Comma separated numbers of cached items.")
+@click.option("--value-sizes", default="64,4096", help="Comma separated value sizes in bytes.")
+@click.option("--threads", default="1,4,16", help="Comma separated numbers of threads.")
+@click.option("--processes", default="1,4", help="Comma separated numbers of processes.")
+@click.option("--shards", default="1,4", help="Comma separated numbers of shards.")
+@click.option("--iterations", default=1000, help="Operations per thread or process.")
+@click.option("--max-bytes", default=2**30, help="Skip caches larger than this many bytes.")
+@click.option("--save", "save_as", default=None, help="Save results as a named baseline.")
+@click.option("--compare", "compare_to", default=None, help="Compare with a named baseline.")
+@click.option("--tolerance", default=0.1, help="Allowed fraction of regression.")
+def main(
+    scenarios: tuple[str, ...],
+    rows: str,
+    value_sizes: str,
+    threads: str,
+    processes: str,
+    shards: str,
+    iterations: int,
+    max_bytes: int,
+    save_as: str | None,
+    compare_to: str | None,
+    tolerance: float,
+) -> None:
+    """Run benchmarks and optionally save or compare them with a baseline."""
+    config = Config(
+        rows=_ints(rows),
+        value_sizes=_ints(value_sizes),
+        threads=_ints(threads),
+        processes=_ints(processes),
+        shards=_ints(shards),
+        iterations=iterations,
+        max_bytes=max_bytes,
+    )
+
+    results: list[Result] = []
+    with TemporaryDirectory() as directory:
+        for name in scenarios or SCENARIOS:
+            for result in SCENARIOS[name](config, Path(directory)):
+                results.append(result)
+                latencies = " ".join(f"{k}={v:.1f}us" for k, v in result.latencies.items())
+                click.echo(f"{result.key}: {result.throughput:,.0f} ops/s {latencies}")
+
+    if save_as is not None:
+        save(results, BASELINES_DIR / f"{save_as}.json")
+        click.echo(f"Saved baseline {save_as!r}")
+
+    if compare_to is not None:
+        comparisons = compare(results, BASELINES_DIR / f"{compare_to}.json")
+        regressions = 0
+        for c in comparisons:
+            regressed = c.regressed(tolerance)
+            regressions += regressed
+            click.echo(
+                click.style(
+                    f"{c.key}: throughput x{c.throughput_ratio:.2f} p99 x{c.p99_ratio:.2f}",
+                    fg="red" if regressed else None,
+                )
+            )
+        if regressions:
+            click.echo(f"{regressions} benchmark(s) regressed compared to {compare_to!r}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
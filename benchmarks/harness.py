@@ -0,0 +1,133 @@
+import json
+import statistics
+import time
+from collections.abc import Callable
+from collections.abc import Iterable
+from collections.abc import Mapping
+from pathlib import Path
+from threading import Barrier
+from threading import Thread
+from typing import Any
+from typing import NamedTuple
+
+
+class Result(NamedTuple):
+    """The measurements of one benchmark."""
+
+    name: str
+    """The name of the scenario."""
+    params: Mapping[str, Any]
+    """The parameters the scenario was run with."""
+    ops: int
+    """The number of operations performed."""
+    seconds: float
+    """The wall clock time it took to perform all operations."""
+    latencies: Mapping[str, float]
+    """Percentiles of the latency of each operation in microseconds."""
+
+    @property
+    def key(self) -> str:
+        """Identifies the benchmark so it can be compared with a baseline."""
+        params = ",".join(f"{k}={v}" for k, v in sorted(self.params.items()))
+        return f"{self.name}[{params}]"
+
+    @property
+    def throughput(self) -> float:
+        """Operations per second."""
+        return self.ops / self.seconds if self.seconds else float("inf")
+
+
+def measure(
+    name: str,
+    params: Mapping[str, Any],
+    op: Callable[[int], object],
+    *,
+    iterations: int,
+    threads: int = 1,
+) -> Result:
+    """Measure an operation by calling it `iterations` times in each of the given threads.
+
+    The operation is passed the index of the call so it can vary its inputs.
+    """
+    barrier = Barrier(threads + 1)
+    latencies: list[list[int]] = [[] for _ in range(threads)]
+
+    def worker(sink: list[int]) -> None:
+        barrier.wait()
+        for i in range(iterations):
+            start = time.perf_counter_ns()
+            op(i)
+            sink.append(time.perf_counter_ns() - start)
+
+    workers = [Thread(target=worker, args=(sink,)) for sink in latencies]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in workers:
+        t.join()
+    seconds = time.perf_counter() - start
+
+    return Result(
+        name=name,
+        params=params,
+        ops=iterations * threads,
+        seconds=seconds,
+        latencies=summarize([n for sink in latencies for n in sink]),
+    )
+
+
+def summarize(latencies_ns: Iterable[int]) -> dict[str, float]:
+    """Compute latency percentiles (in microseconds) from latencies in nanoseconds."""
+    ordered = sorted(latencies_ns)
+    if not ordered:
+        return {}
+    quantiles = statistics.quantiles(ordered, n=100, method="inclusive")
+    return {
+        "p50": quantiles[49] / 1000,
+        "p90": quantiles[89] / 1000,
+        "p99": quantiles[98] / 1000,
+        "max": ordered[-1] / 1000,
+    }
+
+
+def save(results: Iterable[Result], path: Path) -> None:
+    """Save results as a baseline for later comparison."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = {
+        r.key: {"ops": r.ops, "seconds": r.seconds, "latencies": dict(r.latencies)} for r in results
+    }
+    path.write_text(json.dumps(data, indent=2, sort_keys=True))
+
+
+class Comparison(NamedTuple):
+    """How a result compares to its baseline."""
+
+    key: str
+    throughput_ratio: float
+    """New throughput divided by the baseline's (lower is worse)."""
+    p99_ratio: float
+    """New 99th percentile latency divided by the baseline's (higher is worse)."""
+
+    def regressed(self, tolerance: float) -> bool:
+        """Whether the result is worse than the baseline by more than the given fraction."""
+        return self.throughput_ratio < 1 - tolerance or self.p99_ratio > 1 + tolerance
+
+
+def compare(results: Iterable[Result], path: Path) -> list[Comparison]:
+    """Compare results with a saved baseline. Results missing from the baseline are skipped."""
+    baseline = json.loads(path.read_text())
+    comparisons: list[Comparison] = []
+    for r in results:
+        if (old := baseline.get(r.key)) is None:
+            continue
+        old_throughput = old["ops"] / old["seconds"] if old["seconds"] else float("inf")
+        old_p99 = old["latencies"].get("p99")
+        comparisons.append(
+            Comparison(
+                key=r.key,
+                throughput_ratio=r.throughput / old_throughput,
+                p99_ratio=r.latencies["p99"] / old_p99 if old_p99 else 1.0,
+            )
+        )
+    return comparisons
@@ -0,0 +1,283 @@
+import random
+import shutil
+import time
+from collections.abc import Callable
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from multiprocessing import get_context
+from pathlib import Path
+from typing import NamedTuple
+
+from backlite import EVICTION_POLICIES
+from backlite import CacheItem
+from backlite import EvictionPolicy
+from backlite import ShardedStorage
+from backlite import Storage
+from benchmarks.harness import Result
+from benchmarks.harness import measure
+from benchmarks.harness import summarize
+
+BATCH_SIZE = 100
+"""The number of items read or written at once by batch operations."""
+
+POPULATE_BATCH_SIZE = 10_000
+"""The number of items written at once while filling a cache before a benchmark."""
+
+_NO_SIZE_LIMIT = 2**63 - 1
+
+
+class Config(NamedTuple):
+    """The parameters benchmarks are run across."""
+
+    rows: tuple[int, ...]
+    """The number of items in the cache."""
+    value_sizes: tuple[int, ...]
+    """The size of each value in bytes."""
+    threads: tuple[int, ...]
+    """The number of threads used by concurrency benchmarks."""
+    processes: tuple[int, ...]
+    """The number of processes used by concurrency benchmarks."""
+    shards: tuple[int, ...]
+    """The number of shards used by sharding benchmarks."""
+    iterations: int
+    """The number of operations to measure (per thread or process)."""
+    max_bytes: int
+    """Combinations of rows and value sizes that would exceed this many bytes are skipped."""
+
+    def sizes(self) -> Iterator[tuple[int, int]]:
+        """Iterate over the combinations of rows and value sizes that fit the byte limit."""
+        for rows in self.rows:
+            for value_size in self.value_sizes:
+                if rows * value_size <= self.max_bytes:
+                    yield rows, value_size
+
+
+Scenario = Callable[[Config, Path], Iterator[Result]]
+
+SCENARIOS: dict[str, Scenario] = {}
+
+
+def scenario(func: Scenario) -> Scenario:
+    """Register a benchmark scenario under the name of the function."""
+    SCENARIOS[func.__name__] = func
+    return func
+
+
+@scenario
+def get_one(config: Config, directory: Path) -> Iterator[Result]:
+    """Read single items that are in the cache."""
+    for rows, value_size in config.sizes():
+        with populated(directory / "cache.db", rows, value_size) as storage:
+            keys = random_keys(rows, config.iterations)
+            yield measure(
+                "get_one",
+                {"rows": rows, "value_size": value_size},
+                lambda i, keys=keys: storage.get_one(keys[i]),
+                iterations=config.iterations,
+            )
+
+
+@scenario
+def get_many(config: Config, directory: Path) -> Iterator[Result]:
+    """Read batches of items that are in the cache."""
+    for rows, value_size in config.sizes():
+        with populated(directory / "cache.db", rows, value_size) as storage:
+            keys = random_keys(rows, config.iterations * BATCH_SIZE)
+            yield measure(
+                "get_many",
+                {"rows": rows, "value_size": value_size, "batch": BATCH_SIZE},
+                lambda i, keys=keys: storage.get_many(keys[i * BATCH_SIZE : (i + 1) * BATCH_SIZE]),
+                iterations=config.iterations,
+            )
+
+
+@scenario
+def set_one(config: Config, directory: Path) -> Iterator[Result]:
+    """Write single new items to a cache that doesn't need to evict."""
+    for rows, value_size in config.sizes():
+        with populated(directory / "cache.db", rows, value_size) as storage:
+            item = CacheItem(value=random.randbytes(value_size))
+            yield measure(
+                "set_one",
+                {"rows": rows, "value_size": value_size},
+                lambda i, item=item: storage.set_one(f"new{i}", item),
+                iterations=config.iterations,
+            )
+
+
+@scenario
+def write_behind(config: Config, directory: Path) -> Iterator[Result]:
+    """Write single new items to a cache that queues writes and writes them in bulk."""
+    for rows, value_size in config.sizes():
+        with populated(
+            directory / "cache.db",
+            rows,
+            value_size,
+            write_flush_interval=timedelta(seconds=1),
+        ) as storage:
+            item = CacheItem(value=random.randbytes(value_size))
+            yield measure(
+                "write_behind",
+                {"rows": rows, "value_size": value_size},
+                lambda i, item=item: storage.set_one(f"new{i}", item),
+                iterations=config.iterations,
+            )
+
+
+@scenario
+def set_many(config: Config, directory: Path) -> Iterator[Result]:
+    """Write batches of new items to a cache that doesn't need to evict."""
+    for rows, value_size in config.sizes():
+        with populated(directory / "cache.db", rows, value_size) as storage:
+            item = CacheItem(value=random.randbytes(value_size))
+            yield measure(
+                "set_many",
+                {"rows": rows, "value_size": value_size, "batch": BATCH_SIZE},
+                lambda i, item=item: storage.set_many(
+                    {f"new{i}-{j}": item for j in range(BATCH_SIZE)}
+                ),
+                iterations=config.iterations,
+            )
+
+
+@scenario
+def evict(config: Config, directory: Path) -> Iterator[Result]:
+    """Write single new items to a full cache so each write evicts an item."""
+    value_size = min(config.value_sizes)
+    for policy in EVICTION_POLICIES:
+        for rows in config.rows:
+            if rows * value_size > config.max_bytes:
+                continue
+            with populated(
+                directory / "cache.db",
+                rows,
+                value_size,
+                size_limit=rows * value_size,
+                eviction_policy=policy,
+            ) as storage:
+                keys = random_keys(rows, config.iterations)
+                # Give the policy some access statistics to work with
+                storage.get_many(keys)
+                item = CacheItem(value=random.randbytes(value_size))
+                yield measure(
+                    "evict",
+                    {"rows": rows, "value_size": value_size, "policy": policy},
+                    lambda i, item=item: storage.set_one(f"new{i}", item),
+                    iterations=config.iterations,
+                )
+
+
+@scenario
+def threads(config: Config, directory: Path) -> Iterator[Result]:
+    """Read single items from several threads at once."""
+    rows, value_size = min(config.rows), min(config.value_sizes)
+    with populated(directory / "cache.db", rows, value_size) as storage:
+        keys = random_keys(rows, config.iterations)
+        for count in config.threads:
+            yield measure(
+                "threads",
+                {"rows": rows, "value_size": value_size, "threads": count},
+                lambda i, keys=keys: storage.get_one(keys[i]),
+                iterations=config.iterations,
+                threads=count,
+            )
+
+
+@scenario
+def processes(config: Config, directory: Path) -> Iterator[Result]:
+    """Read single items from several processes at once."""
+    rows, value_size = min(config.rows), min(config.value_sizes)
+    location = directory / "cache.db"
+    with populated(location, rows, value_size):
+        for count in config.processes:
+            with ProcessPoolExecutor(count, mp_context=get_context("spawn")) as pool:
+                futures = [
+                    pool.submit(_read_in_process, location, rows, config.iterations, seed)
+                    for seed in range(count)
+                ]
+                outcomes = [f.result() for f in futures]
+            yield Result(
+                name="processes",
+                params={"rows": rows, "value_size": value_size, "processes": count},
+                ops=config.iterations * count,
+                # Each process is timed separately since they take a while to start
+                seconds=max(seconds for _, seconds in outcomes),
+                latencies=summarize(n for latencies, _ in outcomes for n in latencies),
+            )
+
+
+@scenario
+def shards(config: Config, directory: Path) -> Iterator[Result]:
+    """Write single items from several threads at once to a sharded storage."""
+    value_size, count = min(config.value_sizes), max(config.threads)
+    item = CacheItem(value=random.randbytes(value_size))
+    for shard_count in config.shards:
+        location = directory / f"sharded-{shard_count}"
+        try:
+            with ShardedStorage(location, shards=shard_count, size_limit=_NO_SIZE_LIMIT) as storage:
+                yield measure(
+                    "shards",
+                    {"value_size": value_size, "threads": count, "shards": shard_count},
+                    lambda i, storage=storage: storage.set_one(f"new{i}", item),
+                    iterations=config.iterations,
+                    threads=count,
+                )
+        finally:
+            shutil.rmtree(location, ignore_errors=True)
+
+
+def _read_in_process(
+    location: Path,
+    rows: int,
+    iterations: int,
+    seed: int,
+) -> tuple[list[int], float]:
+    keys = random_keys(rows, iterations, seed=seed)
+    latencies: list[int] = []
+    with Storage(location, size_limit=_NO_SIZE_LIMIT) as storage:
+        start = time.perf_counter()
+        for key in keys:
+            op_start = time.perf_counter_ns()
+            storage.get_one(key)
+            latencies.append(time.perf_counter_ns() - op_start)
+        seconds = time.perf_counter() - start
+    return latencies, seconds
+
+
+@contextmanager
+def populated(
+    location: Path,
+    rows: int,
+    value_size: int,
+    *,
+    size_limit: int = _NO_SIZE_LIMIT,
+    eviction_policy: EvictionPolicy = "least-recently-used",
+    write_flush_interval: timedelta | None = None,
+) -> Iterator[Storage]:
+    """Create a storage filled with items and remove it afterwards."""
+    item = CacheItem(value=random.randbytes(value_size))
+    try:
+        with Storage(
+            location,
+            size_limit=size_limit,
+            eviction_policy=eviction_policy,
+            write_flush_interval=write_flush_interval,
+        ) as storage:
+            for start in range(0, rows, POPULATE_BATCH_SIZE):
+                stop = min(start + POPULATE_BATCH_SIZE, rows)
+                storage.set_many({f"key{i}": item for i in range(start, stop)})
+            yield storage
+    finally:
+        for path in location.parent.glob(f"{location.name}*"):
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+
+
+def random_keys(rows: int, count: int, *, seed: int = 0) -> list[str]:
+    """Pick keys of items in a populated storage at random."""
+    rng = random.Random(seed)
+    return [f"key{rng.randrange(rows)}" for _ in range(count)]
@@ -24,6 +24,13 @@ def test(args: list[str]):
     run(["pytest", "-v", *args])
 
 
+@main.command("bench", context_settings={"ignore_unknown_options": True})
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+def bench(args: list[str]):
+    """Run the benchmark suite - pass --help to see its options."""
+    run(["python", "-m", "benchmarks", *args])
+
+
 @main.command("cov")
 @click.option("--no-test", is_flag=True, help="Skip running tests with coverage")
 @click.option("--old-coverage-xml", default=None, type=str, help="Path to target coverage.xml.")
@@ -3,11 +3,32 @@ from importlib.metadata import version
 
 from backlite.decorators import async_cached
 from backlite.decorators import cached
+from backlite.serializers import JsonSerializer
+from backlite.serializers import MsgpackSerializer
+from backlite.serializers import PickleSerializer
+from backlite.storage import AsyncStorage
+from backlite.storage import ShardedStorage
 from backlite.storage import Storage
+from backlite.types import ADMISSION_POLICIES
+from backlite.types import COMPRESSIONS
 from backlite.types import EVICTION_POLICIES
+from backlite.types import TUNING_PROFILES
+from backlite.types import AdmissionPolicy
+from backlite.types import CachedFunction
+from backlite.types import CachedFunctionStats
 from backlite.types import CacheItem
+from backlite.types import Compression
 from backlite.types import EvictionPolicy
+from backlite.types import LatencyHistogram
+from backlite.types import MetricsHook
 from backlite.types import ParamHashFunc
+from backlite.types import PragmaValue
+from backlite.types import Serializer
+from backlite.types import StatementStats
+from backlite.types import StorageStats
+from backlite.types import TuningProfile
+from backlite.types import ValueReader
+from backlite.types import ValueWriter
 
 try:
     __version__ = version(__name__)
@@ -15,11 +36,32 @@ except PackageNotFoundError:  # nocov
     __version__ = "0.0.0"
 
 __all__ = (
+    "ADMISSION_POLICIES",
+    "COMPRESSIONS",
     "EVICTION_POLICIES",
+    "TUNING_PROFILES",
+    "AdmissionPolicy",
+    "AsyncStorage",
     "CacheItem",
+    "CachedFunction",
+    "CachedFunctionStats",
+    "Compression",
     "EvictionPolicy",
+    "JsonSerializer",
+    "LatencyHistogram",
+    "MetricsHook",
+    "MsgpackSerializer",
     "ParamHashFunc",
+    "PickleSerializer",
+    "PragmaValue",
+    "Serializer",
+    "ShardedStorage",
+    "StatementStats",
     "Storage",
+    "StorageStats",
+    "TuningProfile",
+    "ValueReader",
+    "ValueWriter",
     "async_cached",
     "cached",
 )
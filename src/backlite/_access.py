@@ -0,0 +1,46 @@
+import time
+from collections.abc import Iterable
+from collections.abc import Mapping
+from datetime import timedelta
+from threading import Lock
+
+
+class AccessBuffer:
+    """Buffers access statistics in memory so they can be written in bulk."""
+
+    def __init__(self, *, flush_interval: timedelta, flush_count: int) -> None:
+        self.flush_interval = flush_interval.total_seconds()
+        self.flush_count = flush_count
+        self._lock = Lock()
+        self._pending: dict[str, tuple[float, int]] = {}
+        self._count = 0
+        self._last_flush = time.monotonic()
+
+    @property
+    def pending(self) -> bool:
+        """Whether there are buffered statistics that have not been flushed."""
+        return bool(self._pending)
+
+    def record(self, keys: Iterable[str], accessed_at: float) -> bool:
+        """Record that the given keys were accessed.
+
+        Returns:
+            Whether the buffer is due to be flushed.
+        """
+        with self._lock:
+            for key in keys:
+                _, count = self._pending.get(key, (accessed_at, 0))
+                self._pending[key] = (accessed_at, count + 1)
+                self._count += 1
+            return (
+                self._count >= self.flush_count
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+
+    def drain(self) -> Mapping[str, tuple[float, int]]:
+        """Remove and return the buffered `(accessed_at, count)` of each accessed key."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._count = 0
+            self._last_flush = time.monotonic()
+        return pending
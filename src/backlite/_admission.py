@@ -0,0 +1,53 @@
+from collections.abc import Iterable
+from threading import Lock
+
+_DEPTH = 4
+_MAX_COUNT = 15
+_MASK = 2**64 - 1
+
+
+class FrequencySketch:
+    """Estimates how often keys have been used recently with a count-min sketch.
+
+    Each key increments one small saturating counter in each of several rows and its
+    frequency is estimated as the smallest of them. Once `sample_size` uses have been
+    recorded all the counters are halved so that keys which were popular long ago fade.
+    """
+
+    def __init__(self, sample_size: int) -> None:
+        self.sample_size = sample_size
+        # Roughly ten recorded uses per counter keeps the estimates close to exact
+        self._width = 1 << max(sample_size // 10, 1).bit_length()
+        self._counters = bytearray(_DEPTH * self._width)
+        self._lock = Lock()
+        self._recorded = 0
+
+    def record(self, keys: Iterable[str]) -> None:
+        """Record a use of each of the given keys."""
+        counters = self._counters
+        with self._lock:
+            for key in keys:
+                for index in self._indexes(key):
+                    if counters[index] < _MAX_COUNT:
+                        counters[index] += 1
+                self._recorded += 1
+            if self._recorded >= self.sample_size:
+                self._counters = counters.translate(_HALVED)
+                self._recorded //= 2
+
+    def estimate(self, key: str) -> int:
+        """Estimate how many times the key has been used recently."""
+        counters = self._counters
+        return min(counters[index] for index in self._indexes(key))
+
+    def _indexes(self, key: str) -> list[int]:
+        # Keys are only compared within a process so the builtin hash is good enough
+        state = hash(key) & _MASK
+        indexes = []
+        for row in range(_DEPTH):
+            state = (state * 0x9E3779B97F4A7C15 + 0x632BE59BD9B4E019) & _MASK
+            indexes.append(row * self._width + ((state >> 32) & (self._width - 1)))
+        return indexes
+
+
+_HALVED = bytes(count >> 1 for count in range(256))
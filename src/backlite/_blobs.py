@@ -0,0 +1,72 @@
+import mmap
+from collections.abc import Iterable
+from collections.abc import Mapping
+from pathlib import Path
+from typing import BinaryIO
+from uuid import uuid4
+
+from backlite.types import CacheItem
+
+
+class BlobStore:
+    """Stores large values in files alongside the database."""
+
+    def __init__(self, directory: Path, threshold: int | None) -> None:
+        self.directory = directory
+        self.threshold = threshold
+
+    def spill(self, items: Mapping[str, CacheItem]) -> Mapping[str, str]:
+        """Write values at or above the threshold to files.
+
+        Returns:
+            The name of the file each spilled item's value was written to.
+        """
+        if self.threshold is None:
+            return {}
+        names: dict[str, str] = {}
+        try:
+            for key, item in items.items():
+                if len(item["value"]) >= self.threshold:
+                    names[key] = self.write(item["value"])
+        except BaseException:
+            self.remove(names.values())
+            raise
+        return names
+
+    def write(self, value: bytes | memoryview) -> str:
+        """Write a value to a new file and return its name.
+
+        Files are never modified once written so readers can safely memory-map them.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"{uuid4().hex}.blob"
+        (self.directory / name).write_bytes(value)
+        return name
+
+    def create(self) -> tuple[str, BinaryIO]:
+        """Create a new file to write a value to and return its name."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"{uuid4().hex}.blob"
+        return name, (self.directory / name).open("wb")
+
+    def open(self, name: str) -> BinaryIO | None:
+        """Open the given file for reading or return None if it no longer exists."""
+        try:
+            return (self.directory / name).open("rb")
+        except FileNotFoundError:
+            return None
+
+    def read(self, name: str) -> memoryview | None:
+        """Memory-map the given file or return None if it no longer exists."""
+        try:
+            with (self.directory / name).open("rb") as f:
+                if f.seek(0, 2) == 0:
+                    return memoryview(b"")
+                return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except FileNotFoundError:
+            return None
+
+    def remove(self, names: Iterable[str]) -> None:
+        """Remove the given files if they exist."""
+        for name in names:
+            (self.directory / name).unlink(missing_ok=True)
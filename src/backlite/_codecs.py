@@ -0,0 +1,43 @@
+import bz2
+import lzma
+import zlib
+from collections.abc import Callable
+from collections.abc import Mapping
+from typing import cast
+
+from backlite.types import Compression
+
+CODECS: Mapping[
+    Compression,
+    tuple[Callable[[bytes | memoryview], bytes], Callable[[bytes | memoryview], bytes]],
+] = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "bz2": (bz2.compress, bz2.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+"""The `(compress, decompress)` functions of each compression algorithm."""
+
+
+def encode(
+    value: bytes | memoryview,
+    compression: Compression | None,
+    threshold: int,
+) -> tuple[bytes | memoryview, str | None]:
+    """Compress the value if it's large enough and compression makes it smaller.
+
+    Returns:
+        The stored value and the codec used to store it (or None if not compressed).
+    """
+    if compression is None or len(value) < threshold:
+        return value, None
+    compressed = CODECS[compression][0](value)
+    if len(compressed) >= len(value):
+        return value, None
+    return compressed, compression
+
+
+def decode(value: bytes, codec: str | None) -> bytes:
+    """Decompress a stored value given the codec it was stored with."""
+    if codec is None:
+        return value
+    return CODECS[cast("Compression", codec)][1](value)
@@ -1,11 +1,24 @@
+import json
 import sqlite3
+import time
 from collections.abc import Collection
 from collections.abc import Mapping
 from datetime import UTC
 from datetime import datetime
+from datetime import timedelta
+from operator import itemgetter
+from typing import Literal
 
+from backlite import _codecs
+from backlite._blobs import BlobStore
+from backlite._metadata import adaptive_target
+from backlite._metadata import eviction_inflation
+from backlite._metadata import frequent_ghost_size
+from backlite._metadata import recent_ghost_size
+from backlite._metadata import recent_value_size
 from backlite._metadata import total_value_size
 from backlite.types import CacheItem
+from backlite.types import Compression
 from backlite.types import EvictionPolicy
 
 
@@ -15,117 +28,708 @@ def get_cache_keys(conn: sqlite3.Connection, keys: Collection[str] | None) -> se
         rows = conn.execute("SELECT key FROM cache").fetchall()
     else:
         rows = conn.execute(
-            f"SELECT key FROM cache WHERE key IN ({', '.join('?' for _ in keys)})",  # noqa: S608
-            tuple(keys),
+            f"SELECT key FROM cache WHERE key IN {_KEYS_PARAM}",  # noqa: S608
+            (_dump_keys(keys),),
         ).fetchall()
     return {r[0] for r in rows}
 
 
+def get_cache_size(conn: sqlite3.Connection) -> int:
+    """Get the total size of the values in the cache."""
+    return total_value_size.get(conn)
+
+
+def get_cache_sizes(conn: sqlite3.Connection, keys: Collection[str]) -> dict[str, int]:
+    """Get the stored size of the values for the given keys that are in the cache."""
+    rows = conn.execute(
+        f"SELECT key, size FROM cache WHERE key IN {_KEYS_PARAM}",  # noqa: S608
+        (_dump_keys(keys),),
+    ).fetchall()
+    return dict(rows)
+
+
 def get_cache_items(
     conn: sqlite3.Connection,
     keys: Collection[str] | None,
+    *,
+    touch: bool = True,
+    blobs: BlobStore | None = None,
+    prioritize: bool = False,
 ) -> Mapping[str, CacheItem]:
-    """Get the values for the given keys."""
+    """Get the values for the given keys.
+
+    Args:
+        conn: The connection to use.
+        keys: The keys to get. If None, all unexpired items are returned.
+        touch: Whether to update the access statistics of the returned items.
+        blobs: Where values stored in external files are read from.
+        prioritize: Whether to update the priorities of touched items.
+    """
     if keys is None:
         rows = conn.execute(
             """
-            SELECT key, value, expires_at
+            SELECT key, value, codec, external, expires_at, cost
             FROM cache
             WHERE expires_at IS NULL OR expires_at > unixepoch('subsec')
             """
         ).fetchall()
-        keys = [r[0] for r in rows]
+        keys_param = _dump_keys([r[0] for r in rows])
     else:
+        keys_param = _dump_keys(keys)
         rows = conn.execute(
             f"""
-            SELECT key, value, expires_at
+            SELECT key, value, codec, external, expires_at, cost
             FROM cache
-            WHERE key IN ({", ".join("?" for _ in keys)})
-            AND expires_at IS NULL OR expires_at > unixepoch('subsec')
+            WHERE key IN {_KEYS_PARAM}
+            AND (expires_at IS NULL OR expires_at > unixepoch('subsec'))
             """,  # noqa: S608 (ok because values are not user input)
-            tuple(keys),
+            (keys_param,),
         ).fetchall()
     now = datetime.now(tz=UTC)
-    result = {
-        key: CacheItem(value=value, expiration=datetime.fromtimestamp(expires_at, tz=UTC) - now)
-        if expires_at is not None
-        else CacheItem(value=value)
-        for key, value, expires_at in rows
-    }
+    result: dict[str, CacheItem] = {}
+    for key, value, codec, external, expires_at, cost in rows:
+        if external is None:
+            item = CacheItem(value=_codecs.decode(value, codec))
+        elif blobs is not None and (mapped := blobs.read(external)) is not None:
+            item = CacheItem(value=mapped)
+        else:
+            # The file was removed by another process after this row was read
+            continue
+        if expires_at is not None:
+            item["expiration"] = datetime.fromtimestamp(expires_at, tz=UTC) - now
+        if cost is not None:
+            item["cost"] = cost
+        result[key] = item
+    if not touch:
+        return result
+    if prioritize:
+        conn.execute(
+            f"""
+            UPDATE cache
+            SET accessed_at = ?,
+                accessed_count = accessed_count + 1,
+                priority = ? + (accessed_count + 2) * {_PRIORITY_WEIGHT}
+            WHERE key IN {_KEYS_PARAM}
+            """,  # noqa: S608
+            (now.timestamp(), eviction_inflation.get(conn), keys_param),
+        )
+        return result
     conn.execute(
         f"""
         UPDATE cache
-        SET accessed_at = unixepoch('subsec'),
+        SET accessed_at = ?,
             accessed_count = accessed_count + 1
-        WHERE key IN ({", ".join("?" for _ in keys)})
+        WHERE key IN {_KEYS_PARAM}
         """,  # noqa: S608
-        tuple(keys),
+        # Use Python's clock since unixepoch('subsec') only has millisecond resolution
+        (now.timestamp(), keys_param),
     )
     return result
 
 
-def set_cache_items(conn: sqlite3.Connection, items: Mapping[str, CacheItem]) -> None:
-    """Update the cache with the given values."""
-    now = datetime.now(tz=UTC)
+def update_access_stats(
+    conn: sqlite3.Connection,
+    accessed: Mapping[str, tuple[float, int]],
+    *,
+    prioritize: bool = False,
+) -> None:
+    """Apply buffered `(accessed_at, count)` access statistics for each key.
+
+    Args:
+        conn: The connection to use.
+        accessed: The time each key was last accessed and the number of times it was.
+        prioritize: Whether to update the priorities of the accessed items.
+    """
+    if prioritize:
+        inflation = eviction_inflation.get(conn)
+        conn.executemany(
+            f"""
+            UPDATE cache
+            SET accessed_at = MAX(accessed_at, ?),
+                accessed_count = accessed_count + ?,
+                priority = ? + (accessed_count + ? + 1) * {_PRIORITY_WEIGHT}
+            WHERE key = ?
+            """,  # noqa: S608
+            [
+                (accessed_at, count, inflation, count, key)
+                for key, (accessed_at, count) in accessed.items()
+            ],
+        )
+        return
     conn.executemany(
         """
-        INSERT OR REPLACE INTO cache (key, value, expires_at)
-        VALUES (?, ?, ?)
+        UPDATE cache
+        SET accessed_at = MAX(accessed_at, ?),
+            accessed_count = accessed_count + ?
+        WHERE key = ?
         """,
-        [
+        [(accessed_at, count, key) for key, (accessed_at, count) in accessed.items()],
+    )
+
+
+def encode_cache_values(
+    items: Mapping[str, CacheItem],
+    *,
+    compression: Compression | None = None,
+    compression_threshold: int = 0,
+    external: Mapping[str, str] | None = None,
+) -> dict[str, tuple[bytes | memoryview, str | None]]:
+    """Encode the values that will be stored in the database the way they'll be stored.
+
+    Args:
+        items: The items whose values to encode.
+        compression: The algorithm used to compress values (if any).
+        compression_threshold: The minimum size of a value in bytes for it to be compressed.
+        external: The names of files the values of some items have been written to instead.
+
+    Returns:
+        The stored value and its codec for each item not stored in a file.
+    """
+    return {
+        key: _codecs.encode(item["value"], compression, compression_threshold)
+        for key, item in items.items()
+        if external is None or key not in external
+    }
+
+
+def set_cache_items(
+    conn: sqlite3.Connection,
+    items: Mapping[str, CacheItem],
+    *,
+    compression: Compression | None = None,
+    compression_threshold: int = 0,
+    external: Mapping[str, str] | None = None,
+    encoded: Mapping[str, tuple[bytes | memoryview, str | None]] | None = None,
+    prioritize: bool = False,
+) -> None:
+    """Update the cache with the given values.
+
+    Args:
+        conn: The connection to use.
+        items: The items to set.
+        compression: The algorithm used to compress values (if any).
+        compression_threshold: The minimum size of a value in bytes for it to be compressed.
+        external: The names of files the values of some items have already been written to.
+        encoded: Values that have already been encoded by `encode_cache_values`.
+        prioritize: Whether to assign priorities to the items.
+    """
+    now = datetime.now(tz=UTC)
+    inflation = eviction_inflation.get(conn) if prioritize else None
+    rows = []
+    for key, item in items.items():
+        if external is not None and (name := external.get(key)) is not None:
+            value, codec, size = b"", None, len(item["value"])
+        else:
+            name = None
+            if encoded is None or (stored := encoded.get(key)) is None:
+                stored = _codecs.encode(item["value"], compression, compression_threshold)
+            value, codec = stored
+            size = len(value)
+        expiration = item.get("expiration")
+        rows.append(
             (
                 key,
-                value["value"],
-                (now + expiration).timestamp()
-                if (expiration := value.get("expiration")) is not None
-                else None,
+                value,
+                codec,
+                name,
+                size,
+                now.timestamp(),
+                now.timestamp(),
+                (now + expiration).timestamp() if expiration is not None else None,
+                cost := item.get("cost"),
+                _priority(inflation, cost, size) if inflation is not None else None,
             )
-            for key, value in items.items()
-        ],
+        )
+    conn.executemany(
+        """
+        INSERT INTO cache (
+            key, value, codec, external, size, created_at, accessed_at, expires_at, cost, priority
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET
+            value = excluded.value,
+            codec = excluded.codec,
+            external = excluded.external,
+            size = excluded.size,
+            created_at = excluded.created_at,
+            accessed_at = excluded.accessed_at,
+            accessed_count = 0,
+            expires_at = excluded.expires_at,
+            cost = excluded.cost,
+            priority = excluded.priority
+        """,
+        rows,
     )
 
 
+def get_cache_key(conn: sqlite3.Connection, rowid: int) -> str | None:
+    """Get the key of the item with the given rowid."""
+    row = conn.execute("SELECT key FROM cache WHERE rowid = ?", (rowid,)).fetchone()
+    return row[0] if row is not None else None
+
+
+def get_export_keys(
+    conn: sqlite3.Connection,
+    *,
+    prefix: str | None = None,
+    hottest: int | None = None,
+) -> list[str]:
+    """Get the keys of unexpired items to export from the least to the most accessed.
+
+    Args:
+        conn: The connection to use.
+        prefix: Only get keys that start with this.
+        hottest: Only get this many of the most accessed keys.
+    """
+    if prefix is None:
+        rows = conn.execute(
+            """
+            SELECT key FROM cache
+            WHERE expires_at IS NULL OR expires_at > unixepoch('subsec')
+            ORDER BY accessed_count DESC, accessed_at DESC
+            LIMIT ?
+            """,
+            (hottest if hottest is not None else -1,),
+        ).fetchall()
+        return [key for (key,) in reversed(rows)]
+    matches: list[tuple[str, int, float]] = []
+    # Keys that share a prefix are adjacent in the primary key index
+    for key, accessed_count, accessed_at in conn.execute(
+        """
+        SELECT key, accessed_count, accessed_at FROM cache
+        WHERE key >= ? AND (expires_at IS NULL OR expires_at > unixepoch('subsec'))
+        ORDER BY key
+        """,
+        (prefix,),
+    ):
+        if not key.startswith(prefix):
+            break
+        matches.append((key, accessed_count, accessed_at))
+    matches.sort(key=itemgetter(1, 2), reverse=True)
+    return [key for key, _, _ in reversed(matches[:hottest])]
+
+
+def get_cache_item_location(
+    conn: sqlite3.Connection,
+    key: str,
+) -> tuple[int, str | None, str | None] | None:
+    """Get the rowid, codec, and external file name of an unexpired item."""
+    return conn.execute(
+        """
+        SELECT rowid, codec, external
+        FROM cache
+        WHERE key = ?
+        AND (expires_at IS NULL OR expires_at > unixepoch('subsec'))
+        """,
+        (key,),
+    ).fetchone()
+
+
+def reserve_cache_item(
+    conn: sqlite3.Connection,
+    key: str,
+    size: int,
+    *,
+    expiration: timedelta | None = None,
+    external: str | None = None,
+    prioritize: bool = False,
+) -> int:
+    """Create or replace an item with a zero-filled value of the given size.
+
+    Args:
+        conn: The connection to use.
+        key: The key of the item.
+        size: The size of the value in bytes.
+        expiration: The time until the item expires.
+        external: The name of the file the value is stored in (if any).
+        prioritize: Whether to assign a priority to the item.
+
+    Returns:
+        The rowid of the item so its value can be written incrementally.
+    """
+    now = datetime.now(tz=UTC)
+    (rowid,) = conn.execute(
+        """
+        INSERT INTO cache (
+            key, value, codec, external, size, created_at, accessed_at, expires_at, priority
+        )
+        VALUES (?, zeroblob(?), NULL, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET
+            value = excluded.value,
+            codec = excluded.codec,
+            external = excluded.external,
+            size = excluded.size,
+            created_at = excluded.created_at,
+            accessed_at = excluded.accessed_at,
+            accessed_count = 0,
+            expires_at = excluded.expires_at,
+            cost = NULL,
+            priority = excluded.priority
+        RETURNING rowid
+        """,
+        (
+            key,
+            0 if external is not None else size,
+            external,
+            size,
+            now.timestamp(),
+            now.timestamp(),
+            (now + expiration).timestamp() if expiration is not None else None,
+            _priority(eviction_inflation.get(conn), None, size) if prioritize else None,
+        ),
+    ).fetchone()
+    return rowid
+
+
+def get_external_names(conn: sqlite3.Connection) -> list[str]:
+    """Get the names of the files values are stored in."""
+    return [r[0] for r in conn.execute("SELECT external FROM cache WHERE external IS NOT NULL")]
+
+
+def has_orphaned_blobs(conn: sqlite3.Connection) -> bool:
+    """Check whether there are files of deleted or replaced values to remove."""
+    return conn.execute("SELECT 1 FROM orphaned_blobs LIMIT 1").fetchone() is not None
+
+
+def remove_orphaned_blobs(conn: sqlite3.Connection, blobs: BlobStore) -> None:
+    """Remove the files of values whose rows have been deleted or replaced."""
+    names = [r[0] for r in conn.execute("SELECT name FROM orphaned_blobs").fetchall()]
+    if names:
+        blobs.remove(names)
+        conn.execute(
+            f"DELETE FROM orphaned_blobs WHERE name IN {_KEYS_PARAM}",  # noqa: S608
+            (_dump_keys(names),),
+        )
+
+
+def acquire_lease(
+    conn: sqlite3.Connection,
+    key: str,
+    owner: str,
+    duration: timedelta,
+) -> bool:
+    """Acquire a lease on the given key unless another owner holds one that hasn't expired.
+
+    Args:
+        conn: The connection to use.
+        key: The key to lease.
+        owner: Identifies the holder of the lease.
+        duration: The time until the lease expires.
+
+    Returns:
+        Whether the lease was acquired.
+    """
+    now = datetime.now(tz=UTC)
+    row = conn.execute(
+        """
+        INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET
+            owner = excluded.owner,
+            expires_at = excluded.expires_at
+        WHERE leases.expires_at < ?
+        RETURNING owner
+        """,
+        (key, owner, (now + duration).timestamp(), now.timestamp()),
+    ).fetchone()
+    return row is not None
+
+
+def release_lease(conn: sqlite3.Connection, key: str, owner: str) -> None:
+    """Release a lease on the given key if it's still held by the given owner."""
+    conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+
+def delete_expired_cache_items(conn: sqlite3.Connection, *, limit: int | None = None) -> int:
+    """Delete expired items from the cache.
+
+    Args:
+        conn: The connection to use.
+        limit: The maximum number of items to delete.
+
+    Returns:
+        The number of items that were deleted.
+    """
+    return conn.execute(
+        """
+        DELETE FROM cache WHERE rowid IN (
+            SELECT rowid FROM cache
+            WHERE expires_at IS NOT NULL AND expires_at < unixepoch('subsec')
+            ORDER BY expires_at
+            LIMIT ?
+        )
+        """,
+        (limit if limit is not None else -1,),
+    ).rowcount
+
+
 def evict_cache_items(
     conn: sqlite3.Connection,
     *,
     size_limit: int,
     policy: EvictionPolicy,
-) -> None:
-    """Evict items from the cache until the total size is less than the max size."""
+    limit: int | None = None,
+) -> tuple[int, int]:
+    """Evict items from the cache until the total size is less than the max size.
+
+    Args:
+        conn: The connection to use.
+        size_limit: The size the cache must be reduced to.
+        policy: Determines which items are evicted first.
+        limit: The maximum number of items to evict (including those that expired).
+
+    Returns:
+        The number of items that expired and the number evicted to get under the size limit.
+    """
     # Cleanup expired items first
-    conn.execute(
-        "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < unixepoch('subsec')"
-    )
+    expired = delete_expired_cache_items(conn, limit=limit)
+    if limit is not None and (limit := limit - expired) <= 0:
+        return expired, 0
 
     # Get the current size of the cache
     current_size = total_value_size.get(conn)
 
     # If the current size is already less than the limit, do nothing
     if current_size <= size_limit:
+        return expired, 0
+
+    if policy == "adaptive":
+        return expired, _evict_adaptive(conn, current_size - size_limit, limit=limit)
+
+    # Count the items that must be evicted to get under the limit. The window is computed
+    # lazily while walking the policy's index so this only visits the rows being evicted.
+    column, direction = _ORDER_BY_POLICY[policy]
+    order_by = f"{column} {direction}, rowid {direction}"
+
+    cutoff = conn.execute(
+        f"""
+        SELECT evicted_count FROM (
+            SELECT
+                SUM(size) OVER w AS evicted_size,
+                ROW_NUMBER() OVER w AS evicted_count
+            FROM cache
+            WINDOW w AS (ORDER BY {order_by} ROWS UNBOUNDED PRECEDING)
+        )
+        WHERE evicted_size >= ? OR evicted_count >= ?
+        LIMIT 1
+        """,  # noqa: S608 (ok because values are not user input)
+        (current_size - size_limit, limit if limit is not None else _MAX_ROWS),
+    ).fetchone()
+    if policy == "greedy-dual-size-frequency":
+        _inflate(conn, order_by, cutoff[0] if cutoff is not None else None)
+
+    # Evict that many items in order. Deleting by count rather than by a range of the ordered
+    # values avoids scanning every item that shares a value with the last one evicted.
+    if cutoff is None:
+        return expired, conn.execute("DELETE FROM cache").rowcount
+    return expired, conn.execute(
+        f"""
+        DELETE FROM cache WHERE rowid IN (
+            SELECT rowid FROM cache ORDER BY {order_by} LIMIT ?
+        )
+        """,  # noqa: S608
+        cutoff,
+    ).rowcount
+
+
+def adapt_to_evicted_keys(
+    conn: sqlite3.Connection,
+    keys: Collection[str],
+    *,
+    size_limit: int,
+) -> None:
+    """Adapt the adaptive policy to the given keys being written again after being evicted.
+
+    Keys evicted before they were accessed grow the room kept for unaccessed items, while
+    those evicted after being accessed shrink it. Either way the rewritten items count as
+    accessed since they've been asked for again. Evicted keys are only remembered while
+    their sizes add up to less than the size limit.
+
+    Args:
+        conn: The connection to use.
+        keys: The keys that were written.
+        size_limit: The size limit of the cache.
+    """
+    keys_param = _dump_keys(keys)
+    ghosts = conn.execute(
+        f"DELETE FROM ghosts WHERE key IN {_KEYS_PARAM} RETURNING frequent, size",  # noqa: S608
+        (keys_param,),
+    ).fetchall()
+    _trim_ghosts(conn, size_limit)
+    if not ghosts:
         return
+    target = adaptive_target.get(conn)
+    recent, frequent = recent_ghost_size.get(conn), frequent_ghost_size.get(conn)
+    for was_frequent, size in ghosts:
+        if was_frequent:
+            target -= size * max(recent / max(frequent, 1), 1)
+        else:
+            target += size * max(frequent / max(recent, 1), 1)
+    adaptive_target.set(conn, min(max(target, 0.0), size_limit))
+    conn.execute(
+        f"""
+        UPDATE cache SET accessed_count = MAX(accessed_count, 1)
+        WHERE key IN {_KEYS_PARAM}
+        """,  # noqa: S608
+        (keys_param,),
+    )
 
-    # Pick the keys to evict based on the policy
-    keys_to_evict: list[str] = []
-    order_by = _SORT_BY_POLICY[policy]
-    for key, size in conn.execute(
-        f"SELECT key, LENGTH(value) FROM cache ORDER BY {order_by}"  # noqa: S608
-    ).fetchall():
-        keys_to_evict.append(key)
-        current_size -= size
-        if current_size <= size_limit:
+
+def get_eviction_candidates(
+    conn: sqlite3.Connection,
+    *,
+    size: int,
+    policy: EvictionPolicy,
+) -> list[tuple[str, int]]:
+    """Get the keys and sizes of the items that would be evicted first to free the given size.
+
+    Args:
+        conn: The connection to use.
+        size: The total size of the items to get.
+        policy: Determines which items would be evicted first.
+    """
+    column, direction = _ORDER_BY_POLICY[policy]
+    candidates: list[tuple[str, int]] = []
+    if size <= 0:
+        return candidates
+    # Rows are stepped through lazily so this only visits the ones that are returned
+    for key, item_size in conn.execute(
+        f"SELECT key, size FROM cache ORDER BY {column} {direction}, rowid {direction}"  # noqa: S608
+    ):
+        candidates.append((key, item_size))
+        if (size := size - item_size) <= 0:
+            break
+    return candidates
+
+
+_MAX_ROWS = 2**63 - 1
+
+
+_PRIORITY_WEIGHT = "COALESCE(cost, 1.0) / MAX(size, 1)"
+"""The priority an item gains each time it's accessed - its cost per byte.
+
+Items whose cost is unknown are weighed as if they took a second to compute.
+"""
+
+
+def _priority(inflation: float, cost: float | None, size: int) -> float:
+    # Matches _PRIORITY_WEIGHT for an item that has just been written
+    return inflation + (cost if cost is not None else 1.0) / max(size, 1)
+
+
+def _inflate(conn: sqlite3.Connection, order_by: str, count: int | None) -> None:
+    # Age the remaining items by raising the baseline given to newly prioritized ones to
+    # the priority of the last item about to be evicted.
+    (priority,) = conn.execute(
+        f"SELECT MAX(priority) FROM (SELECT priority FROM cache ORDER BY {order_by} LIMIT ?)",  # noqa: S608
+        (count if count is not None else -1,),
+    ).fetchone()
+    if priority is not None and priority > eviction_inflation.get(conn):
+        eviction_inflation.set(conn, priority)
+
+
+_KEYS_PARAM = "(SELECT value FROM json_each(?))"
+"""Selects the keys from a JSON array parameter.
+
+Passing keys as a single JSON array (rather than a placeholder per key) keeps the shape of
+statements fixed so that they're reused from the statement cache, and avoids SQLite's limit
+on the number of variables in a statement.
+"""
+
+
+def _evict_adaptive(conn: sqlite3.Connection, size: int, *, limit: int | None) -> int:
+    # Unaccessed items are evicted while they take up more than the target, then accessed
+    # ones. Either is evicted beyond that if there's not enough of the other.
+    recent = recent_value_size.get(conn)
+    frequent = total_value_size.get(conn) - recent
+    from_recent = min(
+        size, recent, max(int(recent - adaptive_target.get(conn)), size - frequent, 0)
+    )
+    evicted = _evict_from_list(conn, from_recent, frequent=False, limit=limit)
+    freed = sum(s for _, s in evicted)
+    if limit is not None:
+        limit -= len(evicted)
+    if freed < size and (limit is None or limit > 0):
+        evicted += _evict_from_list(conn, size - freed, frequent=True, limit=limit)
+    return len(evicted)
+
+
+_RECENT_BY_RECENCY = """
+SELECT rowid, size FROM cache INDEXED BY cache_recent_accessed_at
+WHERE accessed_count = 0
+ORDER BY accessed_at ASC, rowid ASC
+"""
+"""Walks the unaccessed items from the least recently used.
+
+The index is named since the planner otherwise prefers sorting the items it finds with
+`cache_accessed_count`, which visits all of them.
+"""
+
+_FREQUENT_BY_RECENCY = """
+SELECT rowid, size FROM cache INDEXED BY cache_frequent_accessed_at
+WHERE accessed_count > 0
+ORDER BY accessed_at ASC, rowid ASC
+"""
+"""Walks the accessed items from the least recently used using their partial index."""
+
+
+def _evict_from_list(
+    conn: sqlite3.Connection,
+    size: int,
+    *,
+    frequent: bool,
+    limit: int | None,
+) -> list[tuple[str, int]]:
+    # Evict the least recently used accessed or unaccessed items and remember their keys
+    rowids: list[int] = []
+    for rowid, item_size in conn.execute(_FREQUENT_BY_RECENCY if frequent else _RECENT_BY_RECENCY):
+        if size <= 0 or (limit is not None and len(rowids) >= limit):
             break
+        rowids.append(rowid)
+        size -= item_size
+    if not rowids:
+        return []
+    evicted = conn.execute(
+        f"DELETE FROM cache WHERE rowid IN {_KEYS_PARAM} RETURNING key, size",  # noqa: S608
+        (json.dumps(rowids),),
+    ).fetchall()
+    conn.execute(
+        f"DELETE FROM ghosts WHERE key IN {_KEYS_PARAM}",  # noqa: S608
+        (_dump_keys([key for key, _ in evicted]),),
+    )
+    conn.executemany(
+        "INSERT INTO ghosts (key, frequent, size, evicted_at) VALUES (?, ?, ?, ?)",
+        [(key, frequent, item_size, time.time()) for key, item_size in evicted],
+    )
+    return evicted
+
 
-    # Evict the items
+def _trim_ghosts(conn: sqlite3.Connection, size_limit: int) -> None:
+    # Only remember as many evicted keys as would fit in the cache
+    excess = recent_ghost_size.get(conn) + frequent_ghost_size.get(conn) - size_limit
+    if excess <= 0:
+        return
+    rowids: list[int] = []
+    for rowid, size in conn.execute("SELECT rowid, size FROM ghosts ORDER BY evicted_at"):
+        rowids.append(rowid)
+        if (excess := excess - size) <= 0:
+            break
     conn.execute(
-        f"DELETE FROM cache WHERE key IN ({', '.join('?' for _ in keys_to_evict)})",  # noqa: S608
-        tuple(keys_to_evict),
+        f"DELETE FROM ghosts WHERE rowid IN {_KEYS_PARAM}",  # noqa: S608
+        (json.dumps(rowids),),
     )
 
 
-_SORT_BY_POLICY: Mapping[EvictionPolicy, str] = {
-    "least-recently-used": "accessed_at ASC",
-    "least-frequently-used": "accessed_count ASC",
-    "most-recently-used": "accessed_at DESC",
-    "first-in-first-out": "created_at ASC",
-    "last-in-first-out": "created_at DESC",
+def _dump_keys(keys: Collection[str]) -> str:
+    return json.dumps(keys if isinstance(keys, list) else list(keys))
+
+
+_ORDER_BY_POLICY: Mapping[EvictionPolicy, tuple[str, Literal["ASC", "DESC"]]] = {
+    "least-recently-used": ("accessed_at", "ASC"),
+    "least-frequently-used": ("accessed_count", "ASC"),
+    "most-recently-used": ("accessed_at", "DESC"),
+    "first-in-first-out": ("created_at", "ASC"),
+    "last-in-first-out": ("created_at", "DESC"),
+    "greedy-dual-size-frequency": ("priority", "ASC"),
+    # The adaptive policy evicts in this order within each of its lists
+    "adaptive": ("accessed_at", "ASC"),
 }
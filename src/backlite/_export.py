@@ -0,0 +1,82 @@
+import math
+import struct
+from collections.abc import Iterable
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import BinaryIO
+from typing import Literal
+
+from backlite.types import CacheItem
+
+MAGIC = b"backlite-export\x01"
+"""Identifies an export and the version of its format."""
+
+_HEADER = struct.Struct("<IQdd")
+"""The length of an item's key and value, its remaining expiration in seconds, and its cost.
+
+Missing expirations and costs are written as NaN. The key and value follow the header.
+"""
+
+
+@contextmanager
+def open_file(file: BinaryIO | Path | str, mode: Literal["rb", "wb"]) -> Iterator[BinaryIO]:
+    """Open the given path or use the given file object as is (without closing it)."""
+    if isinstance(file, Path | str):
+        with Path(file).open(mode) as f:
+            yield f
+    else:
+        yield file
+
+
+def write_items(file: BinaryIO, items: Iterable[tuple[str, CacheItem]]) -> int:
+    """Write the given items to an export.
+
+    Returns:
+        The number of items written.
+    """
+    file.write(MAGIC)
+    count = 0
+    for key, item in items:
+        key_data = key.encode()
+        expiration = item.get("expiration")
+        cost = item.get("cost")
+        file.write(
+            _HEADER.pack(
+                len(key_data),
+                len(item["value"]),
+                expiration.total_seconds() if expiration is not None else math.nan,
+                cost if cost is not None else math.nan,
+            )
+        )
+        file.write(key_data)
+        file.write(item["value"])
+        count += 1
+    return count
+
+
+def read_items(file: BinaryIO) -> Iterator[tuple[str, CacheItem]]:
+    """Read the items of an export one at a time."""
+    if file.read(len(MAGIC)) != MAGIC:
+        msg = "Not a backlite export or it was written by an incompatible version"
+        raise ValueError(msg)
+    while header := file.read(_HEADER.size):
+        key_size, value_size, expiration, cost = _HEADER.unpack(_read_exactly(header, file))
+        key = _read_exactly(file.read(key_size), file, key_size).decode()
+        item = CacheItem(value=_read_exactly(file.read(value_size), file, value_size))
+        if not math.isnan(expiration):
+            item["expiration"] = timedelta(seconds=expiration)
+        if not math.isnan(cost):
+            item["cost"] = cost
+        yield key, item
+
+
+def _read_exactly(data: bytes, file: BinaryIO, size: int = _HEADER.size) -> bytes:
+    # Files may return fewer bytes than asked for before they're exhausted
+    while len(data) < size:
+        if not (more := file.read(size - len(data))):
+            msg = "The export ended unexpectedly"
+            raise ValueError(msg)
+        data += more
+    return data
@@ -0,0 +1,235 @@
+import copyreg
+import pickle
+from collections.abc import Callable
+from hashlib import blake2b
+from inspect import Parameter
+from inspect import Signature
+from types import BuiltinFunctionType
+from types import FunctionType
+from typing import Any
+from typing import NamedTuple
+
+
+def param_hash(sig: Signature, args: tuple[Any, ...], kwargs: dict[str, Any]) -> str:
+    """Generate a hash of the given parameters that is stable across processes.
+
+    The arguments are bound to the signature first so that equivalent calls (e.g. passing
+    an argument by position or by keyword, or omitting one that has a default) produce the
+    same hash. Arguments need not be hashable - they're canonicalized into bytes which are
+    then digested with BLAKE2.
+    """
+    chunks: list[bytes] = []
+    for name, value in _get_plan(sig).bind(sig, args, kwargs):
+        chunks.append(b"%s=" % name.encode())
+        _encode(value, chunks, {})
+    return blake2b(b"".join(chunks), digest_size=16).hexdigest()
+
+
+def jump_hash(key: str, buckets: int) -> int:
+    """Pick which of the given number of buckets a key belongs to.
+
+    This is Lamping and Veach's jump consistent hash - when the number of buckets grows
+    from N to N+1 only 1/(N+1) of keys move (all of them to the new bucket).
+    """
+    state = int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), "little")
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        state = (state * 2862933555777941757 + 1) % 2**64
+        candidate = int((bucket + 1) * (2**31 / ((state >> 33) + 1)))
+    return bucket
+
+
+class _BindingPlan(NamedTuple):
+    positional: tuple[str, ...]
+    """Names of parameters that can be passed by position (in order)."""
+    keyword: frozenset[str]
+    """Names of parameters that can be passed by keyword."""
+    defaults: tuple[tuple[str, Any], ...]
+    """Default values of parameters (in order)."""
+    order: tuple[str, ...]
+    """Names of all parameters (in order)."""
+    var_positional: str | None
+    var_keyword: str | None
+
+    def bind(
+        self,
+        sig: Signature,
+        args: tuple[Any, ...],
+        kwargs: dict[str, Any],
+    ) -> list[tuple[str, Any]]:
+        bound: dict[str, Any] = dict(zip(self.positional, args, strict=False))
+        if len(args) > len(self.positional):
+            if self.var_positional is None:
+                return _bind_slow(sig, args, kwargs)
+            bound[self.var_positional] = args[len(self.positional) :]
+        extra: dict[str, Any] = {}
+        for name, value in kwargs.items():
+            if name in self.keyword and name not in bound:
+                bound[name] = value
+            elif self.var_keyword is not None and name not in bound:
+                extra[name] = value
+            else:
+                return _bind_slow(sig, args, kwargs)
+        for name, default in self.defaults:
+            bound.setdefault(name, default)
+        if self.var_keyword is not None:
+            bound[self.var_keyword] = extra
+        if self.var_positional is not None:
+            bound.setdefault(self.var_positional, ())
+        if len(bound) != len(self.order):
+            return _bind_slow(sig, args, kwargs)
+        return [(name, bound[name]) for name in self.order]
+
+
+def _bind_slow(
+    sig: Signature,
+    args: tuple[Any, ...],
+    kwargs: dict[str, Any],
+) -> list[tuple[str, Any]]:
+    # Raises a helpful TypeError if the arguments don't fit the signature
+    bound_args = sig.bind(*args, **kwargs)
+    bound_args.apply_defaults()
+    return list(bound_args.arguments.items())
+
+
+def _get_plan(sig: Signature) -> _BindingPlan:
+    # Signatures are keyed by identity since hashing them is comparatively expensive
+    if (entry := _PLANS.get(id(sig))) is not None and entry[0] is sig:
+        return entry[1]
+    params = sig.parameters.values()
+    plan = _BindingPlan(
+        positional=tuple(
+            p.name
+            for p in params
+            if p.kind in {Parameter.POSITIONAL_ONLY, Parameter.POSITIONAL_OR_KEYWORD}
+        ),
+        keyword=frozenset(
+            p.name
+            for p in params
+            if p.kind in {Parameter.POSITIONAL_OR_KEYWORD, Parameter.KEYWORD_ONLY}
+        ),
+        defaults=tuple((p.name, p.default) for p in params if p.default is not Parameter.empty),
+        order=tuple(p.name for p in params),
+        var_positional=next((p.name for p in params if p.kind is Parameter.VAR_POSITIONAL), None),
+        var_keyword=next((p.name for p in params if p.kind is Parameter.VAR_KEYWORD), None),
+    )
+    _PLANS[id(sig)] = (sig, plan)
+    return plan
+
+
+_PLANS: dict[int, tuple[Signature, _BindingPlan]] = {}
+
+
+def _encode(value: Any, chunks: list[bytes], path: dict[int, int]) -> None:
+    # The path maps the ids of the containers being encoded to how deeply they're nested
+    if (encode_atom := _ATOM_ENCODERS.get(type(value))) is not None:
+        encode_atom(value, chunks)
+        return
+    if (depth := path.get(id(value))) is not None:
+        # The value contains itself - refer back to where it was first encountered
+        chunks.append(b"^%d;" % depth)
+        return
+    path[id(value)] = len(path)
+    try:
+        if (encode := _CONTAINER_ENCODERS.get(type(value))) is not None:
+            encode(value, chunks, path)
+        elif (reduced := _reduce(value)) is not None:
+            chunks.append(b"r")
+            _encode(reduced, chunks, path)
+        else:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            chunks.extend((b"p%d:" % len(data), data))
+    finally:
+        del path[id(value)]
+
+
+def _reduce(value: Any) -> tuple[Any, ...] | None:
+    # Pickling an object whose state holds a set or dict can order it differently in each
+    # process, so break it down the way pickle would and canonicalize the parts instead.
+    # Classes and functions are pickled by reference which is already stable.
+    if isinstance(value, type | FunctionType | BuiltinFunctionType):
+        return None
+    if isinstance(value, set | frozenset):
+        return (type(value), frozenset(value))
+    reduced: Any
+    try:
+        if (reducer := copyreg.dispatch_table.get(type(value))) is not None:
+            reduced = reducer(value)
+        else:
+            reduced = value.__reduce_ex__(pickle.HIGHEST_PROTOCOL)
+    except Exception:  # noqa: BLE001
+        return None
+    if not isinstance(reduced, tuple):
+        return None
+    func, args, state, list_items, dict_items = (*reduced, None, None, None)[:5]
+    return (
+        func,
+        args,
+        state,
+        None if list_items is None else list(list_items),
+        None if dict_items is None else dict(dict_items),
+    )
+
+
+def _encode_str(value: str, chunks: list[bytes]) -> None:
+    data = value.encode()
+    chunks.extend((b"s%d:" % len(data), data))
+
+
+def _encode_bytes(value: bytes, chunks: list[bytes]) -> None:
+    chunks.extend((b"b%d:" % len(value), value))
+
+
+def _encode_sequence(tag: bytes) -> Callable[[Any, list[bytes], dict[int, int]], None]:
+    def encode(
+        value: tuple[Any, ...] | list[Any],
+        chunks: list[bytes],
+        path: dict[int, int],
+    ) -> None:
+        chunks.append(b"%s%d:" % (tag, len(value)))
+        for item in value:
+            _encode(item, chunks, path)
+
+    return encode
+
+
+def _encode_set(
+    value: set[Any] | frozenset[Any],
+    chunks: list[bytes],
+    path: dict[int, int],
+) -> None:
+    encoded = []
+    for item in value:
+        _encode(item, item_chunks := [], path)
+        encoded.append(b"".join(item_chunks))
+    chunks.append(b"S%d:" % len(value))
+    chunks.extend(sorted(encoded))
+
+
+def _encode_dict(value: dict[Any, Any], chunks: list[bytes], path: dict[int, int]) -> None:
+    encoded = []
+    for key, item in value.items():
+        _encode(key, pair_chunks := [], path)
+        _encode(item, pair_chunks, path)
+        encoded.append(b"".join(pair_chunks))
+    chunks.append(b"d%d:" % len(value))
+    chunks.extend(sorted(encoded))
+
+
+_ATOM_ENCODERS: dict[type[Any], Callable[[Any, list[bytes]], None]] = {
+    type(None): lambda _, chunks: chunks.append(b"N"),
+    bool: lambda value, chunks: chunks.append(b"T" if value else b"F"),
+    int: lambda value, chunks: chunks.append(b"i%d;" % value),
+    float: lambda value, chunks: chunks.append(b"f%s;" % value.hex().encode()),
+    str: _encode_str,
+    bytes: _encode_bytes,
+}
+
+_CONTAINER_ENCODERS: dict[type[Any], Callable[[Any, list[bytes], dict[int, int]], None]] = {
+    tuple: _encode_sequence(b"t"),
+    list: _encode_sequence(b"l"),
+    set: _encode_set,
+    frozenset: _encode_set,
+    dict: _encode_dict,
+}
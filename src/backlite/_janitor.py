@@ -0,0 +1,74 @@
+import logging
+import weakref
+from collections.abc import Callable
+from datetime import timedelta
+from threading import Event
+from threading import Thread
+
+logger = logging.getLogger(__name__)
+
+
+class Janitor:
+    """Runs maintenance work periodically in a background thread.
+
+    The janitor only holds a weak reference to its task so that it never keeps the object it
+    maintains alive. It stops once that object is garbage collected.
+    """
+
+    def __init__(
+        self,
+        task: Callable[[], bool],
+        *,
+        interval: timedelta,
+        name: str = "backlite-janitor",
+    ) -> None:
+        """Create a new janitor.
+
+        Args:
+            task:
+                A bound method that does a bounded amount of work and returns whether more
+                work remains. It's called again immediately until it returns False.
+            interval:
+                The time to wait between runs of the task.
+            name:
+                The name of the background thread.
+        """
+        self.interval = interval.total_seconds()
+        self._task = weakref.WeakMethod(task)
+        self._stopped = Event()
+        self._woken = Event()
+        self._thread = Thread(target=self._run, name=name, daemon=True)
+
+    def start(self) -> None:
+        """Start running the task in the background."""
+        self._thread.start()
+
+    def wake(self) -> None:
+        """Run the task as soon as possible instead of waiting for the interval to pass."""
+        self._woken.set()
+
+    def stop(self) -> None:
+        """Stop running the task and wait for the current run to finish."""
+        self._stopped.set()
+        self._woken.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            self._woken.wait(self.interval)
+            self._woken.clear()
+            while not self._stopped.is_set():
+                if (task := self._task()) is None:
+                    return
+                try:
+                    more = task()
+                except Exception:
+                    logger.exception("Maintenance task failed")
+                    break
+                finally:
+                    del task
+                if not more:
+                    break
+            if self._stopped.is_set():
+                return
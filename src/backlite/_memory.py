@@ -0,0 +1,113 @@
+import sqlite3
+import time
+from collections import OrderedDict
+from collections.abc import Collection
+from collections.abc import Mapping
+from datetime import timedelta
+from threading import Lock
+from threading import local
+
+from backlite.types import CacheItem
+
+
+class MemoryCache:
+    """A bounded, least-recently-used, in-process cache of items."""
+
+    def __init__(self, size_limit: int) -> None:
+        self.size_limit = size_limit
+        self._lock = Lock()
+        self._items: OrderedDict[str, tuple[CacheItem, float | None]] = OrderedDict()
+        self._size = 0
+        self._seen = local()
+        self._generation = 0
+
+    @property
+    def generation(self) -> int:
+        """A number that changes whenever items are written, discarded, or cleared.
+
+        Get this before reading items from the database and pass it to `set_many` so they
+        aren't added if they may have been replaced in the meantime.
+        """
+        return self._generation
+
+    def sync(self, conn: sqlite3.Connection) -> None:
+        """Clear the cache if another connection changed the database.
+
+        SQLite's data version only changes when another connection commits, so it's tracked
+        separately for each thread's connection. The first time a connection is seen there's
+        no prior version to compare with so the cache is cleared to be safe.
+        """
+        (version,) = conn.execute("PRAGMA data_version").fetchone()
+        if getattr(self._seen, "state", None) != (conn, version):
+            self.clear()
+            self._seen.state = (conn, version)
+
+    def get_many(self, keys: Collection[str]) -> dict[str, CacheItem]:
+        """Get the unexpired items for the given keys."""
+        now = time.time()
+        found: dict[str, CacheItem] = {}
+        with self._lock:
+            for key in keys:
+                if (entry := self._items.get(key)) is None:
+                    continue
+                item, expires_at = entry
+                if expires_at is None:
+                    found[key] = {**item}
+                elif expires_at > now:
+                    found[key] = {**item, "expiration": timedelta(seconds=expires_at - now)}
+                else:
+                    self._pop(key)
+                    continue
+                self._items.move_to_end(key)
+        return found
+
+    def set_many(self, items: Mapping[str, CacheItem], *, generation: int | None = None) -> None:
+        """Add the given items, evicting the least recently used ones to make room.
+
+        Args:
+            items:
+                The items to add.
+            generation:
+                If given, the items were read from the database and are only added if
+                nothing has been written, discarded, or cleared since this generation.
+                Otherwise they were just written and replace any that were read before.
+        """
+        now = time.time()
+        with self._lock:
+            if generation is None:
+                self._generation += 1
+            elif generation != self._generation:
+                return
+            for key, item in items.items():
+                self._pop(key)
+                value = item["value"]
+                if len(value) > self.size_limit:
+                    continue
+                expiration = item.get("expiration")
+                expires_at = now + expiration.total_seconds() if expiration is not None else None
+                stored = CacheItem(value=value)
+                if (cost := item.get("cost")) is not None:
+                    stored["cost"] = cost
+                self._items[key] = (stored, expires_at)
+                self._size += len(value)
+            while self._size > self.size_limit:
+                _, (item, _) = self._items.popitem(last=False)
+                self._size -= len(item["value"])
+
+    def discard(self, keys: Collection[str]) -> None:
+        """Remove the given keys if present."""
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._pop(key)
+
+    def clear(self) -> None:
+        """Remove all items."""
+        with self._lock:
+            self._generation += 1
+            self._items.clear()
+            self._size = 0
+
+    def _pop(self, key: str) -> None:
+        if (entry := self._items.pop(key, None)) is not None:
+            self._size -= len(entry[0]["value"])
@@ -60,3 +60,22 @@ py_version = Metadata(
 
 total_value_size = Metadata("total_value_size", str, int)
 """The total size of all values in the cache."""
+
+eviction_inflation = Metadata("eviction_inflation", str, float)
+"""The priority of the last item evicted by the greedy-dual-size-frequency policy.
+
+It's added to the priority of items as they're accessed so that those which haven't been
+recently lose out to those which have.
+"""
+
+recent_value_size = Metadata("recent_value_size", str, int)
+"""The total size of the values that haven't been accessed since they were written."""
+
+recent_ghost_size = Metadata("recent_ghost_size", str, int)
+"""The total size of the values of ghosts that hadn't been accessed when evicted."""
+
+frequent_ghost_size = Metadata("frequent_ghost_size", str, int)
+"""The total size of the values of ghosts that had been accessed when evicted."""
+
+adaptive_target = Metadata("adaptive_target", str, float)
+"""The size the adaptive policy aims to keep unaccessed items at before evicting them."""
@@ -0,0 +1,162 @@
+from bisect import bisect_left
+from collections.abc import Iterable
+from threading import Lock
+from typing import cast
+
+from backlite.types import CachedFunctionStats
+from backlite.types import LatencyHistogram
+from backlite.types import MetricsHook
+from backlite.types import StorageStats
+
+LATENCY_BUCKETS = (
+    0.00001,
+    0.00005,
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    float("inf"),
+)
+"""Upper bounds (in seconds) of the buckets operation latencies are counted in."""
+
+COUNTERS = (
+    "hits",
+    "memory_hits",
+    "misses",
+    "sets",
+    "bytes_read",
+    "bytes_written",
+    "evictions",
+    "rejections",
+    "expirations",
+    "expiry_sweeps",
+    "busy_retries",
+)
+"""The names of the counters that are tracked."""
+
+
+class Metrics:
+    """Counters and latency histograms describing the use of a storage."""
+
+    def __init__(self, hook: MetricsHook | None = None) -> None:
+        self.hook = hook
+        self._lock = Lock()
+        self._counters: dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self._latencies: dict[str, tuple[list[int], list[float]]] = {}
+
+    def count(self, **increments: int) -> None:
+        """Increase the given counters."""
+        with self._lock:
+            for name, value in increments.items():
+                self._counters[name] += value
+        if self.hook is not None:
+            for name, value in increments.items():
+                if value:
+                    self.hook(name, value)
+
+    def observe(self, operation: str, seconds: float) -> None:
+        """Record the time it took to perform an operation."""
+        with self._lock:
+            if (entry := self._latencies.get(operation)) is None:
+                entry = self._latencies[operation] = ([0] * len(LATENCY_BUCKETS), [0.0])
+            buckets, total = entry
+            buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            total[0] += seconds
+        if self.hook is not None:
+            self.hook(f"{operation}.seconds", seconds)
+
+    def snapshot(self) -> StorageStats:
+        """Get a copy of the current metrics."""
+        with self._lock:
+            latencies = {
+                operation: LatencyHistogram(
+                    count=sum(buckets),
+                    seconds=total,
+                    buckets=dict(zip(LATENCY_BUCKETS, buckets, strict=True)),
+                )
+                for operation, (buckets, (total,)) in self._latencies.items()
+            }
+            counters = self._counters
+            return StorageStats(
+                hits=counters["hits"],
+                memory_hits=counters["memory_hits"],
+                misses=counters["misses"],
+                sets=counters["sets"],
+                bytes_read=counters["bytes_read"],
+                bytes_written=counters["bytes_written"],
+                evictions=counters["evictions"],
+                rejections=counters["rejections"],
+                expirations=counters["expirations"],
+                expiry_sweeps=counters["expiry_sweeps"],
+                busy_retries=counters["busy_retries"],
+                latencies=latencies,
+            )
+
+
+class FunctionMetrics:
+    """Counters describing the use of a cached function."""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._counters: dict[str, float] = dict.fromkeys(
+            ("hits", "misses", "stale_hits", "refreshes", "compute_seconds"), 0
+        )
+
+    def count(self, **increments: float) -> None:
+        """Increase the given counters."""
+        with self._lock:
+            for name, value in increments.items():
+                self._counters[name] += value
+
+    def snapshot(self) -> CachedFunctionStats:
+        """Get a copy of the current metrics."""
+        with self._lock:
+            counters = self._counters
+            return CachedFunctionStats(
+                hits=int(counters["hits"]),
+                misses=int(counters["misses"]),
+                stale_hits=int(counters["stale_hits"]),
+                refreshes=int(counters["refreshes"]),
+                compute_seconds=counters["compute_seconds"],
+            )
+
+
+def merge_stats(stats: Iterable[StorageStats]) -> StorageStats:
+    """Combine the metrics of several storages."""
+    counters: dict[str, int] = dict.fromkeys(COUNTERS, 0)
+    latencies: dict[str, LatencyHistogram] = {}
+    for s in stats:
+        for name in COUNTERS:
+            counters[name] += s[name]  # type: ignore[literal-required]
+        for operation, histogram in s["latencies"].items():
+            if (merged := latencies.get(operation)) is None:
+                latencies[operation] = LatencyHistogram(
+                    count=histogram["count"],
+                    seconds=histogram["seconds"],
+                    buckets=dict(histogram["buckets"]),
+                )
+            else:
+                merged["count"] += histogram["count"]
+                merged["seconds"] += histogram["seconds"]
+                buckets = cast("dict[float, int]", merged["buckets"])
+                for bound, count in histogram["buckets"].items():
+                    buckets[bound] = buckets.get(bound, 0) + count
+    return StorageStats(
+        hits=counters["hits"],
+        memory_hits=counters["memory_hits"],
+        misses=counters["misses"],
+        sets=counters["sets"],
+        bytes_read=counters["bytes_read"],
+        bytes_written=counters["bytes_written"],
+        evictions=counters["evictions"],
+        rejections=counters["rejections"],
+        expirations=counters["expirations"],
+        expiry_sweeps=counters["expiry_sweeps"],
+        busy_retries=counters["busy_retries"],
+        latencies=latencies,
+    )
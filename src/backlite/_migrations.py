@@ -4,7 +4,7 @@ from collections.abc import Callable
 
 from backlite import _metadata
 
-CURRENT_SCHEMA_VERSION = 1
+CURRENT_SCHEMA_VERSION = 8
 
 
 def run(conn: sqlite3.Connection) -> None:
@@ -26,8 +26,13 @@ def run(conn: sqlite3.Connection) -> None:
 
 def _truncate_if_py_version_changed(conn: sqlite3.Connection) -> None:
     if sys.version_info[:3] != _metadata.py_version.get(conn):
+        # Only the cache is cleared - the schema version must survive or later upgrades
+        # would be re-applied to an already upgraded database.
         conn.execute("DELETE FROM cache")
-        conn.execute("DELETE FROM metadata")
+        _metadata.total_value_size.set(conn, 0)
+        _metadata.eviction_inflation.set(conn, 0.0)
+        conn.execute("DELETE FROM ghosts")
+        _metadata.adaptive_target.set(conn, 0.0)
         _metadata.py_version.set(conn, sys.version_info[:3])
 
 
@@ -74,3 +79,196 @@ def v1(conn: sqlite3.Connection) -> None:
             WHERE key = 'total_value_size';
         END
     """)
+
+
+@UPGRADES.append
+def v2(conn: sqlite3.Connection) -> None:
+    # Store the size of each value so it need not be recomputed when evicting
+    conn.execute("ALTER TABLE cache ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+    conn.execute("UPDATE cache SET size = LENGTH(value)")
+    # Track the total size using the stored size (which may also change on upsert)
+    conn.execute("DROP TRIGGER IF EXISTS total_value_size_on_insert")
+    conn.execute("DROP TRIGGER IF EXISTS total_value_size_on_delete")
+    conn.execute("""
+        CREATE TRIGGER total_value_size_on_insert
+        AFTER INSERT ON cache
+        BEGIN
+            UPDATE metadata
+            SET value = value + NEW.size
+            WHERE key = 'total_value_size';
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER total_value_size_on_update
+        AFTER UPDATE OF size ON cache
+        BEGIN
+            UPDATE metadata
+            SET value = value - OLD.size + NEW.size
+            WHERE key = 'total_value_size';
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER total_value_size_on_delete
+        AFTER DELETE ON cache
+        BEGIN
+            UPDATE metadata
+            SET value = value - OLD.size
+            WHERE key = 'total_value_size';
+        END
+    """)
+    # Resync the total since replaced rows were never subtracted from it
+    conn.execute("""
+        UPDATE metadata
+        SET value = (SELECT COALESCE(SUM(size), 0) FROM cache)
+        WHERE key = 'total_value_size'
+    """)
+    # Index the columns eviction and expiration are ordered by
+    conn.execute("CREATE INDEX cache_accessed_at ON cache (accessed_at)")
+    conn.execute("CREATE INDEX cache_accessed_count ON cache (accessed_count)")
+    conn.execute("CREATE INDEX cache_created_at ON cache (created_at)")
+    conn.execute("CREATE INDEX cache_expires_at ON cache (expires_at)")
+
+
+@UPGRADES.append
+def v3(conn: sqlite3.Connection) -> None:
+    # The codec a value was compressed with (NULL if not compressed)
+    conn.execute("ALTER TABLE cache ADD COLUMN codec TEXT")
+
+
+@UPGRADES.append
+def v4(conn: sqlite3.Connection) -> None:
+    # The name of the file a value is stored in (NULL if stored in the table)
+    conn.execute("ALTER TABLE cache ADD COLUMN external TEXT")
+    # Files whose rows were removed are recorded in the same transaction and deleted after
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS orphaned_blobs (
+            name TEXT PRIMARY KEY
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER orphan_blob_on_delete
+        AFTER DELETE ON cache
+        WHEN OLD.external IS NOT NULL
+        BEGIN
+            INSERT OR IGNORE INTO orphaned_blobs (name) VALUES (OLD.external);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER orphan_blob_on_update
+        AFTER UPDATE OF external ON cache
+        WHEN OLD.external IS NOT NULL AND OLD.external IS NOT NEW.external
+        BEGIN
+            INSERT OR IGNORE INTO orphaned_blobs (name) VALUES (OLD.external);
+        END
+    """)
+
+
+@UPGRADES.append
+def v5(conn: sqlite3.Connection) -> None:
+    # Leases let one process at a time compute the value of a missing key
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            key TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+
+
+@UPGRADES.append
+def v6(conn: sqlite3.Connection) -> None:
+    # The time in seconds it took to compute a value (NULL if unknown)
+    conn.execute("ALTER TABLE cache ADD COLUMN cost REAL")
+
+
+@UPGRADES.append
+def v7(conn: sqlite3.Connection) -> None:
+    # The greedy-dual-size-frequency eviction priority (NULL if not maintained)
+    conn.execute("ALTER TABLE cache ADD COLUMN priority REAL")
+    conn.execute("CREATE INDEX IF NOT EXISTS cache_priority ON cache (priority)")
+    conn.execute("""
+        UPDATE cache SET priority = (accessed_count + 1) * COALESCE(cost, 1.0) / MAX(size, 1)
+    """)
+    _metadata.eviction_inflation.set(conn, 0.0)
+
+
+@UPGRADES.append
+def v8(conn: sqlite3.Connection) -> None:
+    # Track the total size of items that haven't been accessed since they were written
+    _metadata.recent_value_size.set(conn, 0)
+    conn.execute("""
+        CREATE TRIGGER recent_value_size_on_insert
+        AFTER INSERT ON cache
+        WHEN NEW.accessed_count = 0
+        BEGIN
+            UPDATE metadata
+            SET value = value + NEW.size
+            WHERE key = 'recent_value_size';
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER recent_value_size_on_update
+        AFTER UPDATE OF size, accessed_count ON cache
+        WHEN OLD.accessed_count = 0 OR NEW.accessed_count = 0
+        BEGIN
+            UPDATE metadata
+            SET value = value - (OLD.accessed_count = 0) * OLD.size
+                + (NEW.accessed_count = 0) * NEW.size
+            WHERE key = 'recent_value_size';
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER recent_value_size_on_delete
+        AFTER DELETE ON cache
+        WHEN OLD.accessed_count = 0
+        BEGIN
+            UPDATE metadata
+            SET value = value - OLD.size
+            WHERE key = 'recent_value_size';
+        END
+    """)
+    conn.execute("""
+        UPDATE metadata
+        SET value = (SELECT COALESCE(SUM(size), 0) FROM cache WHERE accessed_count = 0)
+        WHERE key = 'recent_value_size'
+    """)
+    # Let the adaptive policy walk each of its lists without visiting the other
+    conn.execute("""
+        CREATE INDEX cache_recent_accessed_at ON cache (accessed_at)
+        WHERE accessed_count = 0
+    """)
+    conn.execute("""
+        CREATE INDEX cache_frequent_accessed_at ON cache (accessed_at)
+        WHERE accessed_count > 0
+    """)
+    # Keys recently evicted by the adaptive policy and whether they had been accessed
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ghosts (
+            key TEXT PRIMARY KEY,
+            frequent INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            evicted_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX ghosts_evicted_at ON ghosts (evicted_at)")
+    _metadata.recent_ghost_size.set(conn, 0)
+    _metadata.frequent_ghost_size.set(conn, 0)
+    conn.execute("""
+        CREATE TRIGGER ghost_size_on_insert
+        AFTER INSERT ON ghosts
+        BEGIN
+            UPDATE metadata
+            SET value = value + NEW.size
+            WHERE key = IIF(NEW.frequent, 'frequent_ghost_size', 'recent_ghost_size');
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER ghost_size_on_delete
+        AFTER DELETE ON ghosts
+        BEGIN
+            UPDATE metadata
+            SET value = value - OLD.size
+            WHERE key = IIF(OLD.frequent, 'frequent_ghost_size', 'recent_ghost_size');
+        END
+    """)
+    _metadata.adaptive_target.set(conn, 0.0)
@@ -0,0 +1,98 @@
+import os
+import sqlite3
+from collections.abc import Mapping
+from pathlib import Path
+from threading import Lock
+from threading import Thread
+from threading import current_thread
+from threading import local
+
+from backlite import _pragmas
+from backlite._tracing import StatementTracer
+from backlite.types import PragmaValue
+
+_INHERITED_CONNECTIONS: list[sqlite3.Connection] = []
+"""Connections inherited from a parent process.
+
+These are kept alive so they are never closed (and thus never checkpoint or unlock the
+database) from inside a forked child process.
+"""
+
+
+class ConnectionPool:
+    """A pool of long-lived SQLite connections - one per thread."""
+
+    def __init__(
+        self,
+        location: Path | str,
+        pragmas: Mapping[str, PragmaValue],
+        *,
+        tracer: StatementTracer | None = None,
+    ) -> None:
+        self.location = location
+        self.pragmas = pragmas
+        self.tracer = tracer
+        self._lock = Lock()
+        self._pid = os.getpid()
+        self._local = local()
+        self._conns: dict[Thread, sqlite3.Connection] = {}
+        self._closed = False
+
+    def get(self) -> sqlite3.Connection:
+        """Get the connection that belongs to the current thread."""
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        if (conn := getattr(self._local, "conn", None)) is None:
+            conn = self._open()
+        return conn
+
+    def close(self) -> None:
+        """Close all connections in the pool."""
+        with self._lock:
+            self._closed = True
+            conns, self._conns = self._conns, {}
+            self._local = local()
+        for conn in conns.values():
+            conn.close()
+
+    def open(self) -> sqlite3.Connection:
+        """Open a connection that isn't part of the pool.
+
+        The caller is responsible for closing it.
+        """
+        if self._closed:
+            msg = "Cannot use a closed storage"
+            raise RuntimeError(msg)
+        return self._connect()
+
+    def _open(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._closed:
+                msg = "Cannot use a closed storage"
+                raise RuntimeError(msg)
+            # Connections belonging to threads that have exited can never be used again.
+            dead = [t for t in self._conns if not t.is_alive()]
+            for thread in dead:
+                self._conns.pop(thread).close()
+            conn = self._connect()
+            self._conns[current_thread()] = conn
+        self._local.conn = conn
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections are only ever used by the thread that opened them. Disabling the
+        # same-thread check allows close() to be called from any thread.
+        conn = (
+            sqlite3.connect(self.location, check_same_thread=False)
+            if self.tracer is None
+            else self.tracer.connect(self.location)
+        )
+        _pragmas.apply(conn, self.pragmas)
+        return conn
+
+    def _reset_after_fork(self) -> None:
+        _INHERITED_CONNECTIONS.extend(self._conns.values())
+        self._lock = Lock()
+        self._pid = os.getpid()
+        self._local = local()
+        self._conns = {}
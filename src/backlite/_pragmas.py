@@ -0,0 +1,57 @@
+import re
+import sqlite3
+from collections.abc import Mapping
+
+from backlite.types import PragmaValue
+from backlite.types import TuningProfile
+
+PRAGMAS_BY_PROFILE: Mapping[TuningProfile, Mapping[str, PragmaValue]] = {
+    "durable": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+    },
+    "fast": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16 * 1024,  # 16 MB
+        "mmap_size": 256 * 1024**2,  # 256 MB
+        "temp_store": "MEMORY",
+    },
+    "ephemeral": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -64 * 1024,  # 64 MB
+        "mmap_size": 1024**3,  # 1 GB
+        "temp_store": "MEMORY",
+    },
+}
+
+
+def resolve(
+    profile: TuningProfile,
+    overrides: Mapping[str, PragmaValue] | None,
+) -> Mapping[str, PragmaValue]:
+    """Get the pragmas for the given profile with the given overrides applied."""
+    pragmas = {**PRAGMAS_BY_PROFILE[profile], **(overrides or {})}
+    for name, value in pragmas.items():
+        if not _PRAGMA_NAME.fullmatch(name):
+            msg = f"Invalid pragma name: {name!r}"
+            raise ValueError(msg)
+        if not isinstance(value, int) and not _PRAGMA_VALUE.fullmatch(value):
+            msg = f"Invalid value for pragma {name!r}: {value!r}"
+            raise ValueError(msg)
+    return pragmas
+
+
+def apply(conn: sqlite3.Connection, pragmas: Mapping[str, PragmaValue]) -> None:
+    """Apply the given pragmas to a connection."""
+    for name, value in pragmas.items():
+        # ok because names and values were validated by resolve()
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+_PRAGMA_NAME = re.compile(r"[A-Za-z_]+")
+_PRAGMA_VALUE = re.compile(r"[A-Za-z0-9_-]+")
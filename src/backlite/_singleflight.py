@@ -0,0 +1,43 @@
+from collections.abc import Callable
+from threading import Lock
+from typing import Generic
+from typing import Protocol
+from typing import TypeVar
+
+
+class _Event(Protocol):
+    def set(self) -> None: ...
+
+
+E = TypeVar("E", bound=_Event)
+
+
+class SingleFlight(Generic[E]):
+    """Tracks which keys are being computed so concurrent callers can wait on one another.
+
+    The first caller to join a key leads and must leave once it's done. Later callers are
+    given an event that's set when the leader leaves.
+    """
+
+    def __init__(self, event_factory: Callable[[], E]) -> None:
+        self._event_factory = event_factory
+        self._lock = Lock()
+        self._flights: dict[str, E] = {}
+
+    def join(self, key: str) -> E | None:
+        """Join the computation of the given key.
+
+        Returns:
+            None if the caller leads the computation, otherwise an event to wait on.
+        """
+        with self._lock:
+            if (event := self._flights.get(key)) is not None:
+                return event
+            self._flights[key] = self._event_factory()
+            return None
+
+    def leave(self, key: str) -> None:
+        """Finish leading the computation of the given key and wake up those waiting on it."""
+        with self._lock:
+            event = self._flights.pop(key)
+        event.set()
@@ -0,0 +1,206 @@
+import re
+import sqlite3
+import time
+from collections.abc import Iterable
+from pathlib import Path
+from threading import Lock
+from typing import Any
+from typing import cast
+
+from backlite.types import StatementStats
+
+_WHITESPACE = re.compile(r"\s+")
+_WAIT_TICKS = 4
+"""The number of instructions at the start of a statement that may wait for locks."""
+
+
+class StatementTracer:
+    """Aggregates the time spent running SQL statements by the shape of their SQL."""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._stats: dict[str, list[float]] = {}
+
+    def connect(self, location: Path | str) -> sqlite3.Connection:
+        """Open a connection whose statements are traced."""
+        conn = sqlite3.connect(location, check_same_thread=False, factory=TracingConnection)
+        conn.install(self)
+        return conn
+
+    def record(
+        self,
+        shape: str,
+        *,
+        calls: int,
+        seconds: float,
+        rows: int,
+        wait_seconds: float,
+    ) -> None:
+        """Add a measurement for the given statement shape."""
+        with self._lock:
+            if (entry := self._stats.get(shape)) is None:
+                entry = self._stats[shape] = [0, 0.0, 0.0, 0, 0.0]
+            entry[0] += calls
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            entry[3] += rows
+            entry[4] += wait_seconds
+
+    def snapshot(self) -> dict[str, StatementStats]:
+        """Get a copy of the aggregated measurements."""
+        with self._lock:
+            return {
+                shape: StatementStats(
+                    count=int(count),
+                    seconds=seconds,
+                    max_seconds=max_seconds,
+                    rows=int(rows),
+                    wait_seconds=wait_seconds,
+                )
+                for shape, (count, seconds, max_seconds, rows, wait_seconds) in self._stats.items()
+            }
+
+    def reset(self) -> None:
+        """Discard all measurements."""
+        with self._lock:
+            self._stats.clear()
+
+
+def statement_shape(sql: str) -> str:
+    """Normalize the whitespace of a statement so that equivalent ones are grouped."""
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+class TracingConnection(sqlite3.Connection):
+    """A connection that reports the statements it runs to a tracer.
+
+    SQLite doesn't report how long a statement waited for a lock so this is measured as
+    the time between SQLite starting a statement (reported by the trace callback) and it
+    running its first few instructions (reported by a progress handler) - locks are taken
+    by the instructions at the start of every statement. SQLite only picks up a
+    progress handler when a statement starts running so it's installed for the duration of
+    each call to execute rather than by the trace callback. Since one call to execute may
+    run several statements (e.g. an implicit BEGIN or trigger bodies) waits are accumulated
+    and attributed to the caller's statement.
+    """
+
+    tracer: StatementTracer
+    _last_tick: float
+    _ticks: int
+    _wait_seconds: float
+
+    def install(self, tracer: StatementTracer) -> None:
+        """Start reporting statements to the given tracer."""
+        self.tracer = tracer
+        self._last_tick = 0.0
+        self._ticks = _WAIT_TICKS
+        self._wait_seconds = 0.0
+        self.set_trace_callback(self._on_statement)
+
+    def cursor(self, factory: Any = None) -> "TracingCursor":
+        """Create a cursor whose statements are traced."""
+        return super().cursor(factory or TracingCursor)
+
+    def execute(self, sql: str, parameters: Any = (), /) -> "TracingCursor":
+        """Run a statement and report it to the tracer."""
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, parameters: Iterable[Any], /) -> "TracingCursor":
+        """Run a statement for each set of parameters and report it to the tracer."""
+        return self.cursor().executemany(sql, parameters)
+
+    def executescript(self, sql_script: str, /) -> "TracingCursor":
+        """Run a script and report it to the tracer as one statement."""
+        return self.cursor().executescript(sql_script)
+
+    def measure_waits(self, enabled: bool) -> None:  # noqa: FBT001
+        """Start or stop measuring the time statements wait before running."""
+        self._ticks = _WAIT_TICKS
+        self.set_progress_handler(self._on_progress if enabled else None, 1)
+
+    def take_wait_seconds(self) -> float:
+        """Get and reset the time statements have waited before running."""
+        wait_seconds, self._wait_seconds = self._wait_seconds, 0.0
+        return wait_seconds
+
+    def _on_statement(self, _: str) -> None:
+        self._last_tick = time.perf_counter()
+        self._ticks = 0
+
+    def _on_progress(self) -> int:
+        if self._ticks < _WAIT_TICKS:
+            now = time.perf_counter()
+            self._wait_seconds += now - self._last_tick
+            self._last_tick = now
+            self._ticks += 1
+        return 0
+
+
+class TracingCursor(sqlite3.Cursor):
+    """A cursor that reports the time spent running and fetching from statements."""
+
+    _shape: str | None = None
+
+    def execute(self, sql: str, parameters: Any = (), /) -> "TracingCursor":
+        return self._run(sql, super().execute, sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Iterable[Any], /) -> "TracingCursor":
+        return self._run(sql, super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script: str, /) -> "TracingCursor":
+        return self._run(sql_script, super().executescript, sql_script)
+
+    def fetchone(self) -> Any:
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._report(time.perf_counter() - start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size: int | None = 1) -> list[Any]:
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._report(time.perf_counter() - start, len(rows))
+        return rows
+
+    def fetchall(self) -> list[Any]:
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._report(time.perf_counter() - start, len(rows))
+        return rows
+
+    def __next__(self) -> Any:
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._report(time.perf_counter() - start, 0)
+            raise
+        self._report(time.perf_counter() - start, 1)
+        return row
+
+    def _run(self, sql: str, method: Any, *args: Any) -> "TracingCursor":
+        conn = cast("TracingConnection", self.connection)
+        self._shape = statement_shape(sql)
+        # Discard waits from statements that weren't run by a cursor (e.g. a COMMIT)
+        conn.take_wait_seconds()
+        changes = conn.total_changes
+        conn.measure_waits(True)
+        start = time.perf_counter()
+        try:
+            method(*args)
+        finally:
+            conn.measure_waits(False)
+            self._report(time.perf_counter() - start, conn.total_changes - changes, calls=1)
+        return self
+
+    def _report(self, seconds: float, rows: int, *, calls: int = 0) -> None:
+        if self._shape is None:
+            return
+        conn = cast("TracingConnection", self.connection)
+        conn.tracer.record(
+            self._shape,
+            calls=calls,
+            seconds=seconds,
+            rows=rows,
+            wait_seconds=conn.take_wait_seconds(),
+        )
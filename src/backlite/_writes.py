@@ -0,0 +1,113 @@
+import time
+from collections.abc import Collection
+from collections.abc import Iterator
+from collections.abc import Mapping
+from contextlib import contextmanager
+from datetime import timedelta
+from threading import Lock
+
+from backlite.types import CacheItem
+
+
+class WriteBuffer:
+    """Queues written items in memory so they can be written to the database in bulk.
+
+    Items stay visible to readers from the moment they're added until the batch they're
+    part of has been written.
+    """
+
+    def __init__(self, *, flush_count: int, flush_size: int) -> None:
+        self.flush_count = flush_count
+        self.flush_size = flush_size
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._pending: dict[str, tuple[CacheItem, float]] = {}
+        self._flushing: dict[str, tuple[CacheItem, float]] = {}
+        self._size = 0
+
+    @property
+    def pending(self) -> bool:
+        """Whether there are queued items that have not been written."""
+        return bool(self._pending)
+
+    @property
+    def overflowing(self) -> bool:
+        """Whether items are being queued much faster than they're written."""
+        return len(self._pending) >= 2 * self.flush_count or self._size >= 2 * self.flush_size
+
+    def add(self, items: Mapping[str, CacheItem]) -> bool:
+        """Queue the given items, replacing any queued items with the same keys.
+
+        Returns:
+            Whether the buffer is due to be flushed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for key, item in items.items():
+                if (old := self._pending.pop(key, None)) is not None:
+                    self._size -= len(old[0]["value"])
+                self._pending[key] = (item, now)
+                self._size += len(item["value"])
+            return len(self._pending) >= self.flush_count or self._size >= self.flush_size
+
+    def discard(self, keys: Collection[str]) -> None:
+        """Remove the given keys from the queue if present.
+
+        Waits for any batch that's being written so it can't overwrite the keys afterwards.
+        """
+        with self._flush_lock, self._lock:
+            for key in keys:
+                if (old := self._pending.pop(key, None)) is not None:
+                    self._size -= len(old[0]["value"])
+
+    def get_many(self, keys: Collection[str] | None) -> dict[str, CacheItem | None]:
+        """Get the queued items for the given keys (or all of them).
+
+        Keys whose queued items have expired map to None since those items still replace
+        whatever is in the database.
+        """
+        now = time.monotonic()
+        found: dict[str, CacheItem | None] = {}
+        with self._lock:
+            # Items queued since a batch started being written are the more recent ones
+            for entries in (self._flushing, self._pending):
+                for key in entries if keys is None else keys:
+                    if (entry := entries.get(key)) is not None:
+                        item = _age(*entry, now)
+                        expiration = item.get("expiration")
+                        expired = expiration is not None and expiration <= timedelta(0)
+                        found[key] = None if expired else item
+        return found
+
+    @contextmanager
+    def flush(self) -> Iterator[dict[str, CacheItem]]:
+        """Take the queued items to write them.
+
+        The items remain visible to readers until the context exits. If an error is raised,
+        items that haven't been queued again since are put back in the queue.
+        """
+        with self._flush_lock:
+            now = time.monotonic()
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+                self._size = 0
+                items = {key: _age(*entry, now) for key, entry in self._flushing.items()}
+            try:
+                yield items
+            except BaseException:
+                with self._lock:
+                    for key, entry in self._flushing.items():
+                        if key not in self._pending:
+                            self._pending[key] = entry
+                            self._size += len(entry[0]["value"])
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+
+def _age(item: CacheItem, queued_at: float, now: float) -> CacheItem:
+    # Expirations count from when the item was queued rather than when it's written
+    if (expiration := item.get("expiration")) is None:
+        return item
+    return {**item, "expiration": expiration - timedelta(seconds=now - queued_at)}
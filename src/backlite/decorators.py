@@ -1,104 +1,419 @@
-import pickle
+import asyncio
+import logging
+import math
+import random
+import time
 from collections.abc import Awaitable
 from collections.abc import Callable
 from collections.abc import Coroutine
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import AbstractAsyncContextManager
 from contextlib import AbstractContextManager
+from contextlib import nullcontext
+from datetime import timedelta
+from functools import cache
 from functools import wraps
-from inspect import Signature
+from hashlib import blake2b
 from inspect import signature
+from threading import Event
 from typing import Any
 from typing import ParamSpec
 from typing import TypeAlias
 from typing import TypeVar
+from typing import cast
 
+import anyio
 from anyio.to_thread import run_sync
 from paramorator import paramorator
 
+from backlite._hashing import param_hash
+from backlite._metrics import FunctionMetrics
+from backlite._singleflight import SingleFlight
+from backlite.serializers import DEFAULT_SERIALIZER
+from backlite.storage import AsyncStorage
+from backlite.storage import ShardedStorage
 from backlite.storage import Storage
+from backlite.types import CachedFunction
+from backlite.types import CacheItem
+from backlite.types import ParamHashFunc
+from backlite.types import Serializer
 
 P = ParamSpec("P")
 R = TypeVar("R")
 AsyncCallable: TypeAlias = Callable[P, Awaitable[R]]
 CoroCallable: TypeAlias = Callable[P, Coroutine[None, None, R]]
 
+logger = logging.getLogger(__name__)
+
 
 @paramorator
 def cached(
     func: Callable[P, R],
     *,
-    storage: Storage,
+    storage: Storage | ShardedStorage,
     barrier: AbstractContextManager | None = None,
-) -> Callable[P, R]:
-    """Decorate a function to cache its result."""
+    hash_func: ParamHashFunc = param_hash,
+    serializer: Serializer = DEFAULT_SERIALIZER,
+    single_flight: bool = True,
+    lease: timedelta | None = None,
+    expiration: timedelta | Callable[[R], timedelta | None] | None = None,
+    stale_while_revalidate: timedelta | None = None,
+    early_refresh: float | None = None,
+) -> CachedFunction[P, R]:
+    """Decorate a function to cache its result.
+
+    The decorated function has a `cache_stats()` method that returns a snapshot of its
+    [`CachedFunctionStats`][backlite.types.CachedFunctionStats].
+
+    Args:
+        func:
+            The function to decorate.
+        storage:
+            Where to cache the function's results.
+        barrier:
+            A context manager entered before calling the function when its result is not
+            already cached.
+        hash_func:
+            Generates the cache key for the function's parameters. By default, parameters
+            are bound to the function's signature and digested in a way that is stable
+            across processes and does not require them to be hashable.
+        serializer:
+            Converts the function's results to and from bytes. Uses pickle by default.
+            Results written by a different type of serializer are treated as misses.
+        single_flight:
+            Whether concurrent calls in this process that miss the same key should wait for
+            the first of them to compute the result instead of each calling the function.
+        lease:
+            If given, calls that miss a key first acquire a lease on it in the storage so
+            that only one process at a time computes the result. Others poll the storage
+            until the result is cached or the lease is released. A lease that's never
+            released (e.g. because its process died) expires after this duration.
+        expiration:
+            The time until a cached result expires, or a function that computes it from the
+            result. Defaults to the storage's default expiration.
+        stale_while_revalidate:
+            How long after a result expires it may still be returned while a new result is
+            computed in a background thread.
+        early_refresh:
+            If given, results may be recomputed before they expire with a probability that
+            grows as expiration nears and the longer the result took to compute. Larger
+            values refresh earlier - 1.0 is a good default. Recomputation happens in the
+            background when `stale_while_revalidate` is set.
+    """
     sig = signature(func)
+    flights = SingleFlight(Event) if single_flight else None
+    refreshing = SingleFlight(Event)
+    metrics = FunctionMetrics()
+    tag = _serializer_tag(serializer)
 
-    def _run(key: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> R:
-        if (item := storage.get_one(key)) is not None:
-            value = pickle.loads(item["value"])
-        else:
-            value = func(*args, **kwargs)
-            storage.set_one(key, {"value": pickle.dumps(value)})
+    def _hit(item: CacheItem) -> R:
+        metrics.count(hits=1)
+        return _load(item)
+
+    def _load(item: CacheItem) -> R:
+        return serializer.loads(memoryview(item["value"])[len(tag) :])
+
+    def _refresh(key: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> R:
+        start = time.perf_counter()
+        value = func(*args, **kwargs)
+        cost = time.perf_counter() - start
+        metrics.count(compute_seconds=cost)
+        expires = expiration(value) if callable(expiration) else expiration
+        storage.set_one(
+            key, _make_item(tag + serializer.dumps(value), cost, expires, stale_while_revalidate)
+        )
         return value
 
-    if barrier:
+    def _refresh_in_background(key: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> None:
+        if refreshing.join(key) is not None:
+            return
+
+        def run() -> None:
+            try:
+                token = storage.acquire_lease(key, lease) if lease is not None else None
+                if lease is not None and token is None:
+                    return  # another process is already refreshing
+                try:
+                    _refresh(key, args, kwargs)
+                    metrics.count(refreshes=1)
+                finally:
+                    if token is not None:
+                        storage.release_lease(key, token)
+            except Exception:
+                logger.exception("Failed to refresh cached result of %r", func)
+            finally:
+                refreshing.leave(key)
+
+        _refresh_executor().submit(run)
 
-        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
-            key = _param_hash_func(sig, args, kwargs)
-            if (item := storage.get_one(key)) is not None:
-                return pickle.loads(item["value"])
-            else:
-                with barrier:
-                    return _run(key, args, kwargs)
+    def _compute(key: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> R:
+        with barrier or nullcontext():
+            # The result may have been cached while waiting
+            if (item := _readable(storage.get_one(key), tag)) is not None:
+                return _hit(item)
+            metrics.count(misses=1)
+            return _refresh(key, args, kwargs)
 
-    else:
+    def _lease_and_compute(key: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> R:
+        if lease is None:
+            return _compute(key, args, kwargs)
+        while (token := storage.acquire_lease(key, lease)) is None:
+            time.sleep(_LEASE_POLL_INTERVAL)
+            if (item := _readable(storage.get_one(key), tag)) is not None:
+                return _hit(item)
+        try:
+            return _compute(key, args, kwargs)
+        finally:
+            storage.release_lease(key, token)
 
-        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
-            key = _param_hash_func(sig, args, kwargs)
-            return _run(key, args, kwargs)
+    def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+        key = hash_func(sig, args, kwargs)
+        while True:
+            if (item := _readable(storage.get_one(key), tag)) is not None:
+                if not _needs_refresh(item, stale_while_revalidate, early_refresh):
+                    return _hit(item)
+                if stale_while_revalidate is None:
+                    metrics.count(refreshes=1)
+                    return _refresh(key, args, kwargs)
+                metrics.count(stale_hits=1)
+                _refresh_in_background(key, args, kwargs)
+                return _load(item)
+            if flights is None:
+                return _lease_and_compute(key, args, kwargs)
+            if (flight := flights.join(key)) is None:
+                try:
+                    return _lease_and_compute(key, args, kwargs)
+                finally:
+                    flights.leave(key)
+            # Check the cache again once the leader is done (or try to lead if it failed)
+            flight.wait()
 
-    return wraps(func)(wrapper)
+    wrapped = wraps(func)(wrapper)
+    wrapped.cache_stats = metrics.snapshot  # type: ignore[attr-defined]
+    return cast("CachedFunction[P, R]", wrapped)
 
 
 @paramorator
 def async_cached(
     func: AsyncCallable[P, R],
-    storage: Storage,
+    storage: Storage | ShardedStorage | AsyncStorage,
     *,
     barrier: AbstractContextManager | AbstractAsyncContextManager | None = None,
-) -> CoroCallable[P, R]:
-    """Decorate an async function to cache its result."""
+    hash_func: ParamHashFunc = param_hash,
+    serializer: Serializer = DEFAULT_SERIALIZER,
+    single_flight: bool = True,
+    lease: timedelta | None = None,
+    expiration: timedelta | Callable[[R], timedelta | None] | None = None,
+    stale_while_revalidate: timedelta | None = None,
+    early_refresh: float | None = None,
+) -> CachedFunction[P, Coroutine[None, None, R]]:
+    """Decorate an async function to cache its result.
+
+    Storage operations are run in worker threads so they don't block the event loop. The
+    decorated function has a `cache_stats()` method that returns a snapshot of its
+    [`CachedFunctionStats`][backlite.types.CachedFunctionStats].
+
+    Args:
+        func:
+            The function to decorate.
+        storage:
+            Where to cache the function's results. A [`Storage`][backlite.storage.Storage] or
+            [`ShardedStorage`][backlite.storage.ShardedStorage] is automatically wrapped in an
+            [`AsyncStorage`][backlite.storage.AsyncStorage].
+        barrier:
+            A sync or async context manager entered before calling the function when its
+            result is not already cached.
+        hash_func:
+            Generates the cache key for the function's parameters. By default, parameters
+            are bound to the function's signature and digested in a way that is stable
+            across processes and does not require them to be hashable.
+        serializer:
+            Converts the function's results to and from bytes. Uses pickle by default.
+            Results written by a different type of serializer are treated as misses.
+        single_flight:
+            Whether concurrent calls in this event loop that miss the same key should wait
+            for the first of them to compute the result instead of each calling the function.
+        lease:
+            If given, calls that miss a key first acquire a lease on it in the storage so
+            that only one process at a time computes the result. Others poll the storage
+            until the result is cached or the lease is released. A lease that's never
+            released (e.g. because its process died) expires after this duration.
+        expiration:
+            The time until a cached result expires, or a function that computes it from the
+            result. Defaults to the storage's default expiration.
+        stale_while_revalidate:
+            How long after a result expires it may still be returned while a new result is
+            computed in a background task.
+        early_refresh:
+            If given, results may be recomputed before they expire with a probability that
+            grows as expiration nears and the longer the result took to compute. Larger
+            values refresh earlier - 1.0 is a good default. Recomputation happens in the
+            background when `stale_while_revalidate` is set.
+    """
     sig = signature(func)
+    async_storage = storage if isinstance(storage, AsyncStorage) else AsyncStorage(storage)
+    flights = SingleFlight(anyio.Event) if single_flight else None
+    async_barrier = (
+        barrier
+        if barrier is None or isinstance(barrier, AbstractAsyncContextManager)
+        else _AsyncContextWrapper(barrier)
+    )
 
-    async def _run(key: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> R:
-        if (item := storage.get_one(key)) is not None:
-            value = pickle.loads(item["value"])
-        else:
-            value = await func(*args, **kwargs)
-            storage.set_one(key, {"value": pickle.dumps(value)})
-        return value
+    refreshing = SingleFlight(anyio.Event)
+    metrics = FunctionMetrics()
+    tag = _serializer_tag(serializer)
+
+    def _hit(item: CacheItem) -> R:
+        metrics.count(hits=1)
+        return _load(item)
 
-    if barrier:
-        async_barrier = (
-            barrier
-            if isinstance(barrier, AbstractAsyncContextManager)
-            else _AsyncContextWrapper(barrier)
+    def _load(item: CacheItem) -> R:
+        return serializer.loads(memoryview(item["value"])[len(tag) :])
+
+    async def _refresh(key: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> R:
+        start = time.perf_counter()
+        value = await func(*args, **kwargs)
+        cost = time.perf_counter() - start
+        metrics.count(compute_seconds=cost)
+        expires = expiration(value) if callable(expiration) else expiration
+        await async_storage.set_one(
+            key, _make_item(tag + serializer.dumps(value), cost, expires, stale_while_revalidate)
         )
+        return value
+
+    async def _refresh_in_background(
+        key: str, args: tuple[Any, ...], kwargs: dict[str, Any]
+    ) -> None:
+        if refreshing.join(key) is not None:
+            return
+
+        async def run() -> None:
+            try:
+                token = await async_storage.acquire_lease(key, lease) if lease is not None else None
+                if lease is not None and token is None:
+                    return  # another process is already refreshing
+                try:
+                    await _refresh(key, args, kwargs)
+                    metrics.count(refreshes=1)
+                finally:
+                    if token is not None:
+                        await async_storage.release_lease(key, token)
+            except Exception:
+                logger.exception("Failed to refresh cached result of %r", func)
+            finally:
+                refreshing.leave(key)
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Background tasks need asyncio - other event loops refresh before returning
+            await run()
+        else:
+            task = loop.create_task(run())
+            _BACKGROUND_TASKS.add(task)
+            task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+    async def _compute(key: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> R:
+        async with async_barrier or nullcontext():
+            # The result may have been cached while waiting
+            if (item := _readable(await async_storage.get_one(key), tag)) is not None:
+                return _hit(item)
+            metrics.count(misses=1)
+            return await _refresh(key, args, kwargs)
+
+    async def _lease_and_compute(key: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> R:
+        if lease is None:
+            return await _compute(key, args, kwargs)
+        while (token := await async_storage.acquire_lease(key, lease)) is None:
+            await anyio.sleep(_LEASE_POLL_INTERVAL)
+            if (item := _readable(await async_storage.get_one(key), tag)) is not None:
+                return _hit(item)
+        try:
+            return await _compute(key, args, kwargs)
+        finally:
+            await async_storage.release_lease(key, token)
+
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+        key = hash_func(sig, args, kwargs)
+        while True:
+            if (item := _readable(await async_storage.get_one(key), tag)) is not None:
+                if not _needs_refresh(item, stale_while_revalidate, early_refresh):
+                    return _hit(item)
+                if stale_while_revalidate is None:
+                    metrics.count(refreshes=1)
+                    return await _refresh(key, args, kwargs)
+                metrics.count(stale_hits=1)
+                await _refresh_in_background(key, args, kwargs)
+                return _load(item)
+            if flights is None:
+                return await _lease_and_compute(key, args, kwargs)
+            if (flight := flights.join(key)) is None:
+                try:
+                    return await _lease_and_compute(key, args, kwargs)
+                finally:
+                    flights.leave(key)
+            # Check the cache again once the leader is done (or try to lead if it failed)
+            await flight.wait()
+
+    wrapper.cache_stats = metrics.snapshot  # type: ignore[attr-defined]
+    return cast("CachedFunction[P, Coroutine[None, None, R]]", wrapper)
+
+
+_LEASE_POLL_INTERVAL = 0.05
+"""Seconds to wait between checks for a result being computed by another process."""
+
+_BACKGROUND_TASKS: set[asyncio.Task[None]] = set()
+"""Strong references to background refresh tasks so they aren't garbage collected."""
 
-        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
-            key = _param_hash_func(sig, args, kwargs)
-            if (item := storage.get_one(key)) is not None:
-                return pickle.loads(item["value"])
-            else:
-                async with async_barrier:
-                    return await _run(key, args, kwargs)
-    else:
 
-        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
-            key = _param_hash_func(sig, args, kwargs)
-            return await _run(key, args, kwargs)
+@cache
+def _refresh_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(thread_name_prefix="backlite-refresh")
 
-    return wrapper
+
+def _serializer_tag(serializer: Serializer) -> bytes:
+    # Results are prefixed with a tag identifying the type of serializer that wrote them
+    cls = type(serializer)
+    return blake2b(f"{cls.__module__}.{cls.__qualname__}".encode(), digest_size=4).digest()
+
+
+def _readable(item: CacheItem | None, tag: bytes) -> CacheItem | None:
+    # Results written by a different type of serializer can't be read so they're misses
+    if item is None or item["value"][: len(tag)] != tag:
+        return None
+    return item
+
+
+def _make_item(
+    value: bytes,
+    cost: float,
+    expiration: timedelta | None,
+    stale_while_revalidate: timedelta | None,
+) -> CacheItem:
+    item = CacheItem(value=value, cost=cost)
+    if expiration is not None:
+        item["expiration"] = expiration
+    if stale_while_revalidate is not None:
+        # Stale results are kept around for long enough to be served while refreshing. The
+        # storage adds this after applying its default expiration and jitter.
+        item["stale_while_revalidate"] = stale_while_revalidate
+    return item
+
+
+def _needs_refresh(
+    item: CacheItem,
+    stale_while_revalidate: timedelta | None,
+    early_refresh: float | None,
+) -> bool:
+    if (expiration := item.get("expiration")) is None:
+        return False
+    remaining = (expiration - (stale_while_revalidate or timedelta())).total_seconds()
+    if remaining <= 0:
+        return True
+    if early_refresh is None or (cost := item.get("cost")) is None:
+        return False
+    # XFetch - see "Optimal Probabilistic Cache Stampede Prevention" (Vattani et al.)
+    return -cost * early_refresh * math.log(1 - random.random()) >= remaining  # noqa: S311
 
 
 class _AsyncContextWrapper:
@@ -110,7 +425,3 @@ class _AsyncContextWrapper:
 
     async def __aexit__(self, *args: Any) -> bool | None:
         return await run_sync(self.ctx.__exit__, *args)
-
-
-def _param_hash_func(_: Signature, args: tuple[Any, ...], kwargs: dict[str, Any]) -> str:
-    return str(hash((args, frozenset(kwargs.items()))))
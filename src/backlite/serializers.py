@@ -0,0 +1,67 @@
+import json
+import pickle
+from typing import Any
+
+
+class PickleSerializer:
+    """Serializes values with [`pickle`][pickle]."""
+
+    def __init__(self, protocol: int = pickle.HIGHEST_PROTOCOL) -> None:
+        """Create a new pickle serializer.
+
+        Args:
+            protocol: The pickle protocol to use.
+        """
+        self.protocol = protocol
+
+    def dumps(self, value: Any, /) -> bytes:
+        """Serialize the given value."""
+        return pickle.dumps(value, protocol=self.protocol)
+
+    def loads(self, data: bytes | memoryview, /) -> Any:
+        """Deserialize the given data."""
+        return pickle.loads(data)
+
+
+class JsonSerializer:
+    """Serializes JSON-compatible values with [`json`][json].
+
+    This is faster than pickle for large structures of primitive types and produces output
+    that compresses well.
+    """
+
+    def dumps(self, value: Any, /) -> bytes:
+        """Serialize the given value."""
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+    def loads(self, data: bytes | memoryview, /) -> Any:
+        """Deserialize the given data."""
+        return json.loads(data if isinstance(data, bytes) else bytes(data))
+
+
+class MsgpackSerializer:
+    """Serializes values with [`msgpack`](https://msgpack.org/).
+
+    Requires the `msgpack` package to be installed.
+    """
+
+    def __init__(self) -> None:
+        try:
+            import msgpack  # pyright: ignore[reportMissingImports]
+        except ImportError:  # nocov
+            msg = "MsgpackSerializer requires the 'msgpack' package to be installed"
+            raise ImportError(msg) from None
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+
+    def dumps(self, value: Any, /) -> bytes:
+        """Serialize the given value."""
+        return self._packb(value)
+
+    def loads(self, data: bytes | memoryview, /) -> Any:
+        """Deserialize the given data."""
+        return self._unpackb(data)
+
+
+DEFAULT_SERIALIZER = PickleSerializer()
+"""The serializer used by decorators by default."""
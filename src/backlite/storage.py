@@ -1,18 +1,63 @@
+import os
+import random
+import shutil
 import sqlite3
+import time
 from collections.abc import Callable
 from collections.abc import Collection
+from collections.abc import Iterable
 from collections.abc import Iterator
 from collections.abc import Mapping
-from contextlib import AbstractContextManager
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from contextlib import contextmanager
 from datetime import timedelta
+from io import BytesIO
+from itertools import count
 from pathlib import Path
+from threading import local
+from types import TracebackType
+from typing import Any
+from typing import BinaryIO
+from typing import Self
+from typing import TypeVar
+from uuid import uuid4
+
+from anyio import CapacityLimiter
+from anyio.to_thread import run_sync
 
 from backlite import _commands
+from backlite import _export
 from backlite import _migrations
+from backlite import _pragmas
+from backlite._access import AccessBuffer
+from backlite._admission import FrequencySketch
+from backlite._blobs import BlobStore
+from backlite._hashing import jump_hash
+from backlite._janitor import Janitor
+from backlite._memory import MemoryCache
+from backlite._metrics import Metrics
+from backlite._metrics import merge_stats
+from backlite._pool import ConnectionPool
+from backlite._tracing import StatementTracer
+from backlite._writes import WriteBuffer
+from backlite.types import ADMISSION_POLICIES
+from backlite.types import COMPRESSIONS
 from backlite.types import EVICTION_POLICIES
+from backlite.types import TUNING_PROFILES
+from backlite.types import AdmissionPolicy
 from backlite.types import CacheItem
+from backlite.types import Compression
 from backlite.types import EvictionPolicy
+from backlite.types import MetricsHook
+from backlite.types import PragmaValue
+from backlite.types import StatementStats
+from backlite.types import StorageStats
+from backlite.types import TuningProfile
+from backlite.types import ValueReader
+from backlite.types import ValueWriter
+
+T = TypeVar("T")
 
 
 class Storage:
@@ -24,7 +69,27 @@ class Storage:
         *,
         size_limit: int = 1024**3,  # 1 GB
         eviction_policy: EvictionPolicy = "least-recently-used",
+        admission_policy: AdmissionPolicy | None = None,
+        admission_sample_size: int = 100_000,
         default_expiration: timedelta | None = None,
+        expiration_jitter: float = 0.0,
+        tuning: TuningProfile = "fast",
+        pragmas: Mapping[str, PragmaValue] | None = None,
+        access_flush_interval: timedelta | None = None,
+        access_flush_count: int = 1000,
+        memory_limit: int | None = None,
+        compression: Compression | None = None,
+        compression_threshold: int = 1024,
+        external_threshold: int | None = None,
+        janitor_interval: timedelta | None = None,
+        janitor_batch_size: int = 1000,
+        metrics_hook: MetricsHook | None = None,
+        trace_statements: bool = False,
+        busy_timeout: timedelta | None = None,
+        write_timeout: timedelta = timedelta(seconds=30),
+        write_flush_interval: timedelta | None = None,
+        write_flush_count: int = 1000,
+        write_flush_size: int = 16 * 1024**2,  # 16 MB
     ) -> None:
         """Create a new storage.
 
@@ -37,29 +102,333 @@ class Storage:
                 of the SQLite file itself.
             eviction_policy:
                 The eviction policy to use.
+            admission_policy:
+                If given, decides whether a new item is worth evicting others to make room
+                for. See [`AdmissionPolicy`][backlite.types.AdmissionPolicy] for the available
+                policies. Items that replace existing ones are always written. How often keys
+                are used is tracked in memory so it's only known to this storage and starts
+                over when it's created.
+            admission_sample_size:
+                The number of key uses after which the admission policy halves its record of
+                how often keys have been used so that it adapts to changes in popularity.
             default_expiration:
                 The default expiration time for items in the cache. If not specified, items will
                 never expire unless explicitly declared at the time of setting.
+            expiration_jitter:
+                Shortens the expiration time of each item by a random fraction of up to this
+                much (between 0 and 1). This keeps items written together from expiring at the
+                same moment and being recomputed all at once.
+            tuning:
+                The named set of SQLite pragmas to apply to each connection. See
+                [`TuningProfile`][backlite.types.TuningProfile] for the available profiles.
+            pragmas:
+                Raw SQLite pragmas to apply to each connection. These take precedence over
+                those of the tuning profile.
+            access_flush_interval:
+                If given, access statistics (used by the eviction policy) are buffered in memory
+                and written in bulk instead of on every read. This keeps reads from taking the
+                database's write lock at the cost of approximate recency and frequency data.
+                Buffered statistics are written once this much time has passed since they were
+                last written, before evicting, when the storage is flushed, or when it's closed.
+            access_flush_count:
+                When access statistics are buffered, write them once this many accesses have
+                been recorded.
+            memory_limit:
+                If given, recently used items are also kept in an in-process cache that's
+                consulted before the database. This is the approximate limit on the total size
+                of its values in bytes. The in-process cache is cleared whenever another
+                connection changes the database. Reads served from memory only update the
+                database's access statistics when `access_flush_interval` is set.
+            compression:
+                The algorithm used to compress stored values. Values are only stored compressed
+                when that makes them smaller. The algorithm is recorded alongside each value so
+                that it can be read even if this setting changes later.
+            compression_threshold:
+                The minimum size of a value in bytes for it to be compressed.
+            external_threshold:
+                If given, values at least this many bytes long are stored in files in a
+                `<location>.blobs` directory next to the database instead of in the database
+                itself. These values are not compressed and are read back as memory-mapped
+                views rather than being copied into memory. Files are removed once their
+                items are evicted, expire, or are replaced.
+            janitor_interval:
+                If given, expired items are removed and the size limit is enforced by a
+                background thread that runs this often instead of before every write. Writes
+                then no longer wait for eviction, so the cache may temporarily exceed its size
+                limit between runs. The thread is stopped when the storage is closed.
+            janitor_batch_size:
+                The maximum number of items the background thread removes per transaction.
+                It keeps removing batches until there's nothing left to remove.
+            metrics_hook:
+                Called with each metric as it's recorded, e.g. to export them to a metrics
+                system. See [`MetricsHook`][backlite.types.MetricsHook] for details.
+            trace_statements:
+                Whether to measure every SQL statement the storage runs. Measurements are
+                grouped by the statement's SQL and returned by `statement_stats()`. This adds
+                overhead to every statement so it's meant for diagnosing slow queries.
+            busy_timeout:
+                How long SQLite waits for a lock held by another connection before giving up.
+                Overrides the `busy_timeout` pragma of the tuning profile (5 seconds).
+            write_timeout:
+                The longest time to keep trying to start a write transaction. Write
+                transactions take the database's write lock when they begin. If that's still
+                held by another connection after the busy timeout, it's retried with jittered
+                exponential backoff until this much time has passed. Retries are counted by
+                the `busy_retries` metric and the time taken to get the lock is recorded in
+                the `begin_write` latency histogram.
+            write_flush_interval:
+                If given, written items are queued in memory and written to the database in
+                bulk by a background thread that runs this often. Queued items are visible to
+                reads from this storage (but not others) right away. They're also written
+                when the storage is flushed or closed, and are lost if the process exits
+                first.
+            write_flush_count:
+                When writes are queued, write them once this many items are queued.
+            write_flush_size:
+                When writes are queued, write them once the queued values add up to this
+                many bytes.
         """
         if eviction_policy not in EVICTION_POLICIES:
             msg = f"Invalid eviction policy: {eviction_policy!r}"
             raise ValueError(msg)
+        if admission_policy is not None and admission_policy not in ADMISSION_POLICIES:
+            msg = f"Invalid admission policy: {admission_policy!r}"
+            raise ValueError(msg)
+        if tuning not in TUNING_PROFILES:
+            msg = f"Invalid tuning profile: {tuning!r}"
+            raise ValueError(msg)
+        if not 0 <= expiration_jitter <= 1:
+            msg = f"Expiration jitter must be between 0 and 1, not {expiration_jitter!r}"
+            raise ValueError(msg)
+        if compression is not None and compression not in COMPRESSIONS:
+            msg = f"Invalid compression: {compression!r}"
+            raise ValueError(msg)
 
-        self._connect = _connector(location)
+        self._metrics = Metrics(metrics_hook)
+        if busy_timeout is not None:
+            pragmas = {**(pragmas or {}), "busy_timeout": int(busy_timeout.total_seconds() * 1000)}
+        self._tracer = StatementTracer() if trace_statements else None
+        self._pool = ConnectionPool(
+            location, _pragmas.resolve(tuning, pragmas), tracer=self._tracer
+        )
+        self._write_timeout = write_timeout.total_seconds()
         self._eviction_policy: EvictionPolicy = eviction_policy
+        self._prioritize = eviction_policy == "greedy-dual-size-frequency"
+        self._adaptive = eviction_policy == "adaptive"
+        self._admission = (
+            FrequencySketch(admission_sample_size) if admission_policy is not None else None
+        )
         self._size_limit = size_limit
         self._default_expiration = default_expiration
+        self._expiration_jitter = expiration_jitter
+        self._access_buffer = (
+            AccessBuffer(flush_interval=access_flush_interval, flush_count=access_flush_count)
+            if access_flush_interval is not None
+            else None
+        )
+        self._memory = MemoryCache(memory_limit) if memory_limit is not None else None
+        self._writing = local()
+        self._write_buffer = (
+            WriteBuffer(flush_count=write_flush_count, flush_size=write_flush_size)
+            if write_flush_interval is not None
+            else None
+        )
+        self._writer = (
+            Janitor(self._flush_writes, interval=write_flush_interval, name="backlite-writer")
+            if write_flush_interval is not None
+            else None
+        )
+        self._compression: Compression | None = compression
+        self._compression_threshold = compression_threshold
+        self._blobs = BlobStore(Path(f"{location}.blobs"), external_threshold)
+        self._janitor_batch_size = janitor_batch_size
+        self._janitor = (
+            Janitor(self._run_maintenance, interval=janitor_interval)
+            if janitor_interval is not None
+            else None
+        )
 
         self._init()
 
     def _init(self) -> None:
-        with self._connect() as conn:
+        with self._connect(write=True) as conn:
             _migrations.run(conn)
-            _commands.evict_cache_items(
-                conn,
-                size_limit=self._size_limit,
-                policy=self._eviction_policy,
-            )
+            if self._janitor is None:
+                self._evict(conn, self._size_limit)
+        self._remove_orphaned_blobs()
+        if self._janitor is not None:
+            self._janitor.start()
+        if self._writer is not None:
+            self._writer.start()
+
+    def stats(self) -> StorageStats:
+        """Get a snapshot of this storage's metrics since it was created."""
+        return self._metrics.snapshot()
+
+    def statement_stats(self, *, reset: bool = False) -> dict[str, StatementStats]:
+        """Get measurements of the SQL statements run since the storage was created.
+
+        Statements are only measured if the storage was created with `trace_statements`.
+
+        Args:
+            reset:
+                Whether to discard the measurements after getting them.
+        """
+        if self._tracer is None:
+            return {}
+        stats = self._tracer.snapshot()
+        if reset:
+            self._tracer.reset()
+        return stats
+
+    def flush(self) -> None:
+        """Write any state buffered in memory to the database."""
+        self._flush_writes()
+        with self._connect(write=True) as conn:
+            self._flush_access_stats(conn)
+
+    def snapshot(self, path: Path | str) -> None:
+        """Copy the cache to a new database at the given path.
+
+        The copy is made with SQLite's online backup API in a single read transaction, so
+        other connections can keep reading and writing while it's made. Values stored in external
+        files are copied to a `<path>.blobs` directory. The copy can be opened as a storage
+        like any other, e.g. to ship a pre-warmed cache.
+
+        Args:
+            path:
+                Where to write the copy. An existing database there is overwritten.
+        """
+        self.flush()
+        with closing(sqlite3.connect(path)) as target:
+            with self._connect() as conn:
+                # A backup made in steps restarts whenever another connection writes in
+                # between, so it's copied in one step. Under WAL that blocks no one.
+                conn.backup(target, pages=-1)
+            names = _commands.get_external_names(target)
+        if names:
+            blobs = Path(f"{path}.blobs")
+            blobs.mkdir(parents=True, exist_ok=True)
+            for name in names:
+                # Files are never modified once written so linking them is as good as a copy
+                try:
+                    os.link(self._blobs.directory / name, blobs / name)
+                except FileExistsError:
+                    pass
+                except FileNotFoundError:
+                    # The item was evicted after the copy was made
+                    continue
+                except OSError:
+                    shutil.copyfile(self._blobs.directory / name, blobs / name)
+
+    def export(
+        self,
+        file: BinaryIO | Path | str,
+        *,
+        prefix: str | None = None,
+        hottest: int | None = None,
+    ) -> int:
+        """Write unexpired items to a file that can be loaded with `warm_from`.
+
+        Items are read and written in batches so the whole cache is never held in memory.
+        They're written from the least to the most accessed so that, if they don't all fit
+        where they're loaded, the most accessed are the ones kept.
+
+        Args:
+            file:
+                The path or binary file object to write to.
+            prefix:
+                Only export items whose keys start with this.
+            hottest:
+                Only export this many of the most frequently accessed items.
+
+        Returns:
+            The number of items exported.
+        """
+        self.flush()
+        with self._connect() as conn:
+            keys = _commands.get_export_keys(conn, prefix=prefix, hottest=hottest)
+        with _export.open_file(file, "wb") as f:
+            return _export.write_items(f, self._iter_items(keys))
+
+    def warm_from(self, file: BinaryIO | Path | str) -> int:
+        """Load the items written to a file by `export`.
+
+        All the items are written in a single transaction and the cache is only reduced to
+        its size limit once they've all been written. Loaded items replace existing ones
+        with the same keys and count as never having been accessed.
+
+        Args:
+            file:
+                The path or binary file object to read from.
+
+        Returns:
+            The number of items loaded.
+        """
+        start = time.perf_counter()
+        loaded, size, spilled = 0, 0, []
+        if self._write_buffer is not None:
+            # Queued items (including any batch the background writer is part way through
+            # writing) are written first so the loaded ones replace them. This can't wait
+            # until the write lock is held since the background writer waits for it too.
+            with self._write_buffer.flush() as queued:
+                if queued:
+                    self._write(queued)
+        try:
+            with _export.open_file(file, "rb") as f, self._connect(write=True) as conn:
+                for batch in _batches(_export.read_items(f), _WARM_BATCH_SIZE):
+                    external = self._blobs.spill(batch)
+                    spilled.extend(external.values())
+                    _commands.set_cache_items(
+                        conn,
+                        batch,
+                        compression=self._compression,
+                        compression_threshold=self._compression_threshold,
+                        external=external,
+                        prioritize=self._prioritize,
+                    )
+                    if self._memory is not None:
+                        self._memory.discard(batch)
+                    loaded += len(batch)
+                    size += sum(len(item["value"]) for item in batch.values())
+                self._flush_access_stats(conn)
+                if self._janitor is None:
+                    self._evict(conn, self._size_limit)
+        except BaseException:
+            self._blobs.remove(spilled)
+            raise
+        self._remove_orphaned_blobs()
+        if self._janitor is not None:
+            self._janitor.wake()
+        self._metrics.count(sets=loaded, bytes_written=size)
+        self._metrics.observe("warm_from", time.perf_counter() - start)
+        return loaded
+
+    def close(self) -> None:
+        """Flush buffered state and close all connections held by this storage.
+
+        The storage cannot be used after it has been closed.
+        """
+        if self._janitor is not None:
+            self._janitor.stop()
+        if self._writer is not None:
+            self._writer.stop()
+        if (self._access_buffer is not None and self._access_buffer.pending) or (
+            self._write_buffer is not None and self._write_buffer.pending
+        ):
+            self.flush()
+        self._pool.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
 
     def get_one(self, key: str) -> CacheItem | None:
         """Get the value for the given key."""
@@ -67,8 +436,46 @@ class Storage:
 
     def get_many(self, keys: Collection[str] | None = None) -> Mapping[str, CacheItem]:
         """Get the value for the given key."""
-        with self._connect() as conn:
-            return _commands.get_cache_items(conn, keys)
+        start = time.perf_counter()
+        if self._admission is not None and keys is not None:
+            self._admission.record(keys)
+        queued = self._write_buffer.get_many(keys) if self._write_buffer is not None else {}
+        to_load = [k for k in keys if k not in queued] if keys is not None else None
+        items: dict[str, CacheItem] = {}
+        memory_hits = 0
+        # Reads only write when they update access statistics as they go
+        write = self._access_buffer is None
+        if self._memory is not None and to_load:
+            # Items served from memory don't need the database's write lock
+            with self._connect() as conn:
+                self._memory.sync(conn)
+            items = self._memory.get_many(to_load)
+            memory_hits = len(items)
+            if missing := [k for k in to_load if k not in items]:
+                # Another thread may write newer items before these are added
+                generation = self._memory.generation
+                with self._connect(write=write) as conn:
+                    loaded = self._get_cache_items(conn, missing)
+                self._memory.set_many(loaded, generation=generation)
+                items.update(loaded)
+        elif to_load is None or to_load:
+            with self._connect(write=write) as conn:
+                items.update(self._get_cache_items(conn, to_load))
+        # Queued items replace those in the database (even once they've expired)
+        for key, item in queued.items():
+            if item is None:
+                items.pop(key, None)
+            else:
+                items[key] = item
+        self._record_access(items)
+        self._metrics.count(
+            hits=len(items),
+            memory_hits=memory_hits,
+            misses=len(keys) - len(items) if keys is not None else 0,
+            bytes_read=sum(len(item["value"]) for item in items.values()),
+        )
+        self._metrics.observe("get_many", time.perf_counter() - start)
+        return items
 
     def set_one(self, key: str, item: CacheItem) -> None:
         """Set the value for the given key."""
@@ -76,23 +483,143 @@ class Storage:
 
     def set_many(self, items: Mapping[str, CacheItem]) -> None:
         """Set the value for the given key."""
-        with self._connect() as cursor:
-            items_size = sum(len(item["value"]) for item in items.values())
-            # Evict items to make room for the new ones
-            _commands.evict_cache_items(
-                cursor,
-                size_limit=self._size_limit - items_size,
-                policy=self._eviction_policy,
-            )
-            # Then set the new items
-            _commands.set_cache_items(cursor, items)
-            # If the items are larger than the size limit evict again
-            if items_size > self._size_limit:
-                _commands.evict_cache_items(
-                    cursor,
-                    size_limit=self._size_limit,
-                    policy=self._eviction_policy,
-                )
+        start = time.perf_counter()
+        if self._admission is not None:
+            self._admission.record(items)
+        items = self._apply_expiration(items)
+        if self._write_buffer is None or self._writer is None:
+            self._write(items)
+        elif self._write_buffer.add(items):
+            # Write in the caller's thread if the background writer can't keep up
+            if self._write_buffer.overflowing:
+                self._flush_writes()
+            else:
+                self._writer.wake()
+        self._metrics.count(
+            sets=len(items),
+            bytes_written=sum(len(item["value"]) for item in items.values()),
+        )
+        self._metrics.observe("set_many", time.perf_counter() - start)
+
+    @contextmanager
+    def open_reader(self, key: str) -> Iterator[ValueReader]:
+        """Open the value of the given key for incremental reading.
+
+        Values stored in the database are read from it in chunks using SQLite's incremental
+        BLOB I/O. Values stored externally are read from their files. Compressed values are
+        decompressed into memory first.
+
+        Raises:
+            KeyError: If the key is not in the cache.
+        """
+        if self._write_buffer is not None and (queued := self._write_buffer.get_many([key])):
+            if (item := queued[key]) is None:
+                self._metrics.count(misses=1)
+                raise KeyError(key)
+            self._metrics.count(hits=1)
+            self._record_access([key])
+            yield BytesIO(item["value"])
+            return
+
+        with self._connect(write=self._access_buffer is None) as conn:
+            if (location := _commands.get_cache_item_location(conn, key)) is not None:
+                self._touch(conn, [key])
+        if location is None:
+            self._metrics.count(misses=1)
+            raise KeyError(key)
+        self._metrics.count(hits=1)
+        self._record_access([key])
+        rowid, codec, external = location
+
+        if external is not None:
+            if (file := self._blobs.open(external)) is None:
+                raise KeyError(key)
+            with file:
+                yield file
+        elif codec is not None:
+            if (item := _commands.get_cache_items(conn, [key], touch=False).get(key)) is None:
+                raise KeyError(key)
+            yield BytesIO(item["value"])
+        else:
+            try:
+                blob = conn.blobopen("cache", "value", rowid, readonly=True)
+            except sqlite3.OperationalError:
+                raise KeyError(key) from None
+            with blob:
+                # The row may have been replaced before the blob was opened
+                if _commands.get_cache_key(conn, rowid) != key:
+                    raise KeyError(key)
+                yield blob
+
+    @contextmanager
+    def open_writer(
+        self,
+        key: str,
+        size: int,
+        *,
+        expiration: timedelta | None = None,
+    ) -> Iterator[ValueWriter]:
+        """Open a value of the given size for incremental writing.
+
+        The value is stored once exactly `size` bytes have been written and the context
+        exits without error. Values are not compressed. Values at least `external_threshold`
+        bytes long are written to a file, otherwise they're written directly into the database
+        using SQLite's incremental BLOB I/O while holding its write lock.
+
+        That's done on a connection of its own so the value can be copied from another one
+        with `open_reader` or `get_one` while it's open. But since the write lock is held,
+        those only work if `access_flush_interval` is set so that reads don't write. Other
+        writes from the same thread raise a `RuntimeError` rather than waiting for a lock
+        the thread holds itself.
+
+        Args:
+            key: The key to store the value under.
+            size: The exact size of the value in bytes.
+            expiration: The time until the item expires. Defaults to the storage's default.
+
+        Raises:
+            ValueError: If the size exceeds the storage's size limit or the wrong number of
+                bytes were written.
+        """
+        if size > self._size_limit:
+            msg = f"Value of {size} bytes exceeds size limit of {self._size_limit} bytes"
+            raise ValueError(msg)
+        if expiration is None:
+            expiration = self._default_expiration
+        expiration = self._jitter(expiration)
+        if self._write_buffer is not None:
+            self._write_buffer.discard([key])
+
+        if self._blobs.threshold is not None and size >= self._blobs.threshold:
+            name, file = self._blobs.create()
+            try:
+                with file:
+                    yield file
+                    _check_written(file, size)
+                with self._connect(write=True) as conn:
+                    self._make_room(conn, size)
+                    self._reserve(conn, key, size, expiration=expiration, external=name)
+            except BaseException:
+                self._blobs.remove([name])
+                raise
+        else:
+            self._check_no_open_writer()
+            with closing(self._pool.open()) as conn, conn:
+                self._begin_write(conn)
+                self._make_room(conn, size)
+                rowid = self._reserve(conn, key, size, expiration=expiration)
+                with conn.blobopen("cache", "value", rowid) as blob:
+                    self._writing.active = True
+                    try:
+                        yield blob
+                    finally:
+                        self._writing.active = False
+                    _check_written(blob, size)
+
+        self._remove_orphaned_blobs()
+        if self._memory is not None:
+            self._memory.discard([key])
+        self._metrics.count(sets=1, bytes_written=size)
 
     def get_keys(self, check: Collection[str] | None = None) -> set[str]:
         """Get keys from the cache.
@@ -103,7 +630,578 @@ class Storage:
                 excluded from the returned set. If None, all keys will be returned.
         """
         with self._connect() as conn:
-            return _commands.get_cache_keys(conn, check)
+            keys = _commands.get_cache_keys(conn, check)
+        if self._write_buffer is not None:
+            for key, item in self._write_buffer.get_many(check).items():
+                if item is None:
+                    keys.discard(key)
+                else:
+                    keys.add(key)
+        return keys
+
+    def acquire_lease(self, key: str, duration: timedelta) -> str | None:
+        """Try to acquire an exclusive lease on the given key.
+
+        Leases are shared by all storages and processes using the same database. They're
+        used to let just one of them compute the value of a missing key. A lease that isn't
+        released expires after the given duration so that another owner can acquire it.
+
+        Args:
+            key: The key to lease.
+            duration: The time until the lease expires.
+
+        Returns:
+            A token to release the lease with, or None if another owner holds the lease.
+        """
+        token = uuid4().hex
+        with self._connect(write=True) as conn:
+            return token if _commands.acquire_lease(conn, key, token, duration) else None
+
+    def release_lease(self, key: str, token: str) -> None:
+        """Release a lease acquired with [`acquire_lease`][backlite.storage.Storage.acquire_lease].
+
+        Nothing happens if the lease has since expired and been acquired by another owner.
+        """
+        with self._connect(write=True) as conn:
+            _commands.release_lease(conn, key, token)
+
+    @contextmanager
+    def _connect(self, *, write: bool = False) -> Iterator[sqlite3.Connection]:
+        if write:
+            self._check_no_open_writer()
+        conn = self._pool.get()
+        with conn:
+            if write:
+                self._begin_write(conn)
+            yield conn
+
+    def _begin_write(self, conn: sqlite3.Connection) -> None:
+        # Taking the write lock up front means SQLite waits for it (up to its busy timeout)
+        # instead of failing immediately when a read transaction is upgraded to a write.
+        start = time.perf_counter()
+        deadline = start + self._write_timeout
+        for attempt in count():
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError as error:
+                remaining = deadline - time.perf_counter()
+                if not _is_busy(error) or remaining <= 0:
+                    raise
+                self._metrics.count(busy_retries=1)
+                time.sleep(min(_backoff(attempt), remaining))
+        self._metrics.observe("begin_write", time.perf_counter() - start)
+
+    def _write(self, items: Mapping[str, CacheItem]) -> None:
+        external = self._blobs.spill(items)
+        try:
+            written = self._set_cache_items(items, external)
+        except BaseException:
+            self._blobs.remove(external.values())
+            raise
+        if rejected := [name for key, name in external.items() if key not in written]:
+            self._blobs.remove(rejected)
+        self._remove_orphaned_blobs()
+        if self._memory is not None:
+            # Rejected keys may still be in memory if this connection evicted their rows
+            self._memory.discard([key for key in items if key not in written])
+            self._memory.set_many(_prepare_items(written, self._size_limit)[0])
+
+    def _flush_writes(self) -> bool:
+        # Also called periodically by the background writer. There's never more to do.
+        if self._write_buffer is not None and self._write_buffer.pending:
+            with self._write_buffer.flush() as items:
+                self._write(items)
+        return False
+
+    def _set_cache_items(
+        self,
+        items: Mapping[str, CacheItem],
+        external: Mapping[str, str],
+    ) -> Mapping[str, CacheItem]:
+        # Values are compressed before taking the write lock. Room is made for the size
+        # they're stored at since that's what counts towards the size limit.
+        encoded = _commands.encode_cache_values(
+            items,
+            compression=self._compression,
+            compression_threshold=self._compression_threshold,
+            external=external,
+        )
+        sizes = {
+            key: len(encoded[key][0] if key in encoded else item["value"])
+            for key, item in items.items()
+        }
+        with self._connect(write=True) as cursor:
+            if self._admission is not None:
+                items = self._admit(cursor, items, sizes, self._admission)
+            items_size = sum(sizes[key] for key in items)
+            # Evict items to make room for the new ones
+            self._make_room(cursor, items_size)
+            # Then set the new items
+            _commands.set_cache_items(
+                cursor,
+                items,
+                compression=self._compression,
+                compression_threshold=self._compression_threshold,
+                external=external,
+                encoded=encoded,
+                prioritize=self._prioritize,
+            )
+            if self._adaptive:
+                _commands.adapt_to_evicted_keys(cursor, items, size_limit=self._size_limit)
+            # If the items are larger than the size limit evict again
+            if items_size > self._size_limit and self._janitor is None:
+                self._evict(cursor, self._size_limit)
+        return items
+
+    def _admit(
+        self,
+        conn: sqlite3.Connection,
+        items: Mapping[str, CacheItem],
+        sizes: Mapping[str, int],
+        sketch: FrequencySketch,
+    ) -> Mapping[str, CacheItem]:
+        # New items may only displace those that have been used less often recently. The
+        # ones used most often get the first chance at the room that's free or can be freed.
+        self._flush_access_stats(conn)
+        if self._janitor is None:
+            # Otherwise the janitor removes expired items in batches
+            expired = _commands.delete_expired_cache_items(conn)
+            self._metrics.count(expirations=expired)
+        # Replaced items free their stored size and take up the size of the new ones
+        existing = _commands.get_cache_sizes(conn, items)
+        free = self._size_limit - _commands.get_cache_size(conn)
+        free += sum(size - sizes[key] for key, size in existing.items())
+        new = sorted(
+            (key for key in items if key not in existing), key=sketch.estimate, reverse=True
+        )
+        candidates = _commands.get_eviction_candidates(
+            conn,
+            size=sum(sizes[key] for key in new) - free,
+            policy=self._eviction_policy,
+        )
+        victims = iter([c for c in candidates if c[0] not in items])
+        admitted = {key: items[key] for key in existing}
+        victim = next(victims, None)
+        for key in new:
+            size, frequency = sizes[key], sketch.estimate(key)
+            while free < size and victim is not None and sketch.estimate(victim[0]) < frequency:
+                free += victim[1]
+                victim = next(victims, None)
+            if free >= size:
+                admitted[key] = items[key]
+                free -= size
+        self._metrics.count(rejections=len(items) - len(admitted))
+        return admitted
+
+    def _iter_items(self, keys: list[str]) -> Iterator[tuple[str, CacheItem]]:
+        # Each batch is read in its own transaction so writers aren't held up for long
+        for i in range(0, len(keys), _EXPORT_BATCH_SIZE):
+            batch = keys[i : i + _EXPORT_BATCH_SIZE]
+            with self._connect() as conn:
+                items = _commands.get_cache_items(conn, batch, touch=False, blobs=self._blobs)
+            for key in batch:
+                if (item := items.get(key)) is not None:
+                    yield key, item
+
+    def _reserve(
+        self,
+        conn: sqlite3.Connection,
+        key: str,
+        size: int,
+        *,
+        expiration: timedelta | None,
+        external: str | None = None,
+    ) -> int:
+        rowid = _commands.reserve_cache_item(
+            conn,
+            key,
+            size,
+            expiration=expiration,
+            external=external,
+            prioritize=self._prioritize,
+        )
+        if self._adaptive:
+            _commands.adapt_to_evicted_keys(conn, [key], size_limit=self._size_limit)
+        return rowid
+
+    def _apply_expiration(self, items: Mapping[str, CacheItem]) -> Mapping[str, CacheItem]:
+        # Items that don't declare an expiration get the default one. Only the time they're
+        # fresh for is jittered - the time they may be served stale for is added after.
+        if (
+            self._default_expiration is None
+            and not self._expiration_jitter
+            and not any("stale_while_revalidate" in item for item in items.values())
+        ):
+            return items
+        applied: dict[str, CacheItem] = {}
+        for key, item in items.items():
+            expiration = self._jitter(item.get("expiration", self._default_expiration))
+            stale = item.get("stale_while_revalidate")
+            if expiration is not None and stale is not None:
+                expiration += stale
+            applied[key] = {**item, "expiration": expiration}
+            applied[key].pop("stale_while_revalidate", None)
+        return applied
+
+    def _jitter(self, expiration: timedelta | None) -> timedelta | None:
+        if expiration is None or not self._expiration_jitter:
+            return expiration
+        return expiration * (1 - self._expiration_jitter * random.random())  # noqa: S311
+
+    def _make_room(self, conn: sqlite3.Connection, size: int) -> None:
+        # Eviction depends on up-to-date access statistics
+        self._flush_access_stats(conn)
+        if self._memory is not None:
+            self._memory.sync(conn)
+        # Otherwise the janitor makes room once the items have been written
+        if self._janitor is None:
+            self._evict(conn, self._size_limit - size)
+
+    def _run_maintenance(self) -> bool:
+        # Called periodically by the janitor. Returns whether there may be more to evict.
+        with self._connect(write=True) as conn:
+            self._flush_access_stats(conn)
+            removed = self._evict(conn, self._size_limit, limit=self._janitor_batch_size)
+        self._remove_orphaned_blobs()
+        return removed >= self._janitor_batch_size
+
+    def _evict(self, conn: sqlite3.Connection, size_limit: int, limit: int | None = None) -> int:
+        expired, evicted = _commands.evict_cache_items(
+            conn,
+            size_limit=size_limit,
+            policy=self._eviction_policy,
+            limit=limit,
+        )
+        self._metrics.count(expirations=expired, evictions=evicted, expiry_sweeps=1)
+        return expired + evicted
+
+    def _remove_orphaned_blobs(self) -> None:
+        # Only files whose rows were removed by an already committed transaction are deleted
+        with self._connect() as conn:
+            if not _commands.has_orphaned_blobs(conn):
+                return
+        with self._connect(write=True) as conn:
+            _commands.remove_orphaned_blobs(conn, self._blobs)
+
+    def _get_cache_items(
+        self,
+        conn: sqlite3.Connection,
+        keys: Collection[str] | None,
+    ) -> Mapping[str, CacheItem]:
+        # Buffered access statistics are recorded once the read transaction is over
+        touch = self._access_buffer is None
+        return _commands.get_cache_items(
+            conn, keys, touch=touch, blobs=self._blobs, prioritize=self._prioritize
+        )
+
+    def _touch(self, conn: sqlite3.Connection, keys: Collection[str]) -> None:
+        if self._access_buffer is None:
+            _commands.update_access_stats(
+                conn, dict.fromkeys(keys, (time.time(), 1)), prioritize=self._prioritize
+            )
+
+    def _record_access(self, keys: Collection[str]) -> None:
+        # Flushing happens in its own write transaction so that reads don't take the write lock
+        if (
+            self._access_buffer is not None
+            and self._access_buffer.record(keys, time.time())
+            and not getattr(self._writing, "active", False)
+        ):
+            self.flush()
+
+    def _check_no_open_writer(self) -> None:
+        # The thread already holds the write lock for a value it's writing with open_writer
+        if getattr(self._writing, "active", False):
+            msg = "Cannot write to the storage while this thread has a value open for writing"
+            raise RuntimeError(msg)
+
+    def _flush_access_stats(self, conn: sqlite3.Connection) -> None:
+        if self._access_buffer is not None and self._access_buffer.pending:
+            _commands.update_access_stats(
+                conn, self._access_buffer.drain(), prioritize=self._prioritize
+            )
+
+
+class ShardedStorage:
+    """A key-value store that spreads keys across several SQLite databases.
+
+    SQLite only allows one writer per database at a time. Spreading keys across several
+    databases lets writes to different shards happen concurrently so that write throughput
+    scales with the number of shards. Operations on many keys are run on each shard in
+    parallel.
+    """
+
+    def __init__(
+        self,
+        location: Path | str,
+        *,
+        shards: int,
+        size_limit: int = 1024**3,  # 1 GB
+        memory_limit: int | None = None,
+        **options: Any,
+    ) -> None:
+        """Create a new sharded storage.
+
+        Args:
+            location:
+                The directory where a SQLite database for each shard should be created.
+            shards:
+                The number of shards. Keys are assigned to shards with a consistent hash so
+                this must not change while the cache is in use. If it's increased anyway, only
+                the keys that moved to the new shards are lost.
+            size_limit:
+                An approximate limit on the size of the whole cache. Each shard gets an equal
+                share of it.
+            memory_limit:
+                An approximate limit on the size of the whole in-process cache. Each shard
+                gets an equal share of it.
+            options:
+                Other options passed to each shard's [`Storage`][backlite.storage.Storage].
+        """
+        if shards < 1:
+            msg = f"Number of shards must be at least 1, not {shards!r}"
+            raise ValueError(msg)
+        directory = Path(location)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.shards = [
+            Storage(
+                directory / f"shard-{i}.db",
+                size_limit=size_limit // shards,
+                memory_limit=memory_limit // shards if memory_limit is not None else None,
+                **options,
+            )
+            for i in range(shards)
+        ]
+        """The storage of each shard."""
+        self._executor = ThreadPoolExecutor(shards, thread_name_prefix="backlite-shard")
+
+    def shard(self, key: str) -> Storage:
+        """Get the storage of the shard the given key belongs to."""
+        return self.shards[jump_hash(key, len(self.shards))]
+
+    def stats(self) -> StorageStats:
+        """Get a snapshot of the combined metrics of all shards."""
+        return merge_stats(s.stats() for s in self.shards)
+
+    def flush(self) -> None:
+        """Write any state buffered in memory to the databases."""
+        self._map(Storage.flush, self.shards)
+
+    def close(self) -> None:
+        """Flush buffered state and close all shards."""
+        try:
+            self._map(Storage.close, self.shards)
+        finally:
+            self._executor.shutdown()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def get_one(self, key: str) -> CacheItem | None:
+        """Get the value for the given key."""
+        return self.shard(key).get_one(key)
+
+    def get_many(self, keys: Collection[str] | None = None) -> Mapping[str, CacheItem]:
+        """Get the values for the given keys, or all values if no keys are given."""
+        if keys is None:
+            results = self._map(Storage.get_many, self.shards)
+        else:
+            by_shard = self._group(keys)
+            results = self._map(lambda s: s.get_many(by_shard[s]), by_shard)
+        return {k: v for r in results for k, v in r.items()}
+
+    def set_one(self, key: str, item: CacheItem) -> None:
+        """Set the value for the given key."""
+        self.shard(key).set_one(key, item)
+
+    def set_many(self, items: Mapping[str, CacheItem]) -> None:
+        """Set the values for the given keys."""
+        by_shard = self._group(items)
+        self._map(lambda s: s.set_many({k: items[k] for k in by_shard[s]}), by_shard)
+
+    @contextmanager
+    def open_reader(self, key: str) -> Iterator[ValueReader]:
+        """Open the value of the given key for incremental reading.
+
+        See [`Storage.open_reader`][backlite.storage.Storage.open_reader].
+        """
+        with self.shard(key).open_reader(key) as reader:
+            yield reader
+
+    @contextmanager
+    def open_writer(
+        self,
+        key: str,
+        size: int,
+        *,
+        expiration: timedelta | None = None,
+    ) -> Iterator[ValueWriter]:
+        """Open a value of the given size for incremental writing.
+
+        See [`Storage.open_writer`][backlite.storage.Storage.open_writer].
+        """
+        with self.shard(key).open_writer(key, size, expiration=expiration) as writer:
+            yield writer
+
+    def get_keys(self, check: Collection[str] | None = None) -> set[str]:
+        """Get keys from the cache - see [`Storage.get_keys`][backlite.storage.Storage.get_keys]."""
+        if check is None:
+            results = self._map(Storage.get_keys, self.shards)
+        else:
+            by_shard = self._group(check)
+            results = self._map(lambda s: s.get_keys(by_shard[s]), by_shard)
+        return set().union(*results)
+
+    def acquire_lease(self, key: str, duration: timedelta) -> str | None:
+        """Try to acquire an exclusive lease on the given key.
+
+        See [`Storage.acquire_lease`][backlite.storage.Storage.acquire_lease].
+        """
+        return self.shard(key).acquire_lease(key, duration)
+
+    def release_lease(self, key: str, token: str) -> None:
+        """Release a lease.
+
+        See [`Storage.release_lease`][backlite.storage.Storage.release_lease].
+        """
+        self.shard(key).release_lease(key, token)
+
+    def _group(self, keys: Iterable[str]) -> dict[Storage, list[str]]:
+        by_shard: dict[Storage, list[str]] = {}
+        for key in keys:
+            by_shard.setdefault(self.shard(key), []).append(key)
+        return by_shard
+
+    def _map(self, func: Callable[[Storage], T], shards: Collection[Storage]) -> list[T]:
+        # Avoid handing work to another thread when there's no parallelism to be had
+        if len(shards) == 1:
+            return [func(next(iter(shards)))]
+        return list(self._executor.map(func, shards))
+
+
+class AsyncStorage:
+    """An async interface to a [`Storage`][backlite.storage.Storage].
+
+    A [`ShardedStorage`][backlite.storage.ShardedStorage] may be wrapped too. Blocking
+    database operations are run in worker threads so they never block the event loop.
+    Each worker thread uses its own long-lived connection to the database.
+    """
+
+    def __init__(
+        self,
+        storage: Storage | ShardedStorage,
+        *,
+        limiter: CapacityLimiter | None = None,
+    ) -> None:
+        """Create a new async storage.
+
+        Args:
+            storage:
+                The storage to wrap.
+            limiter:
+                Limits the number of worker threads used concurrently. If not specified, the
+                default limiter of the async backend is used.
+        """
+        self.storage = storage
+        self._limiter = limiter
+
+    async def get_one(self, key: str) -> CacheItem | None:
+        """Get the value for the given key."""
+        return await run_sync(self.storage.get_one, key, limiter=self._limiter)
+
+    async def get_many(self, keys: Collection[str] | None = None) -> Mapping[str, CacheItem]:
+        """Get the value for the given key."""
+        return await run_sync(self.storage.get_many, keys, limiter=self._limiter)
+
+    async def set_one(self, key: str, item: CacheItem) -> None:
+        """Set the value for the given key."""
+        await run_sync(self.storage.set_one, key, item, limiter=self._limiter)
+
+    async def set_many(self, items: Mapping[str, CacheItem]) -> None:
+        """Set the value for the given key."""
+        await run_sync(self.storage.set_many, items, limiter=self._limiter)
+
+    async def get_keys(self, check: Collection[str] | None = None) -> set[str]:
+        """Get keys from the cache - see [`Storage.get_keys`][backlite.storage.Storage.get_keys]."""
+        return await run_sync(self.storage.get_keys, check, limiter=self._limiter)
+
+    async def acquire_lease(self, key: str, duration: timedelta) -> str | None:
+        """Try to acquire an exclusive lease on the given key.
+
+        See [`Storage.acquire_lease`][backlite.storage.Storage.acquire_lease].
+        """
+        return await run_sync(self.storage.acquire_lease, key, duration, limiter=self._limiter)
+
+    async def release_lease(self, key: str, token: str) -> None:
+        """Release a lease.
+
+        See [`Storage.release_lease`][backlite.storage.Storage.release_lease].
+        """
+        await run_sync(self.storage.release_lease, key, token, limiter=self._limiter)
+
+    async def flush(self) -> None:
+        """Write any state buffered in memory to the database."""
+        await run_sync(self.storage.flush, limiter=self._limiter)
+
+    async def close(self) -> None:
+        """Flush buffered state and close the underlying storage."""
+        await run_sync(self.storage.close, limiter=self._limiter)
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        await self.close()
+
+
+def _is_busy(error: sqlite3.OperationalError) -> bool:
+    return error.sqlite_errorcode & 0xFF in {sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED}
+
+
+def _backoff(attempt: int) -> float:
+    # Exponential backoff with full jitter so that waiting writers don't retry in lockstep
+    return random.uniform(0, min(_MAX_BACKOFF, _MIN_BACKOFF * 2**attempt))  # noqa: S311
+
+
+_MIN_BACKOFF = 0.01
+_MAX_BACKOFF = 1.0
+
+_EXPORT_BATCH_SIZE = 1000
+"""The number of items read per transaction when exporting."""
+
+_WARM_BATCH_SIZE = 1000
+"""The number of items held in memory at a time when warming from an export."""
+
+
+def _batches(items: Iterable[tuple[str, CacheItem]], size: int) -> Iterator[dict[str, CacheItem]]:
+    batch: dict[str, CacheItem] = {}
+    for key, item in items:
+        batch[key] = item
+        if len(batch) >= size:
+            yield batch
+            batch = {}
+    if batch:
+        yield batch
+
+
+def _check_written(writer: ValueWriter, size: int) -> None:
+    if (written := writer.tell()) != size:
+        msg = f"Expected {size} bytes to be written but the writer is at position {written}"
+        raise ValueError(msg)
 
 
 def _prepare_items(
@@ -123,12 +1221,3 @@ def _prepare_items(
         size += item_size
         to_set[k] = i
     return to_set, size
-
-
-def _connector(location: Path | str) -> Callable[[], AbstractContextManager[sqlite3.Connection]]:
-    @contextmanager
-    def connect() -> Iterator[sqlite3.Connection]:
-        with sqlite3.connect(location) as conn:
-            yield conn
-
-    return connect
@@ -1,32 +1,195 @@
+from collections.abc import Mapping
 from datetime import timedelta
 from inspect import Signature
 from typing import Any
 from typing import Literal
+from typing import ParamSpec
 from typing import Protocol
 from typing import Required
 from typing import TypedDict
+from typing import TypeVar
 from typing import get_args
 
+P = ParamSpec("P")
+R_co = TypeVar("R_co", covariant=True)
+
 EvictionPolicy = Literal[
     "least-recently-used",
     "least-frequently-used",
     "most-recently-used",
     "first-in-first-out",
     "last-in-first-out",
+    "greedy-dual-size-frequency",
+    "adaptive",
 ]
 """Defines the possible eviction policies for the cache."""
 
 EVICTION_POLICIES: set[EvictionPolicy] = set(get_args(EvictionPolicy))
 """A set of all possible eviction policies."""
 
+AdmissionPolicy = Literal["tiny-lfu",]
+"""Defines the possible policies for deciding whether new items are worth keeping.
+
+- `tiny-lfu` - admits a new item only if it has been used more often recently than the
+  items that would be evicted to make room for it.
+"""
+
+ADMISSION_POLICIES: set[AdmissionPolicy] = set(get_args(AdmissionPolicy))
+"""A set of all possible admission policies."""
+
+TuningProfile = Literal[
+    "durable",
+    "fast",
+    "ephemeral",
+]
+"""Defines the named sets of SQLite pragmas a storage can be tuned with.
+
+- `durable` - WAL journal with full fsyncs on every commit.
+- `fast` - WAL journal, fsyncs only at checkpoints, and larger page/mmap caches.
+- `ephemeral` - like `fast` but never fsyncs. Recent writes may be lost on power failure.
+"""
+
+TUNING_PROFILES: set[TuningProfile] = set(get_args(TuningProfile))
+"""A set of all possible tuning profiles."""
+
+PragmaValue = int | str
+"""A value that can be assigned to an SQLite pragma."""
+
+Compression = Literal[
+    "zlib",
+    "bz2",
+    "lzma",
+]
+"""Defines the algorithms that can be used to compress stored values."""
+
+COMPRESSIONS: set[Compression] = set(get_args(Compression))
+"""A set of all possible compression algorithms."""
+
 
 class CacheItem(TypedDict, total=False):
     """A cache item."""
 
-    value: Required[bytes]
-    """The value of the item."""
+    value: Required[bytes | memoryview]
+    """The value of the item.
+
+    Values stored in external files are returned as memory-mapped views.
+    """
     expiration: timedelta | None
     """The time until the item expires."""
+    cost: float | None
+    """The time in seconds it took to compute the value (if known)."""
+    stale_while_revalidate: timedelta | None
+    """How long to keep the item after it expires so it can be served while it's recomputed.
+
+    This is added to the expiration once the storage's default expiration and jitter have
+    been applied to it. Items that are read back include it in their expiration instead.
+    """
+
+
+class LatencyHistogram(TypedDict):
+    """The distribution of the time taken by an operation."""
+
+    count: int
+    """The number of times the operation was performed."""
+    seconds: float
+    """The total time spent performing the operation."""
+    buckets: Mapping[float, int]
+    """The number of operations that took at most each duration in seconds (and more than the
+    previous one). The last bucket is unbounded (`inf`)."""
+
+
+class StorageStats(TypedDict):
+    """A snapshot of a storage's metrics since it was created."""
+
+    hits: int
+    """The number of keys that were found when read."""
+    memory_hits: int
+    """The number of hits served by the in-process memory tier."""
+    misses: int
+    """The number of keys that were not found when read."""
+    sets: int
+    """The number of items written."""
+    bytes_read: int
+    """The total size of values that were read."""
+    bytes_written: int
+    """The total size of values that were written."""
+    evictions: int
+    """The number of items removed to stay within the size limit."""
+    rejections: int
+    """The number of new items that were not written because the admission policy
+    preferred the items they would have replaced."""
+    expirations: int
+    """The number of expired items that were removed."""
+    expiry_sweeps: int
+    """The number of times expired items were looked for and removed."""
+    busy_retries: int
+    """The number of times starting a write transaction was retried because the database
+    was locked by another connection for longer than the busy timeout."""
+    latencies: Mapping[str, LatencyHistogram]
+    """The distribution of the time taken by each public storage operation and by waiting
+    for the write lock (`begin_write`)."""
+
+
+class MetricsHook(Protocol):
+    """Receives a storage's metrics as they're recorded, e.g. to export them elsewhere.
+
+    Counters (`hits`, `memory_hits`, `misses`, `sets`, `bytes_read`, `bytes_written`,
+    `evictions`, `rejections`, `expirations`, `expiry_sweeps`, `busy_retries`) are reported
+    by how much they increased. Operation latencies are reported in seconds under
+    `<operation>.seconds` (e.g. `get_many.seconds`). The hook is called while an operation
+    is in progress so it should return quickly.
+    """
+
+    def __call__(self, name: str, value: float, /) -> None:
+        """Record a metric.
+
+        Args:
+            name: The name of the metric.
+            value: The amount a counter increased by or the duration of an operation.
+        """
+        ...
+
+
+class StatementStats(TypedDict):
+    """Measurements of all the SQL statements that share the same shape."""
+
+    count: int
+    """The number of times the statement was run."""
+    seconds: float
+    """The total time spent running the statement and fetching its results."""
+    max_seconds: float
+    """The longest time spent running the statement or fetching a batch of its results."""
+    rows: int
+    """The total number of rows fetched, inserted, updated, or deleted (including by triggers)."""
+    wait_seconds: float
+    """The total time the statement spent waiting to start (e.g. for a database lock)."""
+
+
+class CachedFunctionStats(TypedDict):
+    """A snapshot of the metrics of a cached function since it was decorated."""
+
+    hits: int
+    """The number of calls whose result was already cached."""
+    misses: int
+    """The number of calls whose result had to be computed."""
+    stale_hits: int
+    """The number of calls that returned an expired result while it was being refreshed."""
+    refreshes: int
+    """The number of times a cached result was recomputed before it was needed."""
+    compute_seconds: float
+    """The total time spent computing results."""
+
+
+class CachedFunction(Protocol[P, R_co]):
+    """A function decorated with `cached` or `async_cached`."""
+
+    def __call__(self, *args: P.args, **kwargs: P.kwargs) -> R_co:
+        """Call the function, using a cached result if one is available."""
+        ...
+
+    def cache_stats(self) -> CachedFunctionStats:
+        """Get a snapshot of the function's metrics since it was decorated."""
+        ...
 
 
 class ParamHashFunc(Protocol):
@@ -44,3 +207,47 @@ class ParamHashFunc(Protocol):
             A hash for the given parameters.
         """
         ...
+
+
+class Serializer(Protocol):
+    """Converts the values returned by cached functions to and from bytes."""
+
+    def dumps(self, value: Any, /) -> bytes:
+        """Serialize the given value."""
+        ...
+
+    def loads(self, data: bytes | memoryview, /) -> Any:
+        """Deserialize the given data."""
+        ...
+
+
+class ValueReader(Protocol):
+    """A file-like object for incrementally reading a stored value."""
+
+    def read(self, length: int = -1, /) -> bytes:
+        """Read up to `length` bytes (or all remaining bytes if negative)."""
+        ...
+
+    def seek(self, offset: int, origin: int = 0, /) -> object:
+        """Move to the given position."""
+        ...
+
+    def tell(self) -> int:
+        """Get the current position."""
+        ...
+
+
+class ValueWriter(Protocol):
+    """A file-like object for incrementally writing a stored value."""
+
+    def write(self, data: bytes, /) -> object:
+        """Write the given bytes at the current position."""
+        ...
+
+    def seek(self, offset: int, origin: int = 0, /) -> object:
+        """Move to the given position."""
+        ...
+
+    def tell(self) -> int:
+        """Get the current position."""
+        ...
@@ -1,10 +1,25 @@
 import asyncio
+import os
+import subprocess  # noqa: S404
+import sys
 import time
+from contextlib import suppress
+from datetime import timedelta
+from inspect import signature
+from pathlib import Path
 from threading import Lock
 from threading import Thread
 
+import pytest
+
+from backlite import JsonSerializer
+from backlite import MsgpackSerializer
+from backlite import PickleSerializer
+from backlite import Serializer
+from backlite import ShardedStorage
 from backlite import async_cached
 from backlite import cached
+from backlite._hashing import param_hash
 from tests.conftest import CleanCache
 
 
@@ -86,3 +101,426 @@ async def test_async_cached_function_with_barrier():
 
     lock.release()
     thread.join()
+
+
+def _hash_in_subprocess(code: str) -> str:
+    return subprocess.check_output(  # noqa: S603
+        [sys.executable, "-c", code],
+        env={**os.environ, "PYTHONHASHSEED": "random"},
+        text=True,
+    ).strip()
+
+
+def test_default_hash_func_is_stable_across_processes():
+    code = (
+        "from dataclasses import dataclass\n"
+        "from inspect import signature\n"
+        "from backlite._hashing import param_hash\n"
+        "@dataclass(frozen=True)\n"
+        "class Tags:\n"
+        "    names: frozenset[str]\n"
+        "def f(a, b, *, c, d): ...\n"
+        "print(param_hash(signature(f), ('x', [1, 2.5]), {\n"
+        "    'c': {'y': {None, True}},\n"
+        "    'd': Tags(frozenset('abcdefgh')),\n"
+        "}))"
+    )
+    assert len({_hash_in_subprocess(code) for _ in range(3)}) == 1
+
+
+def test_default_hash_func_binds_to_signature():
+    def f(a, b=2, *args, c=3, **kwargs): ...
+
+    sig = signature(f)
+    assert param_hash(sig, (1,), {}) == param_hash(sig, (), {"a": 1, "b": 2, "c": 3})
+    assert param_hash(sig, (1, 2, 3), {}) != param_hash(sig, (1, 2), {})
+    assert param_hash(sig, (1,), {"d": 4}) != param_hash(sig, (1,), {})
+    assert param_hash(sig, ([1],), {}) != param_hash(sig, ((1,),), {})
+    assert param_hash(sig, ({"x": 1, "y": 2},), {}) == param_hash(sig, ({"y": 2, "x": 1},), {})
+    with pytest.raises(TypeError):
+        param_hash(sig, (), {})
+
+
+class _Node:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.me = self
+
+
+def test_default_hash_func_with_self_referential_args():
+    def f(a): ...
+
+    sig = signature(f)
+    loop: list[object] = [1]
+    loop.append(loop)
+    assert param_hash(sig, (loop,), {}) == param_hash(sig, (loop,), {})
+    assert param_hash(sig, (loop,), {}) != param_hash(sig, ([1, [1]],), {})
+    assert param_hash(sig, (_Node("x"),), {}) == param_hash(sig, (_Node("x"),), {})
+    assert param_hash(sig, (_Node("x"),), {}) != param_hash(sig, (_Node("y"),), {})
+
+
+def test_cached_function_with_unhashable_args():
+    cache = CleanCache("test.db")
+
+    call_count = 0
+
+    @cached(storage=cache)
+    def expensive_function(values: list[int]) -> int:
+        nonlocal call_count
+        call_count += 1
+        return sum(values)
+
+    assert expensive_function([1, 2]) == 3
+    assert expensive_function(values=[1, 2]) == 3
+    assert call_count == 1
+
+
+def test_cached_function_with_custom_hash_func():
+    cache = CleanCache("test.db")
+
+    call_count = 0
+
+    @cached(storage=cache, hash_func=lambda _, args, __: str(args[0] % 2))
+    def expensive_function(_: int) -> None:
+        nonlocal call_count
+        call_count += 1
+
+    expensive_function(1)
+    expensive_function(3)
+    assert call_count == 1
+    assert cache.get_keys() == {"1"}
+
+
+async def test_async_cached_function_with_custom_hash_func():
+    cache = CleanCache("test.db")
+
+    @async_cached(storage=cache, hash_func=lambda *_: "constant")
+    async def expensive_function(x: int) -> int:
+        return x
+
+    assert await expensive_function(1) == 1
+    assert await expensive_function(2) == 1
+
+
+@pytest.mark.parametrize("serializer", [PickleSerializer(protocol=4), JsonSerializer()])
+def test_cached_function_with_serializer(serializer: Serializer):
+    cache = CleanCache("test.db")
+
+    @cached(storage=cache, serializer=serializer)
+    def expensive_function(x: int) -> dict[str, list[int]]:
+        return {"x": [x]}
+
+    assert expensive_function(1) == {"x": [1]}
+    (item,) = cache.get_many().values()
+    assert bytes(item["value"]).endswith(serializer.dumps({"x": [1]}))
+    assert expensive_function(1) == {"x": [1]}
+
+
+def test_cached_function_recomputes_results_of_other_serializer():
+    cache = CleanCache("test.db")
+
+    call_count = 0
+
+    def expensive_function(x: int) -> dict[str, list[int]]:
+        nonlocal call_count
+        call_count += 1
+        return {"x": [x]}
+
+    assert cached(storage=cache)(expensive_function)(1) == {"x": [1]}
+    # the pickled result isn't fed to the JSON serializer
+    json_function = cached(storage=cache, serializer=JsonSerializer())(expensive_function)
+    assert json_function(1) == {"x": [1]}
+    assert json_function(1) == {"x": [1]}
+    assert call_count == 2
+
+
+def test_msgpack_serializer():
+    pytest.importorskip("msgpack")
+    serializer = MsgpackSerializer()
+    assert serializer.loads(serializer.dumps({"x": [1]})) == {"x": [1]}
+
+
+def test_cached_function_single_flight():
+    cache = CleanCache("test.db")
+
+    call_count = 0
+
+    @cached(storage=cache)
+    def expensive_function(x: int) -> int:
+        nonlocal call_count
+        call_count += 1
+        time.sleep(0.1)
+        return x
+
+    threads = [Thread(target=expensive_function, args=(1,)) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert call_count == 1
+
+
+def test_cached_function_single_flight_retries_after_failure():
+    cache = CleanCache("test.db")
+
+    call_count = 0
+    results: list[int] = []
+
+    @cached(storage=cache)
+    def expensive_function(x: int) -> int:
+        nonlocal call_count
+        call_count += 1
+        time.sleep(0.1)
+        if call_count == 1:
+            raise RuntimeError
+        return x
+
+    def call() -> None:
+        with suppress(RuntimeError):
+            results.append(expensive_function(1))
+
+    threads = [Thread(target=call) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert call_count == 2
+    assert results == [1, 1]
+
+
+async def test_async_cached_function_single_flight():
+    cache = CleanCache("test.db")
+
+    call_count = 0
+
+    @async_cached(storage=cache)
+    async def expensive_function(x: int) -> int:
+        nonlocal call_count
+        call_count += 1
+        await asyncio.sleep(0.1)
+        return x
+
+    assert await asyncio.gather(*(expensive_function(1) for _ in range(5))) == [1] * 5
+    assert call_count == 1
+
+
+def test_cached_function_lease_shared_between_storages():
+    call_count = 0
+
+    def expensive_function(x: int) -> int:
+        nonlocal call_count
+        call_count += 1
+        time.sleep(0.2)
+        return x
+
+    # Separate storages stand in for separate processes
+    funcs = [
+        cached(storage=CleanCache("test.db"), lease=timedelta(seconds=10))(expensive_function)
+        for _ in range(3)
+    ]
+    threads = [Thread(target=f, args=(1,)) for f in funcs]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert call_count == 1
+
+
+def wait_for(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out waiting for condition"
+        time.sleep(0.01)
+
+
+def test_cached_function_records_cost():
+    cache = CleanCache("test.db")
+
+    @cached(storage=cache, expiration=timedelta(hours=1))
+    def expensive_function() -> None:
+        time.sleep(0.05)
+
+    expensive_function()
+    (item,) = cache.get_many().values()
+    cost = item.get("cost")
+    assert cost is not None
+    assert cost >= 0.05
+    expiration = item.get("expiration")
+    assert expiration is not None
+    assert timedelta(minutes=59) < expiration <= timedelta(hours=1)
+
+
+def test_cached_function_stale_while_revalidate():
+    cache = CleanCache("test.db")
+
+    call_count = 0
+
+    @cached(
+        storage=cache,
+        expiration=timedelta(milliseconds=50),
+        stale_while_revalidate=timedelta(hours=1),
+    )
+    def expensive_function() -> int:
+        nonlocal call_count
+        call_count += 1
+        return call_count
+
+    assert expensive_function() == 1
+    time.sleep(0.1)
+    # the stale result is returned while a new one is computed in the background
+    assert expensive_function() == 1
+    wait_for(lambda: expensive_function() == 2)
+    assert call_count == 2
+
+    stats = expensive_function.cache_stats()
+    assert stats["stale_hits"] >= 1
+    assert stats["refreshes"] == 1
+
+
+@pytest.mark.parametrize(
+    ("default_expiration", "expiration", "jitter", "min_expiration", "max_expiration"),
+    [
+        (timedelta(hours=1), None, 0.0, timedelta(minutes=119), timedelta(hours=2)),
+        (None, timedelta(minutes=1), 0.5, timedelta(minutes=60.5), timedelta(minutes=61)),
+    ],
+)
+def test_cached_function_stale_while_revalidate_with_storage_expiration(
+    default_expiration: timedelta | None,
+    expiration: timedelta | None,
+    jitter: float,
+    min_expiration: timedelta,
+    max_expiration: timedelta,
+):
+    cache = CleanCache("test.db", default_expiration=default_expiration, expiration_jitter=jitter)
+
+    call_count = 0
+
+    @cached(storage=cache, expiration=expiration, stale_while_revalidate=timedelta(hours=1))
+    def expensive_function() -> int:
+        nonlocal call_count
+        call_count += 1
+        return call_count
+
+    for _ in range(5):
+        assert expensive_function() == 1
+
+    # the default expiration and jitter only apply to the time the result is fresh for
+    (item,) = cache.get_many().values()
+    stored = item.get("expiration")
+    assert stored is not None
+    assert min_expiration < stored <= max_expiration
+    stats = expensive_function.cache_stats()
+    assert stats["stale_hits"] == 0
+    assert stats["refreshes"] == 0
+
+
+async def test_async_cached_function_stale_while_revalidate():
+    cache = CleanCache("test.db")
+
+    call_count = 0
+
+    @async_cached(
+        storage=cache,
+        expiration=timedelta(milliseconds=50),
+        stale_while_revalidate=timedelta(hours=1),
+    )
+    async def expensive_function() -> int:
+        nonlocal call_count
+        call_count += 1
+        return call_count
+
+    assert await expensive_function() == 1
+    await asyncio.sleep(0.1)
+    assert await expensive_function() == 1
+    for _ in range(100):
+        if await expensive_function() == 2:
+            break
+        await asyncio.sleep(0.01)
+    assert call_count == 2
+
+
+@pytest.mark.parametrize(("early_refresh", "expected_calls"), [(None, 1), (1e9, 2)])
+def test_cached_function_early_refresh(early_refresh: float | None, expected_calls: int):
+    cache = CleanCache("test.db")
+
+    call_count = 0
+
+    @cached(storage=cache, expiration=timedelta(hours=1), early_refresh=early_refresh)
+    def expensive_function() -> int:
+        nonlocal call_count
+        call_count += 1
+        time.sleep(0.01)
+        return call_count
+
+    expensive_function()
+    expensive_function()
+    assert call_count == expected_calls
+
+
+def test_cached_function_with_computed_expiration():
+    cache = CleanCache("test.db")
+
+    def expire_after(minutes: int) -> timedelta:
+        return timedelta(minutes=minutes)
+
+    @cached(storage=cache, expiration=expire_after)
+    def expensive_function(minutes: int) -> int:
+        return minutes
+
+    expensive_function(5)
+    (item,) = cache.get_many().values()
+    expiration = item.get("expiration")
+    assert expiration is not None
+    assert timedelta(minutes=4) < expiration <= timedelta(minutes=5)
+
+
+def test_cache_stats():
+    cache = CleanCache("test.db")
+
+    @cached(storage=cache)
+    def func(x: int) -> int:
+        return x
+
+    func(1)
+    func(1)
+    func(2)
+
+    stats = func.cache_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["stale_hits"] == 0
+    assert stats["compute_seconds"] > 0
+
+
+async def test_async_cache_stats():
+    cache = CleanCache("test.db")
+
+    @async_cached(storage=cache)
+    async def func(x: int) -> int:
+        return x
+
+    await func(1)
+    await func(1)
+
+    stats = func.cache_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_cached_function_with_sharded_storage(clean_caches_dir: Path):
+    call_count = 0
+
+    with ShardedStorage(clean_caches_dir / "sharded", shards=2) as storage:
+
+        @cached(storage=storage)
+        def func(x: int) -> int:
+            nonlocal call_count
+            call_count += 1
+            return x
+
+        assert [func(i) for i in range(10)] == list(range(10))
+        assert [func(i) for i in range(10)] == list(range(10))
+        assert call_count == 10
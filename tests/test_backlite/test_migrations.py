@@ -23,3 +23,73 @@ def test_truncate_on_py_version_change(clean_caches_dir: Path):
         migrations.run(conn)
         assert metadata.py_version.get(conn) == sys.version_info[:3]
         assert commands.get_cache_items(conn, ["key"]) == {}
+
+
+def test_rerun_after_truncate_on_py_version_change(clean_caches_dir: Path):
+    with sqlite3.connect(clean_caches_dir / "test.db") as conn:
+        migrations.run(conn)
+        metadata.py_version.set(conn, (3, 8, 0))
+        migrations.run(conn)
+        # upgrades must not be re-applied after the cache was truncated
+        migrations.run(conn)
+        assert metadata.schema_version.get(conn) == migrations.CURRENT_SCHEMA_VERSION
+        assert metadata.total_value_size.get(conn) == 0
+
+
+def test_v2_stores_sizes_and_indexes(clean_caches_dir: Path):
+    with sqlite3.connect(clean_caches_dir / "test.db") as conn:
+        migrations.UPGRADES[0](conn)
+        metadata.schema_version.set(conn, 1)
+        metadata.py_version.set(conn, sys.version_info[:3])
+        conn.execute("INSERT OR REPLACE INTO cache (key, value) VALUES ('a', x'0102')")
+        # replacing a row did not subtract the old size in v1
+        conn.execute("INSERT OR REPLACE INTO cache (key, value) VALUES ('a', x'010203')")
+        assert metadata.total_value_size.get(conn) == 5
+
+        migrations.run(conn)
+
+        assert conn.execute("SELECT size FROM cache WHERE key = 'a'").fetchone() == (3,)
+        assert metadata.total_value_size.get(conn) == 3
+        indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+        assert {
+            "cache_accessed_at",
+            "cache_accessed_count",
+            "cache_created_at",
+            "cache_expires_at",
+        } <= indexes
+
+
+def test_replacing_item_updates_total_value_size(clean_caches_dir: Path):
+    with sqlite3.connect(clean_caches_dir / "test.db") as conn:
+        migrations.run(conn)
+        commands.set_cache_items(conn, {"key": CacheItem(value=b"12345")})
+        commands.set_cache_items(conn, {"key": CacheItem(value=b"12")})
+        assert metadata.total_value_size.get(conn) == 2
+
+
+def test_v7_prioritizes_existing_items(clean_caches_dir: Path):
+    with sqlite3.connect(clean_caches_dir / "test.db") as conn:
+        for upgrade in migrations.UPGRADES[:6]:
+            upgrade(conn)
+        metadata.schema_version.set(conn, 6)
+        metadata.py_version.set(conn, sys.version_info[:3])
+        conn.execute("INSERT INTO cache (key, value, size, cost) VALUES ('a', x'0102', 2, 3.0)")
+
+        migrations.run(conn)
+
+        assert conn.execute("SELECT priority FROM cache WHERE key = 'a'").fetchone() == (1.5,)
+        assert metadata.eviction_inflation.get(conn) == 0
+
+
+def test_recent_value_size_tracks_unaccessed_items(clean_caches_dir: Path):
+    with sqlite3.connect(clean_caches_dir / "test.db") as conn:
+        migrations.run(conn)
+        commands.set_cache_items(conn, {"a": CacheItem(value=b"12"), "b": CacheItem(value=b"345")})
+        assert metadata.recent_value_size.get(conn) == 5
+
+        commands.get_cache_items(conn, ["a"])
+        assert metadata.recent_value_size.get(conn) == 3
+
+        # replacing an item makes it unaccessed again
+        commands.set_cache_items(conn, {"a": CacheItem(value=b"6789")})
+        assert metadata.recent_value_size.get(conn) == 7
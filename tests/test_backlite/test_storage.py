@@ -1,8 +1,27 @@
+import os
+import sqlite3
+import threading
 import time
 from datetime import timedelta
+from io import BytesIO
+from pathlib import Path
+from threading import Thread
 
+import pytest
+from anyio import CapacityLimiter
+
+from backlite import _commands as commands
+from backlite._admission import FrequencySketch
+from backlite._hashing import jump_hash
+from backlite._memory import MemoryCache
+from backlite.storage import AsyncStorage
+from backlite.storage import ShardedStorage
 from backlite.storage import Storage
+from backlite.types import COMPRESSIONS
 from backlite.types import CacheItem
+from backlite.types import Compression
+from backlite.types import PragmaValue
+from backlite.types import TuningProfile
 from tests.conftest import CleanCache
 
 
@@ -72,6 +91,203 @@ def test_least_frequently_use_eviction_policy():
     assert cache.get_one("key3") == item_3
 
 
+def test_greedy_dual_size_frequency_eviction_policy():
+    cache = CleanCache("test.db", size_limit=7, eviction_policy="greedy-dual-size-frequency")
+
+    item_1 = CacheItem(value=b"123", cost=1.0)
+    cache.set_one("key1", item_1)
+
+    item_2 = CacheItem(value=b"456", cost=0.01)
+    cache.set_one("key2", item_2)
+
+    # key2 was used more recently but is cheaper to compute
+    assert cache.get_one("key2") == item_2
+
+    # add a new item that should evict key2
+    item_3 = CacheItem(value=b"789", cost=0.01)
+    cache.set_one("key3", item_3)
+
+    assert cache.get_one("key1") == item_1
+    assert cache.get_one("key2") is None
+    assert cache.get_one("key3") == item_3
+
+
+def test_greedy_dual_size_frequency_eviction_policy_prefers_small_items():
+    cache = CleanCache("test.db", size_limit=8, eviction_policy="greedy-dual-size-frequency")
+
+    item_1 = CacheItem(value=b"123456", cost=0.01)
+    cache.set_one("key1", item_1)
+
+    item_2 = CacheItem(value=b"12", cost=0.01)
+    cache.set_one("key2", item_2)
+
+    # the larger item frees more room for the same cost
+    item_3 = CacheItem(value=b"34", cost=0.01)
+    cache.set_one("key3", item_3)
+
+    assert cache.get_one("key1") is None
+    assert cache.get_one("key2") == item_2
+    assert cache.get_one("key3") == item_3
+
+
+def test_greedy_dual_size_frequency_eviction_policy_ages_items():
+    cache = CleanCache("test.db", size_limit=6, eviction_policy="greedy-dual-size-frequency")
+
+    # key1 was costly but is never used again
+    cache.set_one("key1", CacheItem(value=b"123", cost=0.3))
+    for i in range(10):
+        # each eviction raises the priority that new and accessed items start from
+        cache.set_one(f"key{i + 2}", CacheItem(value=b"456", cost=0.1))
+
+    assert cache.get_one("key1") is None
+
+
+def test_adaptive_eviction_policy():
+    cache = CleanCache("test.db", size_limit=7, eviction_policy="adaptive")
+
+    item_1 = CacheItem(value=b"123")
+    cache.set_one("key1", item_1)
+
+    item_2 = CacheItem(value=b"456")
+    cache.set_one("key2", item_2)
+
+    # access key1 so it's no longer among the items that have only been written
+    assert cache.get_one("key1") == item_1
+
+    # add a new item that should evict key2
+    item_3 = CacheItem(value=b"789")
+    cache.set_one("key3", item_3)
+
+    assert cache.get_one("key1") == item_1
+    assert cache.get_one("key2") is None
+    assert cache.get_one("key3") == item_3
+
+
+def test_adaptive_eviction_policy_resists_scans():
+    cache = CleanCache("test.db", size_limit=9, eviction_policy="adaptive")
+
+    hot = {f"hot{i}": CacheItem(value=b"123") for i in range(2)}
+    cache.set_many(hot)
+    assert cache.get_many(hot.keys()) == hot
+
+    for i in range(10):
+        cache.set_one(f"cold{i}", CacheItem(value=b"456"))
+
+    assert cache.get_many(hot.keys()) == hot
+    assert cache.get_keys() == {*hot, "cold9"}
+
+
+def test_adaptive_eviction_policy_adapts_to_evicted_keys():
+    cache = CleanCache("test.db", size_limit=6, eviction_policy="adaptive")
+
+    cache.set_one("key1", CacheItem(value=b"123"))
+    cache.set_one("key2", CacheItem(value=b"456"))
+    cache.set_one("key3", CacheItem(value=b"789"))
+    assert cache.get_keys() == {"key2", "key3"}
+
+    # writing key1 again shows it was evicted too soon so more room is kept for new items
+    cache.set_one("key1", CacheItem(value=b"123"))
+    assert cache.get_keys() == {"key1", "key3"}
+
+    # key1 now counts as accessed so it's evicted instead of the newer key3
+    cache.set_one("key4", CacheItem(value=b"012"))
+    assert cache.get_keys() == {"key3", "key4"}
+
+
+def test_admission_policy_keeps_items_used_more_often():
+    cache = CleanCache("test.db", size_limit=9, admission_policy="tiny-lfu")
+
+    hot = {f"hot{i}": CacheItem(value=b"123") for i in range(3)}
+    cache.set_many(hot)
+    for _ in range(3):
+        assert cache.get_many(hot.keys()) == hot
+
+    # a scan of keys that are only used once doesn't displace the hot ones
+    for i in range(20):
+        cache.set_one(f"cold{i}", CacheItem(value=b"456"))
+
+    assert cache.get_many(hot.keys()) == hot
+    assert cache.get_keys() == set(hot)
+    assert cache.stats()["rejections"] == 20
+
+
+def test_admission_policy_admits_items_used_more_often():
+    cache = CleanCache("test.db", size_limit=9, admission_policy="tiny-lfu")
+
+    cache.set_many({f"key{i}": CacheItem(value=b"123") for i in range(3)})
+    # replacing an existing item is always allowed
+    cache.set_one("key0", CacheItem(value=b"456"))
+
+    # the new key has been asked for more often than the ones already cached
+    for _ in range(3):
+        assert cache.get_one("new") is None
+    cache.set_one("new", CacheItem(value=b"789"))
+
+    assert cache.get_one("new") == CacheItem(value=b"789")
+    assert len(cache.get_keys()) == 3
+    assert cache.stats()["rejections"] == 0
+
+
+def test_admission_policy_counts_replaced_items_once():
+    cache = CleanCache("test.db", size_limit=100, admission_policy="tiny-lfu")
+    cache.set_one("a", CacheItem(value=b"a" * 60))
+
+    for _ in range(5):
+        assert cache.get_one("b") is None
+    # the replaced value's 60 bytes make room for the new one
+    cache.set_many({"a": CacheItem(value=b"x" * 60), "b": CacheItem(value=b"b" * 30)})
+
+    assert cache.get_keys() == {"a", "b"}
+    assert cache.stats()["rejections"] == 0
+
+
+def test_admission_policy_leaves_expired_items_to_janitor(monkeypatch: pytest.MonkeyPatch):
+    limits: list[int | None] = []
+    original = commands.delete_expired_cache_items
+
+    def spy(conn: sqlite3.Connection, *, limit: int | None = None) -> int:
+        limits.append(limit)
+        return original(conn, limit=limit)
+
+    monkeypatch.setattr(commands, "delete_expired_cache_items", spy)
+
+    with CleanCache(
+        "test.db",
+        admission_policy="tiny-lfu",
+        janitor_interval=timedelta(hours=1),
+        janitor_batch_size=2,
+    ) as cache:
+        cache.set_one("key", CacheItem(value=b"123"))
+
+    # only the janitor removes expired items, and only in batches
+    assert None not in limits
+
+
+def test_admission_policy_rejections_leave_memory_tier():
+    cache = CleanCache("test.db", size_limit=5, memory_limit=1024, admission_policy="tiny-lfu")
+    cache.set_one("key1", CacheItem(value=b"old__"))
+
+    # key2 is asked for more often so it's admitted, evicting key1 but not from memory
+    for _ in range(3):
+        assert cache.get_one("key2") is None
+    cache.set_one("key2", CacheItem(value=b"12345"))
+
+    cache.set_one("key1", CacheItem(value=b"new__"))
+    assert cache.stats()["rejections"] == 1
+    assert cache.get_one("key1") is None
+
+
+def test_frequency_sketch_ages_estimates():
+    sketch = FrequencySketch(sample_size=20)
+    sketch.record(["hot"] * 10)
+    assert sketch.estimate("hot") == 10
+    assert sketch.estimate("cold") == 0
+
+    # counts saturate and are halved once the sample size has been recorded
+    sketch.record(["hot"] * 10)
+    assert sketch.estimate("hot") == 7
+
+
 def test_most_recently_used_eviction_policy():
     cache = CleanCache("test.db", size_limit=7, eviction_policy="most-recently-used")
 
@@ -195,3 +411,1022 @@ def test_get_keys():
     assert cache.get_keys(["key1"]) == {"key1"}
     assert cache.get_keys(["not_in_cache"]) == set()
     assert cache.get_keys([]) == set()
+
+
+@pytest.fixture
+def connect_calls(monkeypatch: pytest.MonkeyPatch) -> list[sqlite3.Connection]:
+    conns: list[sqlite3.Connection] = []
+    connect = sqlite3.connect
+
+    def connect_spy(*args, **kwargs):
+        conns.append(conn := connect(*args, **kwargs))
+        return conn
+
+    monkeypatch.setattr(sqlite3, "connect", connect_spy)
+    return conns
+
+
+def test_connection_is_reused_within_a_thread(connect_calls: list[sqlite3.Connection]):
+    cache = CleanCache("test.db")
+    item = CacheItem(value=b"Hello, Alice!")
+    cache.set_one("key", item)
+    assert cache.get_one("key") == item
+    assert cache.get_keys() == {"key"}
+    assert len(connect_calls) == 1
+
+
+def test_each_thread_gets_its_own_connection(connect_calls: list[sqlite3.Connection]):
+    cache = CleanCache("test.db")
+    item = CacheItem(value=b"Hello, Alice!")
+
+    thread = Thread(target=cache.set_one, args=("key", item))
+    thread.start()
+    thread.join()
+
+    assert cache.get_one("key") == item
+    assert len(connect_calls) == 2
+
+
+def test_close_storage():
+    with CleanCache("test.db") as cache:
+        cache.set_one("key", CacheItem(value=b"123"))
+    with pytest.raises(RuntimeError, match="closed"):
+        cache.get_one("key")
+
+
+def test_new_connection_after_fork(
+    monkeypatch: pytest.MonkeyPatch,
+    connect_calls: list[sqlite3.Connection],
+):
+    cache = CleanCache("test.db")
+    item = CacheItem(value=b"123")
+    cache.set_one("key", item)
+
+    # Simulate being in a forked child process
+    monkeypatch.setattr(os, "getpid", lambda: -1)
+
+    assert cache.get_one("key") == item
+    assert len(connect_calls) == 2
+
+
+def test_wal_journal_mode_by_default(clean_caches_dir: Path):
+    CleanCache("test.db")
+    with sqlite3.connect(clean_caches_dir / "test.db") as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+@pytest.mark.parametrize(
+    ("tuning", "synchronous"),
+    [("durable", 2), ("fast", 1), ("ephemeral", 0)],
+)
+def test_tuning_profile(
+    tuning: TuningProfile,
+    synchronous: int,
+    connect_calls: list[sqlite3.Connection],
+):
+    CleanCache("test.db", tuning=tuning)
+    (conn,) = connect_calls
+    assert conn.execute("PRAGMA synchronous").fetchone() == (synchronous,)
+
+
+def test_pragma_overrides(connect_calls: list[sqlite3.Connection]):
+    CleanCache("test.db", tuning="durable", pragmas={"synchronous": "OFF", "cache_size": -1024})
+    (conn,) = connect_calls
+    assert conn.execute("PRAGMA synchronous").fetchone() == (0,)
+    assert conn.execute("PRAGMA cache_size").fetchone() == (-1024,)
+
+
+@pytest.mark.parametrize(
+    "pragmas",
+    [{"synchronous; DROP TABLE cache": "OFF"}, {"synchronous": "OFF; DROP TABLE cache"}],
+)
+def test_invalid_pragmas(pragmas: dict[str, PragmaValue]):
+    with pytest.raises(ValueError, match="Invalid"):
+        CleanCache("test.db", pragmas=pragmas)
+
+
+def test_eviction_only_removes_enough_items_to_fit():
+    cache = CleanCache("test.db", size_limit=10, eviction_policy="first-in-first-out")
+    cache.set_many({f"key{i}": CacheItem(value=b"12") for i in range(5)})
+    cache.set_one("new", CacheItem(value=b"1234"))
+    assert cache.get_keys() == {"key2", "key3", "key4", "new"}
+
+
+def access_counts(path: Path) -> dict[str, int]:
+    with sqlite3.connect(path) as conn:
+        return dict(conn.execute("SELECT key, accessed_count FROM cache").fetchall())
+
+
+def test_deferred_access_stats(clean_caches_dir: Path):
+    cache = CleanCache("test.db", access_flush_interval=timedelta(hours=1))
+    cache.set_one("key", CacheItem(value=b"123"))
+
+    cache.get_one("key")
+    cache.get_one("key")
+    assert access_counts(clean_caches_dir / "test.db") == {"key": 0}
+
+    cache.flush()
+    assert access_counts(clean_caches_dir / "test.db") == {"key": 2}
+
+
+def test_deferred_access_stats_flushed_after_count(clean_caches_dir: Path):
+    cache = CleanCache(
+        "test.db",
+        access_flush_interval=timedelta(hours=1),
+        access_flush_count=3,
+    )
+    cache.set_one("key", CacheItem(value=b"123"))
+
+    cache.get_one("key")
+    cache.get_one("key")
+    assert access_counts(clean_caches_dir / "test.db") == {"key": 0}
+    cache.get_one("key")
+    assert access_counts(clean_caches_dir / "test.db") == {"key": 3}
+
+
+def test_deferred_access_stats_flushed_before_eviction():
+    cache = CleanCache(
+        "test.db",
+        size_limit=7,
+        eviction_policy="least-frequently-used",
+        access_flush_interval=timedelta(hours=1),
+    )
+
+    item_1 = CacheItem(value=b"123")
+    cache.set_one("key1", item_1)
+    item_2 = CacheItem(value=b"456")
+    cache.set_one("key2", item_2)
+
+    # access key1 to make it the most frequently used
+    assert cache.get_one("key1") == item_1
+
+    # add a new item that should evict key2
+    cache.set_one("key3", CacheItem(value=b"789"))
+
+    assert cache.get_keys() == {"key1", "key3"}
+
+
+def test_deferred_access_stats_flushed_on_close(clean_caches_dir: Path):
+    with CleanCache("test.db", access_flush_interval=timedelta(hours=1)) as cache:
+        cache.set_one("key", CacheItem(value=b"123"))
+        cache.get_one("key")
+    assert access_counts(clean_caches_dir / "test.db") == {"key": 1}
+
+
+def test_get_many_only_returns_requested_keys():
+    cache = CleanCache("test.db")
+    items = {
+        "key1": CacheItem(value=b"123", expiration=timedelta(hours=1)),
+        "key2": CacheItem(value=b"456", expiration=timedelta(hours=1)),
+    }
+    cache.set_many(items)
+    assert cache.get_many(["key1"]).keys() == {"key1"}
+
+
+def test_memory_tier_serves_items(connect_calls: list[sqlite3.Connection]):
+    cache = CleanCache("test.db", memory_limit=1024)
+    item = CacheItem(value=b"123")
+    cache.set_one("key", item)
+
+    # changes made through the storage's own connection don't invalidate the memory tier
+    (conn,) = connect_calls
+    with conn:
+        conn.execute("DELETE FROM cache")
+
+    assert cache.get_one("key") == item
+
+
+def test_memory_tier_invalidated_by_other_connections():
+    cache = CleanCache("test.db", memory_limit=1024)
+    other = CleanCache("test.db")
+
+    cache.set_one("key", CacheItem(value=b"123"))
+    assert cache.get_one("key") == CacheItem(value=b"123")
+
+    other.set_one("key", CacheItem(value=b"456"))
+    assert cache.get_one("key") == CacheItem(value=b"456")
+
+
+def test_memory_tier_size_limit(connect_calls: list[sqlite3.Connection]):
+    cache = CleanCache("test.db", memory_limit=6)
+    cache.set_many({"key1": CacheItem(value=b"123"), "key2": CacheItem(value=b"456")})
+    cache.get_one("key1")
+    cache.set_one("key3", CacheItem(value=b"789"))
+
+    (conn,) = connect_calls
+    with conn:
+        conn.execute("DELETE FROM cache")
+
+    # key2 was the least recently used item in memory
+    assert cache.get_keys() == set()
+    assert cache.get_many(["key1", "key2", "key3"]).keys() == {"key1", "key3"}
+
+
+def test_memory_tier_respects_expiration():
+    cache = CleanCache("test.db", memory_limit=1024)
+    cache.set_one("key", CacheItem(value=b"123", expiration=timedelta(seconds=0)))
+    short_sleep()
+    assert cache.get_one("key") is None
+
+
+async def test_async_storage():
+    async with AsyncStorage(CleanCache("test.db")) as cache:
+        items = {
+            "key1": CacheItem(value=b"Hello, Alice!"),
+            "key2": CacheItem(value=b"Hello, Bob!"),
+        }
+        await cache.set_many(items)
+        await cache.set_one("key3", CacheItem(value=b"Hello, Eve!"))
+        assert await cache.get_many(items.keys()) == items
+        assert await cache.get_one("key3") == CacheItem(value=b"Hello, Eve!")
+        assert await cache.get_keys() == {"key1", "key2", "key3"}
+    with pytest.raises(RuntimeError, match="closed"):
+        cache.storage.get_one("key1")
+
+
+async def test_async_storage_does_not_block_event_loop(monkeypatch: pytest.MonkeyPatch):
+    cache = AsyncStorage(CleanCache("test.db"), limiter=CapacityLimiter(1))
+    loop_thread = threading.get_ident()
+    threads: list[int] = []
+
+    monkeypatch.setattr(cache.storage, "set_one", lambda *_: threads.append(threading.get_ident()))
+    await cache.set_one("key", CacheItem(value=b"123"))
+
+    assert threads
+    assert threads[0] != loop_thread
+
+
+@pytest.mark.parametrize("compression", sorted(COMPRESSIONS))
+def test_compression(clean_caches_dir: Path, compression: Compression):
+    cache = CleanCache("test.db", compression=compression, compression_threshold=100)
+    items = {
+        "small": CacheItem(value=b"a" * 10),
+        "large": CacheItem(value=b"a" * 1000),
+    }
+    cache.set_many(items)
+    assert cache.get_many(items.keys()) == items
+
+    with sqlite3.connect(clean_caches_dir / "test.db") as conn:
+        rows = dict(conn.execute("SELECT key, codec FROM cache").fetchall())
+        (total_size,) = conn.execute("SELECT SUM(size) FROM cache").fetchone()
+    assert rows == {"small": None, "large": compression}
+    assert total_size < 1010
+
+
+def test_compressed_items_readable_after_compression_changes():
+    item = CacheItem(value=b"a" * 1000)
+    CleanCache("test.db", compression="zlib").set_one("key", item)
+    assert CleanCache("test.db").get_one("key") == item
+
+
+def test_room_made_for_compressed_size():
+    cache = CleanCache("test.db", size_limit=1000, compression="zlib", compression_threshold=100)
+    items = {f"key{i}": CacheItem(value=os.urandom(90)) for i in range(10)}
+    cache.set_many(items)
+
+    # the value is stored in far less than the 100 bytes still free
+    cache.set_one("large", CacheItem(value=b"a" * 950))
+    assert cache.get_keys() == {*items, "large"}
+    assert cache.stats()["evictions"] == 0
+
+
+def test_incompressible_values_stored_uncompressed(clean_caches_dir: Path):
+    cache = CleanCache("test.db", compression="zlib", compression_threshold=0)
+    item = CacheItem(value=os.urandom(100))
+    cache.set_one("key", item)
+    assert cache.get_one("key") == item
+    with sqlite3.connect(clean_caches_dir / "test.db") as conn:
+        assert conn.execute("SELECT codec FROM cache").fetchone() == (None,)
+
+
+def test_many_keys():
+    cache = CleanCache("test.db")
+    # more keys than SQLite allows variables in a single statement
+    items = {f"key{i}": CacheItem(value=b"") for i in range(100_000)}
+    cache.set_many(items)
+    assert cache.get_many(items.keys()) == items
+    assert cache.get_keys(items.keys()) == items.keys()
+    assert cache.get_keys(["key1", "nope"]) == {"key1"}
+
+
+def blob_files(clean_caches_dir: Path) -> list[Path]:
+    return list((clean_caches_dir / "test.db.blobs").glob("*"))
+
+
+def test_external_values(clean_caches_dir: Path):
+    cache = CleanCache("test.db", external_threshold=100)
+    items = {
+        "small": CacheItem(value=b"a" * 10),
+        "large": CacheItem(value=b"a" * 1000),
+    }
+    cache.set_many(items)
+
+    result = cache.get_many(items.keys())
+    assert result == items
+    assert isinstance(result["large"]["value"], memoryview)
+    assert len(blob_files(clean_caches_dir)) == 1
+    with sqlite3.connect(clean_caches_dir / "test.db") as conn:
+        assert conn.execute("SELECT SUM(size), SUM(LENGTH(value)) FROM cache").fetchone() == (
+            1010,
+            10,
+        )
+
+
+def test_external_values_removed_when_replaced(clean_caches_dir: Path):
+    cache = CleanCache("test.db", external_threshold=100)
+    cache.set_one("key", CacheItem(value=b"a" * 1000))
+    (old_file,) = blob_files(clean_caches_dir)
+
+    cache.set_one("key", CacheItem(value=b"b" * 1000))
+    (new_file,) = blob_files(clean_caches_dir)
+    assert old_file != new_file
+
+    cache.set_one("key", CacheItem(value=b"c"))
+    assert blob_files(clean_caches_dir) == []
+    assert cache.get_one("key") == CacheItem(value=b"c")
+
+
+def test_external_values_removed_when_evicted(clean_caches_dir: Path):
+    cache = CleanCache("test.db", size_limit=1500, external_threshold=100)
+    cache.set_one("key1", CacheItem(value=b"a" * 1000))
+    old_value = cache.get_one("key1")
+    cache.set_one("key2", CacheItem(value=b"b" * 1000))
+
+    assert cache.get_keys() == {"key2"}
+    assert len(blob_files(clean_caches_dir)) == 1
+    # views of removed files remain readable
+    assert old_value == CacheItem(value=b"a" * 1000)
+
+
+def test_external_values_removed_when_write_fails(
+    clean_caches_dir: Path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    cache = CleanCache("test.db", external_threshold=100)
+
+    def fail(*_, **__):
+        raise sqlite3.OperationalError
+
+    monkeypatch.setattr(commands, "set_cache_items", fail)
+    with pytest.raises(sqlite3.OperationalError):
+        cache.set_one("key", CacheItem(value=b"a" * 1000))
+    assert blob_files(clean_caches_dir) == []
+
+
+@pytest.mark.parametrize("external_threshold", [None, 100])
+def test_stream_values(external_threshold: int | None):
+    cache = CleanCache("test.db", external_threshold=external_threshold)
+    chunks = [b"a" * 100, b"b" * 100, b"c" * 100]
+
+    with cache.open_writer("key", 300) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+
+    with cache.open_reader("key") as reader:
+        assert [reader.read(100) for _ in chunks] == chunks
+        assert reader.read() == b""
+
+    assert cache.get_one("key") == CacheItem(value=b"".join(chunks))
+
+
+def test_stream_compressed_value():
+    cache = CleanCache("test.db", compression="zlib", compression_threshold=0)
+    cache.set_one("key", CacheItem(value=b"a" * 1000))
+    with cache.open_reader("key") as reader:
+        assert reader.read() == b"a" * 1000
+
+
+def test_stream_missing_value():
+    cache = CleanCache("test.db")
+    with pytest.raises(KeyError), cache.open_reader("key"):
+        pass
+
+
+@pytest.mark.parametrize("external_threshold", [None, 5])
+def test_stream_incomplete_value_not_stored(clean_caches_dir: Path, external_threshold: int | None):
+    cache = CleanCache("test.db", external_threshold=external_threshold)
+    cache.set_one("key", CacheItem(value=b"old"))
+
+    with pytest.raises(ValueError, match="Expected 10 bytes"):
+        with cache.open_writer("key", 10) as writer:
+            writer.write(b"new")
+
+    assert cache.get_one("key") == CacheItem(value=b"old")
+    assert blob_files(clean_caches_dir) == []
+
+
+def test_stream_copy_between_keys():
+    cache = CleanCache("test.db", access_flush_interval=timedelta(hours=1))
+    cache.set_one("src", CacheItem(value=b"a" * 100))
+
+    with cache.open_writer("dst", 100) as dst, cache.open_reader("src") as src:
+        # the value being written isn't visible until it's complete
+        assert cache.get_one("dst") is None
+        dst.write(src.read())
+
+    assert cache.get_one("dst") == CacheItem(value=b"a" * 100)
+
+
+def test_stream_writes_in_same_thread_raise():
+    cache = CleanCache("test.db")
+    cache.set_one("src", CacheItem(value=b"123"))
+
+    with cache.open_writer("dst", 3) as dst:
+        # reads record access statistics in the database by default
+        with pytest.raises(RuntimeError, match="open for writing"):
+            cache.get_one("src")
+        with pytest.raises(RuntimeError, match="open for writing"):
+            cache.set_one("other", CacheItem(value=b"123"))
+        dst.write(b"456")
+
+    assert cache.get_many(["src", "dst"]) == {
+        "src": CacheItem(value=b"123"),
+        "dst": CacheItem(value=b"456"),
+    }
+
+
+def test_stream_value_larger_than_size_limit():
+    cache = CleanCache("test.db", size_limit=5)
+    with pytest.raises(ValueError, match="exceeds size limit"):
+        with cache.open_writer("key", 10):
+            pass
+
+
+def wait_for(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out waiting for condition"
+        short_sleep()
+
+
+def janitor_threads() -> list[Thread]:
+    return [t for t in threading.enumerate() if t.name == "backlite-janitor"]
+
+
+def test_janitor_evicts_in_background():
+    with CleanCache(
+        "test.db",
+        size_limit=6,
+        eviction_policy="first-in-first-out",
+        janitor_interval=timedelta(milliseconds=10),
+    ) as cache:
+        cache.set_many({f"key{i}": CacheItem(value=b"123") for i in range(3)})
+        wait_for(lambda: cache.get_keys() == {"key1", "key2"})
+
+
+def test_janitor_does_not_evict_on_write():
+    with CleanCache("test.db", size_limit=6, janitor_interval=timedelta(hours=1)) as cache:
+        cache.set_many({f"key{i}": CacheItem(value=b"123") for i in range(3)})
+        assert cache.get_keys() == {"key0", "key1", "key2"}
+
+
+def test_janitor_removes_expired_items_in_batches(monkeypatch: pytest.MonkeyPatch):
+    limits: list[int | None] = []
+    original = commands.delete_expired_cache_items
+
+    def spy(conn: sqlite3.Connection, *, limit: int | None = None) -> int:
+        limits.append(limit)
+        return original(conn, limit=limit)
+
+    monkeypatch.setattr(commands, "delete_expired_cache_items", spy)
+
+    with CleanCache(
+        "test.db",
+        janitor_interval=timedelta(milliseconds=10),
+        janitor_batch_size=2,
+    ) as cache:
+        expired = CacheItem(value=b"123", expiration=timedelta(seconds=-1))
+        cache.set_many({f"key{i}": expired for i in range(5)})
+        cache.set_one("fresh", CacheItem(value=b"123"))
+        wait_for(lambda: cache.get_keys() == {"fresh"})
+
+    assert limits
+    assert set(limits) == {2}
+
+
+def test_janitor_stopped_on_close():
+    cache = CleanCache("test.db", janitor_interval=timedelta(milliseconds=10))
+    assert len(janitor_threads()) == 1
+    cache.close()
+    assert janitor_threads() == []
+
+
+def test_leases():
+    cache = CleanCache("test.db")
+    other = CleanCache("test.db")
+
+    token = cache.acquire_lease("key", timedelta(seconds=10))
+    assert token is not None
+    assert other.acquire_lease("key", timedelta(seconds=10)) is None
+    assert other.acquire_lease("other", timedelta(seconds=10)) is not None
+
+    # only the owner can release the lease
+    other.release_lease("key", "not-the-token")
+    assert other.acquire_lease("key", timedelta(seconds=10)) is None
+    cache.release_lease("key", token)
+    assert other.acquire_lease("key", timedelta(seconds=10)) is not None
+
+
+def test_expired_lease_can_be_acquired():
+    cache = CleanCache("test.db")
+    assert cache.acquire_lease("key", timedelta(seconds=-1)) is not None
+    assert cache.acquire_lease("key", timedelta(seconds=10)) is not None
+
+
+@pytest.mark.parametrize("memory_limit", [None, 1024])
+def test_cost_is_stored(memory_limit: int | None):
+    cache = CleanCache("test.db", memory_limit=memory_limit)
+    cache.set_one("key", CacheItem(value=b"123", cost=1.5))
+    assert cache.get_one("key") == CacheItem(value=b"123", cost=1.5)
+    assert cache.get_one("key") == CacheItem(value=b"123", cost=1.5)
+
+
+def expirations(cache: Storage) -> dict[str, timedelta]:
+    return {
+        key: expiration
+        for key, item in cache.get_many().items()
+        if (expiration := item.get("expiration")) is not None
+    }
+
+
+def test_default_expiration():
+    cache = CleanCache("test.db", default_expiration=timedelta(hours=1))
+    cache.set_one("default", CacheItem(value=b"123"))
+    cache.set_one("explicit", CacheItem(value=b"123", expiration=timedelta(minutes=1)))
+    with cache.open_writer("streamed", 3) as writer:
+        writer.write(b"123")
+
+    found = expirations(cache)
+    assert timedelta(minutes=59) < found["default"] <= timedelta(hours=1)
+    assert found["explicit"] <= timedelta(minutes=1)
+    assert timedelta(minutes=59) < found["streamed"] <= timedelta(hours=1)
+
+
+def test_expiration_jitter():
+    cache = CleanCache("test.db", default_expiration=timedelta(hours=1), expiration_jitter=0.5)
+    cache.set_many({f"key{i}": CacheItem(value=b"123") for i in range(20)})
+    found = set(expirations(cache).values())
+    assert len(found) > 1
+    assert all(timedelta(minutes=29) < e <= timedelta(hours=1) for e in found)
+
+
+@pytest.mark.parametrize("jitter", [-0.1, 1.1])
+def test_invalid_expiration_jitter(jitter: float):
+    with pytest.raises(ValueError, match="jitter"):
+        CleanCache("test.db", expiration_jitter=jitter)
+
+
+def test_eviction_with_tied_values():
+    cache = CleanCache("test.db", size_limit=10, eviction_policy="first-in-first-out")
+    # items written together share the same creation time
+    cache.set_many({f"key{i}": CacheItem(value=b"12") for i in range(5)})
+    cache.set_one("new", CacheItem(value=b"12"))
+    assert cache.get_keys() == {"key1", "key2", "key3", "key4", "new"}
+
+
+@pytest.mark.parametrize("memory_limit", [None, 1024])
+def test_stats(memory_limit: int | None):
+    cache = CleanCache("test.db", memory_limit=memory_limit)
+    cache.set_many({"a": CacheItem(value=b"123"), "b": CacheItem(value=b"45")})
+    cache.get_many(["a", "b", "c"])
+    cache.get_one("a")
+
+    stats = cache.stats()
+    assert stats["sets"] == 2
+    assert stats["bytes_written"] == 5
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+    assert stats["bytes_read"] == 8
+    assert stats["memory_hits"] == (0 if memory_limit is None else 3)
+
+    get_latency = stats["latencies"]["get_many"]
+    assert get_latency["count"] == 2
+    assert sum(get_latency["buckets"].values()) == 2
+    assert stats["latencies"]["set_many"]["count"] == 1
+
+
+def test_stats_evictions_and_expirations():
+    cache = CleanCache("test.db", size_limit=4)
+    cache.set_one("expired", CacheItem(value=b"1", expiration=timedelta(seconds=-1)))
+    cache.set_one("a", CacheItem(value=b"12"))
+    cache.set_one("b", CacheItem(value=b"12"))
+    cache.set_one("c", CacheItem(value=b"12"))
+
+    stats = cache.stats()
+    assert stats["expirations"] == 1
+    assert stats["evictions"] == 1
+    assert stats["expiry_sweeps"] >= 1
+
+
+def test_metrics_hook():
+    reported: list[tuple[str, float]] = []
+    cache = CleanCache("test.db", metrics_hook=lambda name, value: reported.append((name, value)))
+    cache.set_one("key", CacheItem(value=b"123"))
+    cache.get_one("key")
+
+    assert ("sets", 1) in reported
+    assert ("bytes_written", 3) in reported
+    assert ("hits", 1) in reported
+    assert ("misses", 0) not in reported
+    assert any(name == "get_many.seconds" for name, _ in reported)
+
+
+def test_statement_stats():
+    cache = CleanCache("test.db", trace_statements=True)
+    cache.statement_stats(reset=True)
+    cache.set_many({"a": CacheItem(value=b"1"), "b": CacheItem(value=b"2")})
+    cache.get_many(["a", "b"])
+    cache.get_many(["a"])
+
+    stats = cache.statement_stats()
+    (select,) = (stats[sql] for sql in stats if sql.startswith("SELECT key, value"))
+    assert select["count"] == 2
+    assert select["rows"] == 3
+    assert select["seconds"] >= select["max_seconds"] > 0
+    # statements that write report the rows they changed, including those of triggers
+    assert any(s["rows"] >= 2 for sql, s in stats.items() if sql.startswith("INSERT INTO cache"))
+
+    assert cache.statement_stats(reset=True)
+    assert cache.statement_stats() == {}
+
+
+def test_statement_stats_disabled():
+    cache = CleanCache("test.db")
+    cache.get_one("key")
+    assert cache.statement_stats() == {}
+
+
+def test_statement_stats_lock_wait(clean_caches_dir: Path):
+    cache = CleanCache("test.db", trace_statements=True)
+    other = sqlite3.connect(clean_caches_dir / "test.db", check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.2, other.commit).start()
+    cache.statement_stats(reset=True)
+    cache.set_one("key", CacheItem(value=b"1"))
+    other.close()
+
+    wait_seconds = sum(s["wait_seconds"] for s in cache.statement_stats().values())
+    assert wait_seconds >= 0.15
+
+
+def test_sharded_storage(clean_caches_dir: Path):
+    with ShardedStorage(clean_caches_dir / "sharded", shards=4) as cache:
+        items = {f"key{i}": CacheItem(value=str(i).encode()) for i in range(100)}
+        cache.set_many(items)
+
+        assert {k: v["value"] for k, v in cache.get_many(items).items()} == {
+            k: v["value"] for k, v in items.items()
+        }
+        assert cache.get_many().keys() == items.keys()
+        assert cache.get_keys() == set(items)
+        assert cache.get_keys(["key1", "missing"]) == {"key1"}
+        item = cache.get_one("key1")
+        assert item is not None
+        assert item["value"] == b"1"
+        assert cache.get_one("missing") is None
+
+        # every shard is used and keys are stored in the shard they're assigned to
+        for shard in cache.shards:
+            keys = shard.get_keys()
+            assert keys
+            assert all(cache.shard(k) is shard for k in keys)
+
+        assert cache.stats()["sets"] == 100
+
+
+def test_sharded_storage_splits_limits(clean_caches_dir: Path):
+    with ShardedStorage(
+        clean_caches_dir / "sharded", shards=4, size_limit=40, memory_limit=8
+    ) as cache:
+        cache.set_many({f"key{i}": CacheItem(value=b"12345") for i in range(100)})
+        for shard in cache.shards:
+            assert len(shard.get_keys()) <= 2
+        assert len(cache.get_keys()) <= 8
+
+
+def test_sharded_storage_streams_values(clean_caches_dir: Path):
+    with ShardedStorage(clean_caches_dir / "sharded", shards=2) as cache:
+        with cache.open_writer("key", 5) as writer:
+            writer.write(b"hello")
+        with cache.open_reader("key") as reader:
+            assert reader.read() == b"hello"
+        assert cache.shard("key").get_keys() == {"key"}
+
+
+def test_invalid_shard_count(clean_caches_dir: Path):
+    with pytest.raises(ValueError, match="at least 1"):
+        ShardedStorage(clean_caches_dir / "sharded", shards=0)
+
+
+def test_jump_hash_moves_few_keys():
+    keys = [f"key{i}" for i in range(1000)]
+    before = {k: jump_hash(k, 4) for k in keys}
+    after = {k: jump_hash(k, 5) for k in keys}
+    moved = [k for k in keys if before[k] != after[k]]
+    assert all(after[k] == 4 for k in moved)
+    assert 100 < len(moved) < 300
+
+
+def hold_write_lock(location: Path, seconds: float) -> None:
+    conn = sqlite3.connect(location, check_same_thread=False)
+    conn.execute("BEGIN IMMEDIATE")
+    threading.Timer(seconds, lambda: (conn.commit(), conn.close())).start()
+
+
+def test_write_retries_while_locked(clean_caches_dir: Path):
+    cache = CleanCache("test.db", busy_timeout=timedelta(milliseconds=10))
+    hold_write_lock(clean_caches_dir / "test.db", 0.3)
+    cache.set_one("key", CacheItem(value=b"1"))
+    assert cache.get_keys() == {"key"}
+
+    stats = cache.stats()
+    assert stats["busy_retries"] > 0
+    assert stats["latencies"]["begin_write"]["seconds"] >= 0.25
+
+
+def test_write_timeout(clean_caches_dir: Path):
+    cache = CleanCache(
+        "test.db",
+        busy_timeout=timedelta(milliseconds=10),
+        write_timeout=timedelta(milliseconds=100),
+    )
+    hold_write_lock(clean_caches_dir / "test.db", 0.5)
+    with pytest.raises(sqlite3.OperationalError, match="locked"):
+        cache.set_one("key", CacheItem(value=b"1"))
+
+
+def test_memory_hits_do_not_take_write_lock(clean_caches_dir: Path):
+    cache = CleanCache(
+        "test.db",
+        memory_limit=1024,
+        busy_timeout=timedelta(milliseconds=10),
+        write_timeout=timedelta(milliseconds=50),
+    )
+    item = CacheItem(value=b"123")
+    cache.set_one("key", item)
+    assert cache.get_one("key") == item
+
+    hold_write_lock(clean_caches_dir / "test.db", 0.5)
+    assert cache.get_one("key") == item
+    assert cache.stats()["busy_retries"] == 0
+
+
+def test_buffered_reads_do_not_take_write_lock(clean_caches_dir: Path):
+    cache = CleanCache(
+        "test.db",
+        access_flush_interval=timedelta(hours=1),
+        busy_timeout=timedelta(milliseconds=10),
+        write_timeout=timedelta(milliseconds=10),
+    )
+    cache.set_one("key", CacheItem(value=b"1"))
+    hold_write_lock(clean_caches_dir / "test.db", 0.3)
+    assert cache.get_one("key") is not None
+    assert cache.stats()["busy_retries"] == 0
+
+
+def test_write_behind():
+    with CleanCache("test.db", write_flush_interval=timedelta(hours=1)) as cache:
+        other = CleanCache("test.db")
+        cache.set_one("key", CacheItem(value=b"123"))
+
+        # visible to the writing storage right away but not yet written to the database
+        item = cache.get_one("key")
+        assert item is not None
+        assert item["value"] == b"123"
+        assert cache.get_keys() == {"key"}
+        assert cache.get_many().keys() == {"key"}
+        with cache.open_reader("key") as reader:
+            assert reader.read() == b"123"
+        assert other.get_one("key") is None
+
+        cache.flush()
+        item = other.get_one("key")
+        assert item is not None
+        assert item["value"] == b"123"
+
+
+def test_write_behind_flushes_in_background():
+    with CleanCache("test.db", write_flush_interval=timedelta(milliseconds=10)) as cache:
+        other = CleanCache("test.db")
+        cache.set_one("key", CacheItem(value=b"123"))
+        wait_for(lambda: other.get_one("key") is not None)
+
+
+@pytest.mark.parametrize(("flush_count", "flush_size"), [(3, 1024), (1000, 9)])
+def test_write_behind_flushes_when_full(flush_count: int, flush_size: int):
+    with CleanCache(
+        "test.db",
+        write_flush_interval=timedelta(hours=1),
+        write_flush_count=flush_count,
+        write_flush_size=flush_size,
+    ) as cache:
+        other = CleanCache("test.db")
+        cache.set_many({"a": CacheItem(value=b"123"), "b": CacheItem(value=b"123")})
+        time.sleep(0.05)
+        assert other.get_keys() == set()
+        cache.set_one("c", CacheItem(value=b"123"))
+        wait_for(lambda: other.get_keys() == {"a", "b", "c"})
+
+
+def test_memory_tier_skips_items_replaced_while_loading(monkeypatch: pytest.MonkeyPatch):
+    cache = CleanCache("test.db", memory_limit=1024)
+    CleanCache("test.db").set_one("key", CacheItem(value=b"old"))
+
+    loaded, replaced = threading.Event(), threading.Event()
+    set_many = MemoryCache.set_many
+
+    def set_many_after_replaced(self: MemoryCache, *args, **kwargs) -> None:
+        if threading.current_thread() is reader:
+            loaded.set()
+            replaced.wait()
+        set_many(self, *args, **kwargs)
+
+    monkeypatch.setattr(MemoryCache, "set_many", set_many_after_replaced)
+    reader = Thread(target=cache.get_one, args=("key",))
+    reader.start()
+    # the reader has loaded the old item but hasn't added it to memory yet
+    loaded.wait()
+    cache.set_one("key", CacheItem(value=b"new"))
+    replaced.set()
+    reader.join()
+
+    item = cache.get_one("key")
+    assert item is not None
+    assert item["value"] == b"new"
+
+
+def test_write_behind_flushed_on_close():
+    cache = CleanCache("test.db", write_flush_interval=timedelta(hours=1))
+    cache.set_one("key", CacheItem(value=b"123"))
+    cache.close()
+    assert CleanCache("test.db").get_keys() == {"key"}
+
+
+def test_write_behind_expiration():
+    with CleanCache("test.db", write_flush_interval=timedelta(hours=1)) as cache:
+        cache.set_one("key", CacheItem(value=b"old"))
+        cache.flush()
+        cache.set_one("key", CacheItem(value=b"new", expiration=timedelta(milliseconds=10)))
+        time.sleep(0.02)
+        # the expired queued item hides the older one in the database
+        assert cache.get_one("key") is None
+        assert cache.get_keys() == set()
+        cache.flush()
+        assert cache.get_one("key") is None
+
+
+def test_write_behind_stream_replaces_queued_item():
+    with CleanCache("test.db", write_flush_interval=timedelta(hours=1)) as cache:
+        cache.set_one("key", CacheItem(value=b"old"))
+        with cache.open_writer("key", 3) as writer:
+            writer.write(b"new")
+        cache.flush()
+        item = cache.get_one("key")
+        assert item is not None
+        assert item["value"] == b"new"
+
+
+def test_snapshot(clean_caches_dir: Path):
+    cache = CleanCache("test.db", external_threshold=100)
+    items = {
+        "small": CacheItem(value=b"123", cost=0.5),
+        "large": CacheItem(value=b"x" * 200),
+    }
+    cache.set_many(items)
+
+    cache.snapshot(clean_caches_dir / "snapshot.db")
+    cache.set_one("small", CacheItem(value=b"456"))
+
+    copy = CleanCache("snapshot.db", external_threshold=100)
+    assert copy.get_many(items.keys()) == items
+    # the copy has its own external files
+    cache.set_one("large", CacheItem(value=b"y" * 200))
+    assert copy.get_one("large") == items["large"]
+
+
+def test_snapshot_while_another_connection_writes(clean_caches_dir: Path):
+    cache = CleanCache("test.db")
+    # large enough that a backup made in steps would take several of them
+    items = {f"key{i}": CacheItem(value=os.urandom(1024)) for i in range(8000)}
+    cache.set_many(items)
+
+    other = CleanCache("test.db")
+    stop = threading.Event()
+
+    def read() -> None:
+        # reads write access statistics
+        while not stop.is_set():
+            other.get_one("key0")
+
+    reader = Thread(target=read)
+    snapshot = Thread(target=cache.snapshot, args=(clean_caches_dir / "snapshot.db",))
+    reader.start()
+    try:
+        snapshot.start()
+        snapshot.join(timeout=10)
+        assert not snapshot.is_alive()
+    finally:
+        stop.set()
+        reader.join()
+        snapshot.join()
+
+    copy = CleanCache("snapshot.db")
+    assert copy.get_many(items.keys()) == items
+
+
+def test_export_and_warm_from():
+    cache = CleanCache("test.db", external_threshold=100)
+    items = {
+        "key1": CacheItem(value=b"123", cost=0.5),
+        "key2": CacheItem(value=b"x" * 200),
+        "key3": CacheItem(value=b"", expiration=timedelta(hours=1)),
+    }
+    cache.set_many(items)
+
+    file = BytesIO()
+    assert cache.export(file) == 3
+
+    file.seek(0)
+    other = CleanCache("other.db")
+    other.set_one("key1", CacheItem(value=b"old"))
+    assert other.warm_from(file) == 3
+
+    loaded = other.get_many(items.keys())
+    assert loaded.keys() == items.keys()
+    assert loaded["key1"] == items["key1"]
+    assert loaded["key2"] == items["key2"]
+    expiration = loaded["key3"].get("expiration")
+    assert expiration is not None
+    assert timedelta(minutes=59) < expiration < timedelta(hours=1)
+    assert other.stats()["sets"] == 4
+
+
+def test_export_filters_by_prefix_and_hotness(clean_caches_dir: Path):
+    cache = CleanCache("test.db")
+    cache.set_many({key: CacheItem(value=b"123") for key in ["a1", "a2", "a3", "b1"]})
+    for _ in range(3):
+        cache.get_many(["a3", "b1"])
+    cache.get_one("a2")
+
+    path = clean_caches_dir / "export.bin"
+    assert cache.export(path, prefix="a", hottest=2) == 2
+
+    other = CleanCache("other.db")
+    assert other.warm_from(path) == 2
+    assert other.get_keys() == {"a2", "a3"}
+
+
+def test_warm_from_keeps_most_accessed_items():
+    cache = CleanCache("test.db")
+    cache.set_many({f"key{i}": CacheItem(value=b"123") for i in range(4)})
+    for i in range(4):
+        for _ in range(i):
+            cache.get_one(f"key{i}")
+
+    file = BytesIO()
+    cache.export(file)
+
+    file.seek(0)
+    other = CleanCache("other.db", size_limit=6)
+    assert other.warm_from(file) == 4
+    assert other.get_keys() == {"key2", "key3"}
+    assert other.stats()["evictions"] == 2
+
+
+def test_warm_from_while_writer_is_flushing(clean_caches_dir: Path):
+    file = BytesIO()
+    CleanCache("other.db").set_one("key", CacheItem(value=b"new"))
+    CleanCache("other.db").export(file)
+    file.seek(0)
+
+    with CleanCache(
+        "test.db",
+        write_flush_interval=timedelta(milliseconds=10),
+        busy_timeout=timedelta(milliseconds=10),
+        write_timeout=timedelta(seconds=2),
+    ) as cache:
+        lock = sqlite3.connect(clean_caches_dir / "test.db", check_same_thread=False)
+        lock.execute("BEGIN IMMEDIATE")
+        cache.set_one("key", CacheItem(value=b"old"))
+        # the background writer takes the queued item and waits for the write lock
+        time.sleep(0.3)
+        start = time.monotonic()
+        warm = Thread(target=cache.warm_from, args=(file,))
+        warm.start()
+        time.sleep(0.05)
+        lock.commit()
+        lock.close()
+        warm.join()
+        # neither waits for the other until its write timeout
+        assert time.monotonic() - start < 1
+        item = cache.get_one("key")
+        assert item is not None
+        assert item["value"] == b"new"
+
+
+@pytest.mark.parametrize("data", [b"not an export", b"backlite-export\x01\x01\x00"])
+def test_warm_from_invalid_export(data: bytes):
+    cache = CleanCache("test.db")
+    with pytest.raises(ValueError, match="export"):
+        cache.warm_from(BytesIO(data))
+    assert cache.get_keys() == set()